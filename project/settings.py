@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -20,6 +21,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'splitter.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -27,6 +29,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'splitter.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'project.urls'
@@ -48,11 +51,26 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'project.wsgi.application'
+ASGI_APPLICATION = 'project.asgi.application'
 
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open between requests instead of reconnecting
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Seconds a write waits for the lock before "database is locked"
+            'timeout': 20,
+            # Take the write lock when a transaction starts; upgrading a read
+            # lock later fails at once instead of waiting for the timeout
+            # (needs Django 5.1, see requirements.txt)
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Tests use a file too: in-memory databases have neither WAL nor the
+        # write queue (see splitter.writer)
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -69,3 +87,97 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = '/api/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
+
+# Expenses written per transaction by the bulk import endpoint
+EXPENSE_IMPORT_CHUNK_SIZE = 1000
+# Expenses fetched (with their lines) per round trip by the CSV/JSONL export
+EXPORT_CHUNK_SIZE = 2000
+
+# Rendered report PDFs, keyed by group id and change-version
+PDF_CACHE_DIR = BASE_DIR / 'pdf_cache'
+PDF_RENDER_WORKERS = 2
+# Expense history rows per table (about one page); also the DB fetch size
+PDF_EXPENSE_ROWS_PER_TABLE = 40
+# Inline (date-range) PDFs are kept in memory up to this size, then spilled to disk
+PDF_SPOOL_MAX_MEMORY = 5 * 1024 * 1024
+# Processes rendering the ZIP of many reports (render_reports, POST
+# /api/reports/pdf/batch/ and the group admin action); see splitter.pdf_batch
+PDF_BATCH_WORKERS = os.cpu_count() or 2
+
+# Cached report/member payloads are keyed by group change-version, so this
+# only bounds how long entries of old versions linger
+GROUP_RESPONSE_CACHE_TIMEOUT = 3600
+
+# Server-sent group events (/api/groups/<id>/events/). A stream is closed
+# after GROUP_EVENTS_MAX_DURATION seconds and the browser reconnects; under
+# WSGI, which buffers the response, each request waits for at most one
+# change (up to GROUP_EVENTS_LONG_POLL seconds) instead
+GROUP_EVENTS_MAX_DURATION = 300
+GROUP_EVENTS_LONG_POLL = 25
+GROUP_EVENTS_HEARTBEAT = 15
+GROUP_EVENTS_RETRY_MS = 2000
+# Pending events per watcher before a slow one is cut off to resync
+GROUP_EVENTS_QUEUE_SIZE = 100
+
+# Request metrics (/api/metrics). Requests slower than this many seconds are
+# logged to "splitter.slow_requests" with their slowest SQL; None disables
+# the log and the per-request SQL capture it needs
+METRICS_SLOW_REQUEST_SECONDS = None
+METRICS_SLOW_SQL_LIMIT = 20
+
+# POST /api/reports/batch/: groups loaded and solved per pass, and the size of
+# the process pool used for the settlement step when "parallel" is requested
+REPORT_BATCH_CHUNK_SIZE = 500
+REPORT_BATCH_WORKERS = 4
+
+# POST /api/groups/<id>/members/bulk/: people accepted per request
+GROUP_MEMBERS_BULK_MAX = 1000
+
+# SQLite under concurrent load: pragmas run on every new connection (see
+# splitter.sqlite), and writes of the expense, member and user creation
+# endpoints go through one writer thread per process that commits up to
+# SQLITE_WRITE_BATCH_SIZE queued writes together (see splitter.writer)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    'cache_size': -20000,  # KiB
+    'mmap_size': 128 * 1024 * 1024,
+}
+SQLITE_WRITE_QUEUE = True
+SQLITE_WRITE_BATCH_SIZE = 50
+
+# Threads that async views hand CPU-heavy work to (settlement solving, PDF
+# building), so it never runs on the event loop; see splitter.offload
+ASYNC_CPU_WORKERS = 4
+
+# Per-process LRU of compact group state (members, net balances) behind the
+# report and member list endpoints; see splitter.group_cache. Those check the
+# group's version on every request, so other processes' writes show up at
+# once there and after GROUP_STATE_CACHE_TTL seconds elsewhere. With
+# several workers use 'splitter.group_cache.SharedBackend', which keeps the
+# states in the GROUP_STATE_CACHE_ALIAS cache (e.g. Redis or memcached)
+GROUP_STATE_CACHE_BACKEND = 'splitter.group_cache.LocalBackend'
+GROUP_STATE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+GROUP_STATE_CACHE_TTL = 300
+GROUP_STATE_CACHE_ALIAS = 'default'
+
+# The optimal settlement solver falls back to greedy beyond this many open
+# balances, or when its search uses more than this many seconds. The budget
+# is measured with time.process_time, i.e. CPU time of the whole process,
+# not wall time
+SETTLEMENT_SOLVER_MAX_PARTIES = 18
+SETTLEMENT_SOLVER_BUDGET = 0.2
+
+# Stored settlement plans (see splitter.plans): transfers an incrementally
+# updated plan may have beyond a fresh solve before it is rebuilt, and how
+# many group versions of removed transfers are kept for ?since= diffs
+SETTLEMENT_PLAN_MAX_EXTRA_TRANSFERS = 2
+SETTLEMENT_PLAN_HISTORY = 1000
+
+# Opt-in request profiling for staff (see splitter.profiling): how many
+# profiles each process keeps, how long a profile_token is valid, and
+# seconds between stack samples
+PROFILE_HISTORY = 20
+PROFILE_TOKEN_MAX_AGE = 12 * 60 * 60
+PROFILE_SAMPLE_INTERVAL = 0.001
@@ -1,6 +1,17 @@
 from django.contrib import admin
-from .models import Group, GroupMember, Expense
+from .models import Group, GroupMember, Expense, MemberBalance
+from . import pdf_batch
+
+
+@admin.register(Group)
+class GroupAdmin(admin.ModelAdmin):
+    actions = ['download_report_pdfs']
+
+    @admin.action(description='Download settlement PDFs (ZIP)')
+    def download_report_pdfs(self, request, queryset):
+        return pdf_batch.zip_response(list(queryset.order_by('id').values_list('id', flat=True)))
+
 
-admin.site.register(Group)
 admin.site.register(GroupMember)
 admin.site.register(Expense)
+admin.site.register(MemberBalance)
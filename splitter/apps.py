@@ -3,3 +3,9 @@ from django.apps import AppConfig
 class SplitterConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'splitter'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import signals, group_cache, events, metrics, sqlite  # noqa: F401
+        connection_created.connect(sqlite.configure)
+        connection_created.connect(metrics.install)
@@ -0,0 +1,131 @@
+"""Settlement reports of many groups in one request.
+
+Groups are processed in chunks of ``REPORT_BATCH_CHUNK_SIZE``. Each chunk
+costs three set-based queries (groups, memberships, ledger rows), one
+``engine.batch_reports`` pass for the balances and two queries for the
+groups' stored settlement plans (``plans.current_many``), and its reports
+are yielded before the next chunk is loaded, so a batch of any size streams
+in bounded memory. Groups whose plan is out of date are solved again; that
+step can optionally be fanned out to a process pool.
+"""
+import itertools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.utils.dateparse import parse_date
+
+from .models import Group, GroupMember
+from . import engine, group_cache, plans
+
+# Accepted keys of a batch ``filter`` and the lookups they map to
+FILTERS = {
+    'name': 'name__icontains',
+    'created_by': 'created_by_id',
+    'member': 'members__user_id',
+    'created_after': 'created_at__date__gte',
+    'created_before': 'created_at__date__lte',
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # "spawn" rather than fork: a forked worker would share the parent's
+            # SQLite handles and any threads it had running (see pdf_batch).
+            # Workers only run settlement.solve_many, which needs the settings
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.REPORT_BATCH_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+            )
+        return _pool
+
+
+def _filter_value(key, value):
+    if key in ('created_by', 'member'):
+        return int(value)
+    if key in ('created_after', 'created_before'):
+        day = parse_date(str(value))
+        if day is None:
+            raise ValueError(f'{key} must be a date in YYYY-MM-DD format')
+        return day
+    return str(value)
+
+
+def filtered_group_ids(filters):
+    """Ids of the groups matching a batch ``filter`` dict, in id order.
+
+    Raises ``ValueError`` for unknown keys or malformed values.
+    """
+    unknown = set(filters) - set(FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown filter(s): {', '.join(sorted(unknown))}")
+    lookups = {FILTERS[key]: _filter_value(key, value) for key, value in filters.items()}
+    queryset = Group.objects.filter(**lookups).distinct().order_by('id')
+    return queryset.values_list('id', flat=True).iterator(chunk_size=settings.REPORT_BATCH_CHUNK_SIZE)
+
+
+def iter_reports(group_ids, solver, parallel=False):
+    """Yield one report dict per id of ``group_ids`` (any iterable)."""
+    executor = get_pool() if parallel else None
+    group_ids = iter(group_ids)
+    while True:
+        chunk = list(itertools.islice(group_ids, settings.REPORT_BATCH_CHUNK_SIZE))
+        if not chunk:
+            return
+        yield from _chunk_reports(chunk, solver, executor)
+
+
+def _chunk_reports(chunk, solver, executor):
+    groups = {
+        group_id: (name, version)
+        for group_id, name, version in
+        Group.objects.filter(id__in=chunk).values_list('id', 'name', 'version')
+    }
+    members_by_group = {group_id: [] for group_id in groups}
+    usernames = {}
+    rows = (
+        GroupMember.objects.filter(group_id__in=groups).order_by('group_id', 'id')
+        .values_list('group_id', 'user_id', 'user__username')
+    )
+    for group_id, user_id, username in rows:
+        members_by_group[group_id].append(user_id)
+        usernames[user_id] = username
+
+    results = engine.batch_reports(members_by_group, solver=None)
+    states = {
+        group_id: group_cache.GroupState(
+            group_id, *groups[group_id],
+            [(user_id, usernames[user_id], '') for user_id in members_by_group[group_id]],
+            result.net_by_user()
+        )
+        for group_id, result in results.items()
+    }
+    group_plans = plans.current_many(states.values(), solver, executor)
+
+    for group_id in chunk:
+        if group_id not in groups:
+            yield {'group_id': group_id, 'error': 'Group not found'}
+            continue
+        state = states[group_id]
+        settlements, used = group_plans[group_id]
+        yield {
+            'group_id': group_id,
+            'group': state.name,
+            'version': state.version,
+            'members': [
+                {'id': user_id, 'username': username, 'balance': net / 100}
+                for user_id, username, _, net in state.members()
+            ],
+            'settlements': [
+                {'from_user': debtor, 'to_user': creditor, 'amount': cents / 100}
+                for debtor, creditor, cents in settlements
+            ],
+            'solver': used,
+        }
@@ -0,0 +1,227 @@
+"""Balance and settlement engine.
+
+All money is handled as integer cents in flat NumPy arrays. Balances are
+summed with ``np.bincount`` over (group, member) slots, so one call can
+serve a single group or a whole batch of groups with the same few queries.
+Every report and export should go through ``group_report`` or
+``batch_reports`` (or their async twins) rather than summing payments and
+splits itself.
+"""
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import BigIntegerField, F, Sum, Value
+from django.db.models.functions import Cast, Round
+
+from .models import DailyBalance, MemberBalance, ExpensePayment, ExpenseSplit
+from .settlement import DEFAULT_SOLVER, solve, solve_many
+from . import offload
+
+# Multiplier used to pack (group_id, user_id) into one int64 key
+_KEY_SPAN = 1 << 32
+
+
+def to_cents(amount):
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+def cents_column(field):
+    """SQL expression of a decimal money column as integer cents."""
+    return Cast(Round(F(field) * 100), BigIntegerField())
+
+
+class GroupResult:
+    """Balances and settlement plan of one group, in integer cents."""
+
+    __slots__ = ('group_id', 'user_ids', 'paid', 'owed', 'net', 'settlements', 'solver')
+
+    def __init__(self, group_id, user_ids, paid, owed):
+        self.group_id = group_id
+        self.user_ids = user_ids
+        self.paid = paid
+        self.owed = owed
+        self.net = paid - owed
+        self.settlements = []
+        self.solver = None
+
+    def net_by_user(self):
+        return dict(zip(self.user_ids.tolist(), self.net.tolist()))
+
+    def settlements_display(self):
+        return [
+            {'from_user': debtor, 'to_user': creditor, 'amount': cents / 100}
+            for debtor, creditor, cents in self.settlements
+        ]
+
+
+def _slots(members_by_group):
+    """Flatten ``{group_id: [user_id, ...]}`` into sorted int64 slot keys."""
+    group_col = []
+    user_col = []
+    for group_id, user_ids in members_by_group.items():
+        group_col.extend([group_id] * len(user_ids))
+        user_col.extend(user_ids)
+    groups = np.asarray(group_col, dtype=np.int64)
+    users = np.asarray(user_col, dtype=np.int64)
+    keys = groups * _KEY_SPAN + users
+    order = np.argsort(keys, kind='stable')
+    return keys[order], order, users
+
+
+def _sum_into_slots(slot_keys, rows):
+    """Sum ``(group_id, user_id, cents)`` rows into their member slots.
+
+    Rows whose user is not (or no longer) a member of the group are dropped.
+    """
+    totals = np.zeros(len(slot_keys), dtype=np.int64)
+    if not len(rows) or not len(slot_keys):
+        return totals
+    data = np.asarray(rows, dtype=np.int64).reshape(-1, 3)
+    keys = data[:, 0] * _KEY_SPAN + data[:, 1]
+    idx = np.searchsorted(slot_keys, keys)
+    idx[idx == len(slot_keys)] = 0
+    known = slot_keys[idx] == keys
+    # bincount sums in float64, which is exact for cent totals below 2**53
+    sums = np.bincount(idx[known], weights=data[known, 2], minlength=len(slot_keys))
+    totals += np.rint(sums).astype(np.int64)
+    return totals
+
+
+def balance_rows(group_ids, source='ledger', period=None):
+    """Query of ``(group_id, user_id, paid_cents, owed_cents)`` rows.
+
+    ``source`` picks where balances come from: the running ``ledger``, the
+    daily ``rollups`` or the raw expense ``lines``; the latter two can be
+    limited to a ``period``, an optional ``(start, end)`` pair of dates
+    (inclusive, either may be None). Rollups are read as one row per
+    (member, day with activity), so their cost depends on the number of
+    days rather than the number of expenses. The query is lazy, so it can
+    be evaluated with ``list()`` or ``async for``.
+    """
+    if source == 'ledger':
+        if period is not None:
+            raise ValueError('The ledger only holds all-time balances')
+        return (
+            MemberBalance.objects.filter(group_id__in=group_ids)
+            .values_list('group_id', 'user_id', cents_column('paid'), cents_column('owed'))
+        )
+    if source == 'rollups':
+        return (
+            DailyBalance.objects.filter(group_id__in=group_ids, **_period_filters('day', period))
+            .values_list('group_id', 'user_id')
+            .annotate(paid=Sum(cents_column('paid')), owed=Sum(cents_column('owed')))
+            .order_by()
+        )
+    if source == 'lines':
+        filters = {'expense__group_id__in': group_ids, **_period_filters('expense__created_at__date', period)}
+        payments = (
+            ExpensePayment.objects.filter(**filters)
+            .values_list('expense__group_id', 'payer_id', cents_column('amount'), Value(0))
+            .order_by()
+        )
+        splits = (
+            ExpenseSplit.objects.filter(**filters)
+            .values_list('expense__group_id', 'member_id', Value(0), cents_column('share'))
+            .order_by()
+        )
+        return payments.union(splits, all=True)
+    raise ValueError(f'Unknown balance source: {source}')
+
+
+def _period_filters(field, period):
+    if period is None:
+        return {}
+    start, end = period
+    filters = {}
+    if start is not None:
+        filters[f'{field}__gte'] = start
+    if end is not None:
+        filters[f'{field}__lte'] = end
+    return filters
+
+
+def batch_reports(members_by_group, source='ledger', solver=DEFAULT_SOLVER, period=None,
+                  executor=None):
+    """Compute balances and settlements for many groups at once.
+
+    ``members_by_group`` maps each group id to its member user ids, in the
+    order they should be reported. ``source`` and ``period`` select the
+    balances as in ``balance_rows``. ``solver`` names the settlement
+    solver (see ``splitter.settlement``), or None for balances only. With
+    an ``executor`` (e.g. a process pool) the settlement step is fanned out
+    to it in chunks.
+    """
+    rows = list(balance_rows(list(members_by_group), source, period))
+    return compute_reports(members_by_group, rows, solver, executor)
+
+
+async def abatch_reports(members_by_group, source='ledger', solver=DEFAULT_SOLVER, period=None):
+    """``batch_reports`` for async views.
+
+    The rows are read with the async ORM, and the summing and settlement
+    run on the ``offload`` pool rather than the event loop.
+    """
+    rows = [row async for row in balance_rows(list(members_by_group), source, period)]
+    return await offload.run(compute_reports, members_by_group, rows, solver)
+
+
+def compute_reports(members_by_group, rows, solver=DEFAULT_SOLVER, executor=None):
+    """Turn ``balance_rows`` output into a ``GroupResult`` per group."""
+    paid_rows = [(g, u, paid) for g, u, paid, _ in rows]
+    owed_rows = [(g, u, owed) for g, u, _, owed in rows]
+
+    slot_keys, order, users = _slots(members_by_group)
+    paid_sorted = _sum_into_slots(slot_keys, paid_rows)
+    owed_sorted = _sum_into_slots(slot_keys, owed_rows)
+
+    # Put the sums back into the caller's member order
+    paid = np.empty_like(paid_sorted)
+    owed = np.empty_like(owed_sorted)
+    paid[order] = paid_sorted
+    owed[order] = owed_sorted
+
+    results = {}
+    start = 0
+    for group_id, user_ids in members_by_group.items():
+        end = start + len(user_ids)
+        results[group_id] = GroupResult(group_id, users[start:end], paid[start:end], owed[start:end])
+        start = end
+
+    if solver is None:
+        return results
+    tasks = [(r.group_id, r.user_ids, r.net) for r in results.values()]
+    for group_id, (settlements, used) in solve_all(tasks, solver, executor).items():
+        results[group_id].settlements, results[group_id].solver = settlements, used
+    return results
+
+
+def solve_all(tasks, solver=DEFAULT_SOLVER, executor=None):
+    """``{group_id: (settlements, solver used)}`` of ``(group_id, user_ids, net)`` tasks.
+
+    With an ``executor`` the tasks are fanned out to it in chunks.
+    """
+    if executor is None:
+        return {group_id: solve(user_ids, net, solver) for group_id, user_ids, net in tasks}
+    solved = {}
+    chunks = [tasks[i:i + SOLVE_CHUNK_SIZE] for i in range(0, len(tasks), SOLVE_CHUNK_SIZE)]
+    for chunk in executor.map(solve_many, chunks, [solver] * len(chunks)):
+        for group_id, settlements, used in chunk:
+            solved[group_id] = settlements, used
+    return solved
+
+
+# Groups per task handed to an executor; amortises the pickling round trip
+SOLVE_CHUNK_SIZE = 64
+
+
+def group_report(group_id, member_ids, source='ledger', solver=DEFAULT_SOLVER, period=None):
+    return batch_reports(
+        {group_id: list(member_ids)}, source=source, solver=solver, period=period
+    )[group_id]
+
+
+async def agroup_report(group_id, member_ids, source='ledger', solver=DEFAULT_SOLVER, period=None):
+    results = await abatch_reports(
+        {group_id: list(member_ids)}, source=source, solver=solver, period=period
+    )
+    return results[group_id]
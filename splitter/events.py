@@ -0,0 +1,282 @@
+"""Server-sent balance updates for open group pages.
+
+Every change to a group's expenses or members ends in ``group_changed``.
+While anyone is watching that group, the new balances and stored
+settlement plan are read once (through ``group_cache``) and only what moved
+since the last update is fanned out to the watchers through an in-process
+hub, so N open pages cost one read instead of N full report recomputations.
+
+The hub is looked up with ``get_hub()`` on every use; ``set_hub()`` swaps
+in another implementation (a stand-in in tests, or a cross-process one).
+"""
+import asyncio
+import json
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+from .settlement import DEFAULT_SOLVER
+from .signals import group_changed
+from . import group_cache
+
+logger = logging.getLogger('splitter.events')
+
+
+class Subscription:
+    """One watcher's queue of events, owned by its event loop."""
+
+    def __init__(self, group_id, loop, maxsize):
+        self.group_id = group_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def _deliver(self, event):
+        # Runs on the subscriber's loop. A watcher too slow to keep up is
+        # cut off; it reconnects and starts again from a fresh snapshot.
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout):
+        """Next event, ``None`` if the subscription was dropped.
+
+        Raises ``asyncio.TimeoutError`` when nothing arrives within ``timeout``.
+        """
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class LocalHub:
+    """Publish/subscribe between threads of this process.
+
+    ``publish`` may be called from any thread; events are handed to each
+    subscriber's event loop with ``call_soon_threadsafe``.
+    """
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or settings.GROUP_EVENTS_QUEUE_SIZE
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, group_id):
+        sub = Subscription(group_id, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(group_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.group_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.group_id]
+
+    def has_subscribers(self, group_id):
+        with self._lock:
+            return bool(self._subscribers.get(group_id))
+
+    def publish(self, group_id, event):
+        with self._lock:
+            subs = list(self._subscribers.get(group_id, ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._deliver, event)
+            except RuntimeError:
+                # The subscriber's loop has already shut down
+                self.unsubscribe(sub)
+
+
+_hub = LocalHub()
+
+
+def get_hub():
+    return _hub
+
+
+def set_hub(hub):
+    """Replace the process-wide hub; returns the previous one."""
+    global _hub
+    previous, _hub = _hub, hub
+    return previous
+
+
+def group_state(group_id):
+    """Current version, members, balances and stored settlement plan of a group.
+
+    Read through ``group_cache``, so it is the plan the report shows.
+    """
+    state = group_cache.get_state(group_id)
+    if state is None:
+        return None
+    settlements, _ = state.plan(DEFAULT_SOLVER)
+    return {
+        'version': state.version,
+        'names': dict(zip(state.user_ids, state.usernames)),
+        'net': dict(zip(state.user_ids, state.net)),
+        'settlements': [
+            {'from_user': debtor, 'to_user': creditor, 'amount': cents / 100}
+            for debtor, creditor, cents in settlements
+        ],
+    }
+
+
+def snapshot_event(state):
+    return {
+        'version': state['version'],
+        'members': [
+            {'id': uid, 'username': name, 'balance': state['net'][uid] / 100}
+            for uid, name in state['names'].items()
+        ],
+        'settlements': state['settlements'],
+    }
+
+
+def delta_event(previous, state):
+    """What changed between two states: new members, removed members,
+    members whose balance moved, and the (small) settlement plan."""
+    old_net = previous['net'] if previous else {}
+    return {
+        'version': state['version'],
+        'members': [
+            {'id': uid, 'username': name}
+            for uid, name in state['names'].items() if uid not in old_net
+        ],
+        'removed': [uid for uid in old_net if uid not in state['net']],
+        'balances': {
+            str(uid): cents / 100
+            for uid, cents in state['net'].items() if old_net.get(uid) != cents
+        },
+        'settlements': state['settlements'],
+    }
+
+
+class Publisher:
+    """Builds and fans out the deltas of changed groups on its own thread.
+
+    ``group_changed`` is sent after commit on whichever thread wrote, often
+    the write queue's, so the receiver only queues the group id here.
+    Changes queued while a group's delta is being built are merged into
+    one. The last state published per group is the base of its next delta.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._queued = {}
+        self._thread = None
+        self._published = {}
+
+    def submit(self, group_id):
+        with self._lock:
+            self._queued[group_id] = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='splitter-events', daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def forget(self, group_id):
+        # Nobody watching; the next watcher starts from a snapshot
+        with self._lock:
+            self._queued.pop(group_id, None)
+            self._published.pop(group_id, None)
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                while not self._queued:
+                    self._wake.wait()
+                group_ids = list(self._queued)
+                self._queued.clear()
+            try:
+                for group_id in group_ids:
+                    try:
+                        self._publish(group_id)
+                    except Exception:
+                        logger.exception('Publishing the changes of group %s failed', group_id)
+            finally:
+                # This thread outlives requests, so expire its connection like one
+                close_old_connections()
+
+    def _publish(self, group_id):
+        hub = get_hub()
+        if not hub.has_subscribers(group_id):
+            self.forget(group_id)
+            return
+        state = group_state(group_id)
+        with self._lock:
+            previous = self._published.get(group_id)
+            if state is None or (previous and state['version'] <= previous['version']):
+                return
+            self._published[group_id] = state
+        hub.publish(group_id, delta_event(previous, state))
+
+
+_publisher = Publisher()
+
+
+@receiver(group_changed)
+def publish_group_change(sender, group_id, **kwargs):
+    if get_hub().has_subscribers(group_id):
+        _publisher.submit(group_id)
+    else:
+        _publisher.forget(group_id)
+
+
+def format_event(kind, data):
+    return f"id: {data['version']}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream(group_id, last_version=None, duration=None, once=False):
+    """Server-sent events for one watcher of a group.
+
+    Starts with a ``snapshot`` unless the client already holds the current
+    version (``Last-Event-ID``), then sends a ``delta`` per change until
+    ``duration`` seconds have passed. With ``once`` the stream ends after
+    the first thing it sends, for servers that buffer the whole response.
+    """
+    hub = get_hub()
+    loop = asyncio.get_running_loop()
+    duration = duration or settings.GROUP_EVENTS_MAX_DURATION
+    heartbeat = settings.GROUP_EVENTS_HEARTBEAT
+    deadline = loop.time() + duration
+
+    # Subscribe before reading the snapshot so no change can fall between
+    sub = hub.subscribe(group_id)
+    try:
+        yield f'retry: {settings.GROUP_EVENTS_RETRY_MS}\n\n'
+        state = await sync_to_async(group_state)(group_id)
+        if state is None:
+            return
+        version = state['version']
+        if version != last_version:
+            yield format_event('snapshot', snapshot_event(state))
+            if once:
+                return
+
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                event = await sub.get(min(heartbeat, remaining))
+            except asyncio.TimeoutError:
+                if not once:
+                    yield ': keep-alive\n\n'
+                continue
+            if event is None:
+                return
+            if event['version'] <= version:
+                continue
+            version = event['version']
+            yield format_event('delta', event)
+            if once:
+                return
+    finally:
+        hub.unsubscribe(sub)
@@ -0,0 +1,63 @@
+"""Streaming CSV / JSON Lines export of a group's expense history.
+
+One output line is emitted per payment or split. Expenses are walked with
+a chunked server-side iterator and their lines are prefetched per chunk,
+so memory stays flat however large the group is. The CSV columns are a
+superset of what the bulk importer reads, so an export can be imported
+into another group as-is.
+"""
+import csv
+import json
+
+from django.conf import settings
+from django.db.models import Prefetch
+
+from .models import Expense, ExpensePayment, ExpenseSplit
+
+FIELDS = ['expense', 'created_at', 'description', 'kind', 'user', 'username', 'amount']
+
+
+class _Echo:
+    """File-like object whose ``write`` returns the value, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def export_lines(group, chunk_size=None):
+    """Yield one row (a list in ``FIELDS`` order) per payment and split."""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    expenses = (
+        Expense.objects.filter(group=group)
+        .order_by('created_at', 'id')
+        .prefetch_related(
+            Prefetch('payments', queryset=ExpensePayment.objects.select_related('payer').order_by('id')),
+            Prefetch('splits', queryset=ExpenseSplit.objects.select_related('member').order_by('id')),
+        )
+    )
+    for exp in expenses.iterator(chunk_size=chunk_size):
+        created_at = exp.created_at.isoformat()
+        for payment in exp.payments.all():
+            yield [exp.id, created_at, exp.description, 'payment',
+                   payment.payer_id, payment.payer.username, str(payment.amount)]
+        for split in exp.splits.all():
+            yield [exp.id, created_at, exp.description, 'split',
+                   split.member_id, split.member.username, str(split.share)]
+
+
+def csv_stream(group):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in export_lines(group):
+        yield writer.writerow(row)
+
+
+def jsonl_stream(group):
+    for row in export_lines(group):
+        yield json.dumps(dict(zip(FIELDS, row))) + '\n'
+
+
+FORMATS = {
+    'csv': (csv_stream, 'text/csv'),
+    'jsonl': (jsonl_stream, 'application/x-ndjson'),
+}
@@ -0,0 +1,391 @@
+"""Cache of compact per-group state for the hottest reads.
+
+The report and member list of a group only need its name, version,
+members, net balances and settlement plan: a few hundred bytes, rebuilt
+from three queries (plus two for the stored plan, see ``splitter.plans``).
+``get_state`` keeps them in ``GroupState`` objects (``__slots__``, with ids
+and cents in ``array('q')``) so a cached group is served without any SQL.
+
+Entries are dropped by signal receivers on every save or delete of an
+expense, expense line or membership, and again on ``group_changed`` once
+the write has committed. Each drop bumps the group's generation; a state
+loaded while a write was in flight carries the old generation and is never
+served, so a racing reader can't put stale balances back.
+
+The default ``LocalBackend`` is an LRU per process, bounded by
+``GROUP_STATE_CACHE_MAX_BYTES``. Signals don't cross processes, so writes
+made elsewhere (another worker, a management command) are only picked up
+when entries expire after ``GROUP_STATE_CACHE_TTL`` seconds, except by the
+views that answer ``If-None-Match``: they read the group's version for
+their ETag anyway and ``refresh`` the state when it is older. With several
+workers, set ``GROUP_STATE_CACHE_BACKEND`` to ``SharedBackend``, which keeps
+states and generations in a Django cache all workers share.
+"""
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import Expense, ExpensePayment, ExpenseSplit, Group, GroupMember, MemberBalance
+from .settlement import SOLVERS
+from .signals import group_changed
+from . import engine, plans
+
+# Rough bytes of one cached settlement transfer, used to leave room for a
+# plan per solver in a state's size
+_TRANSFER_BYTES = 120
+
+
+class GroupState:
+    """Name, version, members and net balances (cents) of one group."""
+
+    __slots__ = ('group_id', 'name', 'version', 'user_ids', 'usernames', 'emails', 'net',
+                 'generation', 'size', '_plans')
+
+    def __init__(self, group_id, name, version, members, net_by_user, generation=0):
+        self.group_id = group_id
+        self.name = name
+        self.version = version
+        self.user_ids = array('q', [m[0] for m in members])
+        self.usernames = tuple(m[1] for m in members)
+        self.emails = tuple(m[2] for m in members)
+        self.net = array('q', [net_by_user.get(m[0], 0) for m in members])
+        self.generation = generation
+        self._plans = {}
+        strings = sum(sys.getsizeof(s) for s in (name,) + self.usernames + self.emails)
+        arrays = 2 * self.user_ids.itemsize * len(self.user_ids)
+        plans = len(SOLVERS) * len(members) * _TRANSFER_BYTES
+        self.size = 256 + strings + arrays + plans
+
+    def __getstate__(self):
+        # Plans are cheap to recompute and would only bloat shared entries
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != '_plans'}
+
+    def __setstate__(self, data):
+        for slot, value in data.items():
+            setattr(self, slot, value)
+        self._plans = {}
+
+    def members(self):
+        return zip(self.user_ids, self.usernames, self.emails, self.net)
+
+    def cached_plan(self, solver):
+        return self._plans.get(solver)
+
+    def arrays(self):
+        """``(user_ids, net)`` as int64 NumPy views of the cached arrays."""
+        user_ids = np.frombuffer(self.user_ids, dtype=np.int64)
+        net = np.frombuffer(self.net, dtype=np.int64)
+        # A solver must not write through them
+        user_ids.flags.writeable = net.flags.writeable = False
+        return user_ids, net
+
+    def plan(self, solver):
+        """``(settlements, solver used)`` of the group's stored plan, read
+        (and brought up to date) once per state and solver."""
+        plan = self._plans.get(solver)
+        if plan is None:
+            plan = self._plans[solver] = plans.current(self, solver)
+        return plan
+
+
+class Backend:
+    """Where states live. Async views call the ``a*`` methods, which
+    default to the sync ones for backends that never block."""
+
+    def get(self, group_id):
+        raise NotImplementedError
+
+    def generation(self, group_id):
+        raise NotImplementedError
+
+    def set(self, state):
+        raise NotImplementedError
+
+    def invalidate(self, group_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+    async def aget(self, group_id):
+        return self.get(group_id)
+
+    async def ageneration(self, group_id):
+        return self.generation(group_id)
+
+    async def aset(self, state):
+        self.set(state)
+
+    async def ainvalidate(self, group_id):
+        self.invalidate(group_id)
+
+
+class LocalBackend(Backend):
+    """In-process LRU bounded by the estimated size of its states."""
+
+    def __init__(self, max_bytes=None, ttl=None):
+        self.max_bytes = settings.GROUP_STATE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.ttl = settings.GROUP_STATE_CACHE_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, group_id):
+        with self._lock:
+            entry = self._entries.get(group_id)
+            if entry is not None:
+                state, expires = entry
+                if expires > time.monotonic() and state.generation == self._generations.get(group_id, 0):
+                    self._entries.move_to_end(group_id)
+                    self.hits += 1
+                    return state
+                self._drop(group_id)
+            self.misses += 1
+            return None
+
+    def generation(self, group_id):
+        with self._lock:
+            return self._generations.get(group_id, 0)
+
+    def set(self, state):
+        if state.size > self.max_bytes:
+            return
+        with self._lock:
+            if state.generation != self._generations.get(state.group_id, 0):
+                return
+            self._drop(state.group_id)
+            self._entries[state.group_id] = (state, time.monotonic() + self.ttl)
+            self._bytes += state.size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, group_id):
+        with self._lock:
+            self._generations[group_id] = self._generations.get(group_id, 0) + 1
+            if self._drop(group_id):
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._bytes = 0
+
+    def _drop(self, group_id):
+        entry = self._entries.pop(group_id, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[0].size
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+class SharedBackend(Backend):
+    """States in a Django cache (``GROUP_STATE_CACHE_ALIAS``) shared by workers.
+
+    The generation lives next to each state, so an invalidation from any
+    process retires the entry for all of them. Every read is a cache round
+    trip instead of a dict lookup, but still no SQL.
+    """
+
+    def __init__(self, alias=None, ttl=None):
+        self.cache = caches[alias or settings.GROUP_STATE_CACHE_ALIAS]
+        self.ttl = settings.GROUP_STATE_CACHE_TTL if ttl is None else ttl
+
+    @staticmethod
+    def _keys(group_id):
+        return f'group-state:{group_id}', f'group-state-gen:{group_id}'
+
+    def _valid(self, values, group_id):
+        state_key, gen_key = self._keys(group_id)
+        state = values.get(state_key)
+        if state is not None and state.generation == values.get(gen_key, 0):
+            return state
+        return None
+
+    def get(self, group_id):
+        return self._valid(self.cache.get_many(self._keys(group_id)), group_id)
+
+    async def aget(self, group_id):
+        return self._valid(await self.cache.aget_many(self._keys(group_id)), group_id)
+
+    def generation(self, group_id):
+        return self.cache.get(self._keys(group_id)[1], 0)
+
+    async def ageneration(self, group_id):
+        return await self.cache.aget(self._keys(group_id)[1], 0)
+
+    def set(self, state):
+        self.cache.set(self._keys(state.group_id)[0], state, self.ttl)
+
+    async def aset(self, state):
+        await self.cache.aset(self._keys(state.group_id)[0], state, self.ttl)
+
+    def invalidate(self, group_id):
+        state_key, gen_key = self._keys(group_id)
+        try:
+            self.cache.incr(gen_key)
+        except ValueError:
+            # Outlive any state stored under the old generation
+            self.cache.set(gen_key, 1, None)
+        self.cache.delete(state_key)
+
+    async def ainvalidate(self, group_id):
+        state_key, gen_key = self._keys(group_id)
+        try:
+            await self.cache.aincr(gen_key)
+        except ValueError:
+            await self.cache.aset(gen_key, 1, None)
+        await self.cache.adelete(state_key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = import_string(settings.GROUP_STATE_CACHE_BACKEND)()
+        return _backend
+
+
+def set_backend(backend):
+    """Replace the process-wide backend; returns the previous one."""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
+
+
+def _group_query(group_id):
+    return Group.objects.filter(pk=group_id).values_list('name', 'version')
+
+
+def _member_query(group_id):
+    return (
+        GroupMember.objects.filter(group_id=group_id).order_by('id')
+        .values_list('user_id', 'user__username', 'user__email')
+    )
+
+
+def _net_query(group_id):
+    # paid - owed, exactly as engine.balance_rows reads the ledger
+    return (
+        MemberBalance.objects.filter(group_id=group_id)
+        .values_list('user_id', engine.cents_column('paid'), engine.cents_column('owed'))
+    )
+
+
+def get_state(group_id):
+    """The cached ``GroupState`` of a group, loaded on a miss; None if it doesn't exist."""
+    backend = get_backend()
+    state = backend.get(group_id)
+    if state is not None:
+        return state
+    generation = backend.generation(group_id)
+    group = _group_query(group_id).first()
+    if group is None:
+        return None
+    net = {user_id: paid - owed for user_id, paid, owed in _net_query(group_id)}
+    state = GroupState(group_id, *group, list(_member_query(group_id)), net, generation)
+    backend.set(state)
+    return state
+
+
+async def aget_state(group_id):
+    backend = get_backend()
+    state = await backend.aget(group_id)
+    if state is not None:
+        return state
+    generation = await backend.ageneration(group_id)
+    group = await _group_query(group_id).afirst()
+    if group is None:
+        return None
+    members = [row async for row in _member_query(group_id)]
+    net = {user_id: paid - owed async for user_id, paid, owed in _net_query(group_id)}
+    state = GroupState(group_id, *group, members, net, generation)
+    await backend.aset(state)
+    return state
+
+
+def invalidate(group_id):
+    get_backend().invalidate(group_id)
+
+
+def refresh(group_id, version):
+    """Drop the cached state of a group if it is older than ``version``,
+    read from the database: writes made by other processes aren't
+    signalled to this one."""
+    backend = get_backend()
+    state = backend.get(group_id)
+    if state is not None and state.version < version:
+        backend.invalidate(group_id)
+
+
+async def arefresh(group_id, version):
+    backend = get_backend()
+    state = await backend.aget(group_id)
+    if state is not None and state.version < version:
+        await backend.ainvalidate(group_id)
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=GroupMember)
+@receiver(post_delete, sender=GroupMember)
+def invalidate_on_write(sender, instance, **kwargs):
+    invalidate(instance.group_id)
+
+
+# Lines are written with bulk_create (no signals) next to a saved expense,
+# and deleted only with or through their expense; this catches saves made
+# one by one, e.g. from the admin. Delete receivers are left off on
+# purpose: they would stop Django from fast-deleting an expense's lines.
+@receiver(post_save, sender=ExpensePayment)
+@receiver(post_save, sender=ExpenseSplit)
+def invalidate_on_line_write(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate(instance.expense.group_id)
+
+
+@receiver(post_save, sender=Group)
+def invalidate_on_group_write(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate(instance.id)
+
+
+@receiver(group_changed)
+def invalidate_on_commit(sender, group_id, **kwargs):
+    invalidate(group_id)
@@ -0,0 +1,182 @@
+"""Streaming bulk import of expenses from CSV or JSON Lines.
+
+The request body is read line by line and turned into expense records,
+which are validated against a membership set loaded once per import and
+written with ``bulk_create`` one chunk at a time, each chunk in its own
+transaction. Invalid records are skipped and reported by line number.
+
+JSON Lines: one expense per line, in the same shape as the expense POST
+body: ``{"description": ..., "payments": [...], "splits": [...]}``.
+
+CSV: one payment or split per row, with the header
+``expense,description,kind,user,amount``. Rows of the same expense share
+the ``expense`` reference and must be adjacent; ``kind`` is ``payment``
+or ``split``.
+"""
+import csv
+import json
+
+from django.db import transaction
+
+from .models import Expense, ExpensePayment, ExpenseSplit
+from .validation import LineError, check_lines, group_member_ids
+from .signals import mark_group_changed
+from . import ledger
+
+CSV_FIELDS = ['expense', 'description', 'kind', 'user', 'amount']
+
+# Error details beyond this many are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+class RecordError(Exception):
+    pass
+
+
+def _decode(lines):
+    for line in lines:
+        yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+
+def jsonl_records(lines):
+    """Yield ``(line_number, record)`` pairs from a JSON Lines stream."""
+    for line_no, line in enumerate(_decode(lines), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield line_no, RecordError(f'Invalid JSON: {exc}')
+            continue
+        if not isinstance(record, dict):
+            yield line_no, RecordError('Each line must be a JSON object')
+            continue
+        yield line_no, record
+
+
+def csv_records(lines):
+    """Yield ``(line_number, record)`` pairs from a CSV stream.
+
+    Adjacent rows with the same ``expense`` reference are folded into one
+    record; the line number reported is that of its first row.
+    """
+    reader = csv.DictReader(_decode(lines))
+    if reader.fieldnames is None:
+        return
+    missing = set(CSV_FIELDS) - set(reader.fieldnames)
+    if missing:
+        yield 1, RecordError(f'Missing CSV columns: {", ".join(sorted(missing))}')
+        return
+
+    current_ref = None
+    record = None
+    start_line = None
+    for row in reader:
+        ref = row['expense']
+        if record is not None and ref != current_ref:
+            yield start_line, record
+            record = None
+        if record is None:
+            current_ref = ref
+            start_line = reader.line_num
+            record = {'description': row['description'] or '', 'payments': [], 'splits': []}
+
+        kind = (row['kind'] or '').strip().lower()
+        if kind == 'payment':
+            record['payments'].append({'payer': row['user'], 'amount': row['amount']})
+        elif kind == 'split':
+            record['splits'].append({'member': row['user'], 'share': row['amount']})
+        else:
+            # The remaining rows of this expense are still consumed
+            record.setdefault(
+                '_error', RecordError(f'Unknown kind {row["kind"]!r} on line {reader.line_num}')
+            )
+    if record is not None:
+        yield start_line, record
+
+
+FORMATS = {
+    'text/csv': csv_records,
+    'application/x-ndjson': jsonl_records,
+    'application/jsonl': jsonl_records,
+    'application/json-lines': jsonl_records,
+}
+
+
+def check_record(record, member_ids):
+    """Validate one expense record; return ``(description, payments, splits)``."""
+    if isinstance(record, RecordError):
+        raise record
+    if '_error' in record:
+        raise record['_error']
+    try:
+        payments, splits = check_lines(record, member_ids)
+    except LineError as exc:
+        raise RecordError(str(exc))
+    description = str(record.get('description') or '')[:500]
+    return description, payments, splits
+
+
+def _write_chunk(group, chunk):
+    with transaction.atomic():
+        expenses = Expense.objects.bulk_create(
+            [
+                Expense(group=group, description=description, **ledger.line_totals(payments, splits))
+                for description, payments, splits in chunk
+            ]
+        )
+        payment_rows = []
+        split_rows = []
+        # Lines per creation day, for the daily rollups (normally just one)
+        lines_by_day = {}
+        for expense, (_, payments, splits) in zip(expenses, chunk):
+            payment_rows.extend(
+                ExpensePayment(expense=expense, payer_id=uid, amount=amount)
+                for uid, amount in payments
+            )
+            split_rows.extend(
+                ExpenseSplit(expense=expense, member_id=uid, share=share)
+                for uid, share in splits
+            )
+            day_payments, day_splits = lines_by_day.setdefault(ledger.expense_day(expense), ([], []))
+            day_payments.extend(payments)
+            day_splits.extend(splits)
+        ExpensePayment.objects.bulk_create(payment_rows)
+        ExpenseSplit.objects.bulk_create(split_rows)
+        for day, (day_payments, day_splits) in lines_by_day.items():
+            ledger.apply_lines(group.id, day_payments, day_splits, day)
+        mark_group_changed(group.id)
+    return len(payment_rows), len(split_rows)
+
+
+def import_expenses(group, records, chunk_size=1000):
+    """Import a stream of ``(line_number, record)`` pairs into ``group``.
+
+    Returns a report dict with the number of imported expenses and lines
+    plus the per-record errors.
+    """
+    member_ids = group_member_ids(group)
+    report = {'imported': 0, 'payments': 0, 'splits': 0, 'error_count': 0, 'errors': []}
+
+    chunk = []
+    for line_no, record in records:
+        try:
+            chunk.append(check_record(record, member_ids))
+        except RecordError as exc:
+            report['error_count'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'line': line_no, 'error': str(exc)})
+            continue
+        if len(chunk) >= chunk_size:
+            payments, splits = _write_chunk(group, chunk)
+            report['imported'] += len(chunk)
+            report['payments'] += payments
+            report['splits'] += splits
+            chunk = []
+
+    if chunk:
+        payments, splits = _write_chunk(group, chunk)
+        report['imported'] += len(chunk)
+        report['payments'] += payments
+        report['splits'] += splits
+    return report
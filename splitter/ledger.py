@@ -0,0 +1,272 @@
+"""Running per-member balance ledger.
+
+Every (group, member) pair has one ``MemberBalance`` row holding what the
+member has paid and owes across the whole group history, and one
+``DailyBalance`` row per day with activity. Write paths call
+``apply_lines`` inside their own transaction so reports can read O(members)
+rows, and historical queries O(days) rows, instead of walking every
+payment and split.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyBalance, Expense, MemberBalance, ExpensePayment, ExpenseSplit
+
+ZERO = Decimal('0.00')
+
+
+def apply_lines(group_id, payments, splits, day, sign=1):
+    """Add (``sign=1``) or remove (``sign=-1``) expense lines from the ledger.
+
+    ``payments`` and ``splits`` are iterables of ``(user_id, amount)`` pairs
+    of expenses created on ``day``, whose daily rollup is updated as well.
+    Runs a fixed number of queries no matter how many lines are passed.
+    """
+    paid = defaultdict(Decimal)
+    owed = defaultdict(Decimal)
+    for user_id, amount in payments:
+        paid[user_id] += amount
+    for user_id, share in splits:
+        owed[user_id] += share
+
+    user_ids = set(paid) | set(owed)
+    if not user_ids:
+        return
+
+    with transaction.atomic():
+        _add_to_rows(MemberBalance, {'group_id': group_id}, user_ids, paid, owed, sign)
+        _add_to_rows(DailyBalance, {'group_id': group_id, 'day': day}, user_ids, paid, owed, sign)
+
+
+def _add_to_rows(model, key, user_ids, paid, owed, sign):
+    model.objects.bulk_create(
+        [model(user_id=uid, **key) for uid in user_ids],
+        ignore_conflicts=True
+    )
+    rows = list(model.objects.select_for_update().filter(user_id__in=user_ids, **key))
+    for row in rows:
+        row.paid += sign * paid.get(row.user_id, ZERO)
+        row.owed += sign * owed.get(row.user_id, ZERO)
+    fields = ['paid', 'owed']
+    if model is MemberBalance:
+        for row in rows:
+            row.net = row.paid - row.owed
+        fields.append('net')
+    model.objects.bulk_update(rows, fields)
+
+
+def expense_day(expense):
+    """The day an expense counts towards in the daily rollups."""
+    return timezone.localdate(expense.created_at)
+
+
+def expense_lines(expense_id):
+    """Return the ``(payments, splits)`` pairs currently stored for an expense."""
+    payments = list(
+        ExpensePayment.objects.filter(expense_id=expense_id).values_list('payer_id', 'amount')
+    )
+    splits = list(
+        ExpenseSplit.objects.filter(expense_id=expense_id).values_list('member_id', 'share')
+    )
+    return payments, splits
+
+
+def apply_expense(expense, sign=1):
+    payments, splits = expense_lines(expense.pk)
+    apply_lines(expense.group_id, payments, splits, expense_day(expense), sign=sign)
+
+
+def ensure_member(group_id, user_id):
+    """Create an empty ledger row for a newly added member."""
+    MemberBalance.objects.get_or_create(group_id=group_id, user_id=user_id)
+
+
+def ensure_members(group_id, user_ids):
+    """``ensure_member`` for many members, in one insert."""
+    MemberBalance.objects.bulk_create(
+        [MemberBalance(group_id=group_id, user_id=user_id) for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+
+
+def computed_totals(group_id):
+    """Recompute ``{user_id: (paid, owed)}`` for a group from the raw rows."""
+    totals = defaultdict(lambda: [ZERO, ZERO])
+    paid_rows = (
+        ExpensePayment.objects.filter(expense__group_id=group_id)
+        .values_list('payer_id').annotate(total=Sum('amount'))
+    )
+    owed_rows = (
+        ExpenseSplit.objects.filter(expense__group_id=group_id)
+        .values_list('member_id').annotate(total=Sum('share'))
+    )
+    for user_id, total in paid_rows:
+        totals[user_id][0] = total
+    for user_id, total in owed_rows:
+        totals[user_id][1] = total
+    return {uid: tuple(pair) for uid, pair in totals.items()}
+
+
+def rebuild_group(group_id, fix=True):
+    """Compare the ledger of one group against its raw rows.
+
+    Returns a list of ``(user_id, stored, expected)`` tuples for every row
+    that drifted, where both are ``(paid, owed)``. With ``fix`` the stored
+    rows are rewritten to the expected values.
+    """
+    expected = computed_totals(group_id)
+    drift = []
+    with transaction.atomic():
+        stored = {
+            row.user_id: row
+            for row in MemberBalance.objects.select_for_update().filter(group_id=group_id)
+        }
+        to_create = []
+        to_update = []
+        for user_id in set(expected) | set(stored):
+            paid, owed = expected.get(user_id, (ZERO, ZERO))
+            row = stored.get(user_id)
+            if row is None:
+                if paid or owed:
+                    drift.append((user_id, (ZERO, ZERO), (paid, owed)))
+                    to_create.append(MemberBalance(
+                        group_id=group_id, user_id=user_id,
+                        paid=paid, owed=owed, net=paid - owed
+                    ))
+                continue
+            if row.paid != paid or row.owed != owed or row.net != paid - owed:
+                drift.append((user_id, (row.paid, row.owed), (paid, owed)))
+                row.paid, row.owed, row.net = paid, owed, paid - owed
+                to_update.append(row)
+        if fix:
+            MemberBalance.objects.bulk_create(to_create)
+            MemberBalance.objects.bulk_update(to_update, ['paid', 'owed', 'net'])
+            if drift:
+                # Repaired balances are a change: retire cached reports and states
+                from .signals import mark_group_changed
+                mark_group_changed(group_id)
+    return drift
+
+
+def line_totals(payments, splits):
+    """Stored ``Expense`` totals for these ``(user_id, amount)`` lines.
+
+    Passed to ``Expense(...)``/``save()`` by every path that writes lines,
+    so listings and reports never have to add up the split rows.
+    """
+    return {
+        'total_amount': sum((share for _, share in splits), ZERO),
+        'payment_count': len(payments),
+        'split_count': len(splits),
+    }
+
+
+def rebuild_expense_totals(group_id, fix=True):
+    """Compare the stored totals of a group's expenses against their lines.
+
+    Returns a list of ``(expense_id, stored, expected)`` tuples for every
+    expense that drifted, where both are ``(total_amount, payment_count,
+    split_count)``. With ``fix`` the stored values are rewritten.
+    """
+    expected = defaultdict(lambda: [ZERO, 0, 0])
+    payment_rows = (
+        ExpensePayment.objects.filter(expense__group_id=group_id)
+        .values_list('expense_id').annotate(n=Count('id')).order_by()
+    )
+    for expense_id, count in payment_rows:
+        expected[expense_id][1] = count
+    split_rows = (
+        ExpenseSplit.objects.filter(expense__group_id=group_id)
+        .values_list('expense_id').annotate(total=Sum('share'), n=Count('id')).order_by()
+    )
+    for expense_id, total, count in split_rows:
+        expected[expense_id][0] = total
+        expected[expense_id][2] = count
+
+    drift = []
+    to_update = []
+    with transaction.atomic():
+        stored = Expense.objects.select_for_update().filter(group_id=group_id).only(
+            'id', 'total_amount', 'payment_count', 'split_count'
+        )
+        for expense in stored.iterator():
+            want = tuple(expected.get(expense.id, (ZERO, 0, 0)))
+            have = (expense.total_amount, expense.payment_count, expense.split_count)
+            if have != want:
+                drift.append((expense.id, have, want))
+                expense.total_amount, expense.payment_count, expense.split_count = want
+                to_update.append(expense)
+        if fix:
+            Expense.objects.bulk_update(
+                to_update, ['total_amount', 'payment_count', 'split_count'], batch_size=500
+            )
+            if drift:
+                # Listings and exports show the stored totals, so cached ones are stale
+                from .signals import mark_group_changed
+                mark_group_changed(group_id)
+    return drift
+
+
+def computed_rollups(group_id):
+    """Recompute ``{(user_id, day): (paid, owed)}`` for a group from the raw rows."""
+    totals = defaultdict(lambda: [ZERO, ZERO])
+    paid_rows = (
+        ExpensePayment.objects.filter(expense__group_id=group_id)
+        .annotate(day=TruncDate('expense__created_at'))
+        .values_list('payer_id', 'day').annotate(total=Sum('amount')).order_by()
+    )
+    owed_rows = (
+        ExpenseSplit.objects.filter(expense__group_id=group_id)
+        .annotate(day=TruncDate('expense__created_at'))
+        .values_list('member_id', 'day').annotate(total=Sum('share')).order_by()
+    )
+    for user_id, day, total in paid_rows:
+        totals[(user_id, day)][0] = total
+    for user_id, day, total in owed_rows:
+        totals[(user_id, day)][1] = total
+    return {key: tuple(pair) for key, pair in totals.items()}
+
+
+def rebuild_rollups(group_id, fix=True):
+    """Compare the daily rollups of one group against its raw rows.
+
+    Returns a list of ``((user_id, day), stored, expected)`` tuples for
+    every row that drifted, where both are ``(paid, owed)``. With ``fix``
+    the stored rows are rewritten to the expected values.
+    """
+    expected = computed_rollups(group_id)
+    drift = []
+    with transaction.atomic():
+        stored = {
+            (row.user_id, row.day): row
+            for row in DailyBalance.objects.select_for_update().filter(group_id=group_id)
+        }
+        to_create = []
+        to_update = []
+        for key in set(expected) | set(stored):
+            paid, owed = expected.get(key, (ZERO, ZERO))
+            row = stored.get(key)
+            if row is None:
+                if paid or owed:
+                    drift.append((key, (ZERO, ZERO), (paid, owed)))
+                    to_create.append(DailyBalance(
+                        group_id=group_id, user_id=key[0], day=key[1], paid=paid, owed=owed
+                    ))
+                continue
+            if row.paid != paid or row.owed != owed:
+                drift.append((key, (row.paid, row.owed), (paid, owed)))
+                row.paid, row.owed = paid, owed
+                to_update.append(row)
+        if fix:
+            DailyBalance.objects.bulk_create(to_create, batch_size=500)
+            DailyBalance.objects.bulk_update(to_update, ['paid', 'owed'], batch_size=500)
+            if drift:
+                # Period reports read the rollups, so their cached copies are stale
+                from .signals import mark_group_changed
+                mark_group_changed(group_id)
+    return drift
@@ -0,0 +1,295 @@
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from splitter import group_cache, ledger, metrics
+from splitter.models import (
+    Expense, ExpensePayment, ExpenseSplit, Group, GroupMember, SettlementPlan,
+)
+
+User = get_user_model()
+
+DEFAULT_SCALES = ['5x100', '50x10000', '500x100000']
+
+# Rows per bulk_create while seeding
+SEED_BATCH = 5000
+
+
+def parse_scale(value):
+    try:
+        members, expenses = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise CommandError(f'Invalid scale {value!r}, expected MEMBERSxEXPENSES (e.g. 50x10000)')
+    if members < 2 or expenses < 1:
+        raise CommandError(f'Invalid scale {value!r}: need at least 2 members and 1 expense')
+    return members, expenses
+
+
+def seed_group(label, n_members, n_expenses, seed):
+    """Create one synthetic group straight into the tables.
+
+    The data depends only on the scale and ``seed``: every expense has 1-3
+    payers and 2-6 splits in whole cents that add up to the same total, and
+    the expenses are spread over the last year. The balance ledger and
+    daily rollups are then rebuilt from the rows.
+    """
+    rng = random.Random(f'{seed}:{label}')
+    users = User.objects.bulk_create([
+        User(username=f'bench-{label}-{i}', email=f'bench{i}@example.com', password='!')
+        for i in range(n_members)
+    ])
+    user_ids = [u.id for u in users]
+    group = Group.objects.create(name=f'bench {label}', created_by=users[0])
+    GroupMember.objects.bulk_create([GroupMember(group=group, user_id=uid) for uid in user_ids])
+
+    start = timezone.now() - timedelta(days=365)
+    step = timedelta(days=365) / n_expenses
+    for offset in range(0, n_expenses, SEED_BATCH):
+        count = min(SEED_BATCH, n_expenses - offset)
+        expenses = Expense.objects.bulk_create([
+            Expense(group=group, description=f'expense {offset + i}')
+            for i in range(count)
+        ])
+        payments, splits = [], []
+        for i, expense in enumerate(expenses):
+            # auto_now_add would stamp every row with the same instant
+            expense.created_at = start + step * (offset + i)
+            total = rng.randint(100, 50000)
+            payers = rng.sample(user_ids, min(rng.randint(1, 3), n_members))
+            members = rng.sample(user_ids, min(rng.randint(2, 6), n_members))
+            expense.total_amount = Decimal(total) / 100
+            expense.payment_count, expense.split_count = len(payers), len(members)
+            for payer_id, cents in zip(payers, _divide(total, len(payers), rng)):
+                payments.append(ExpensePayment(
+                    expense=expense, payer_id=payer_id, amount=Decimal(cents) / 100
+                ))
+            for member_id, cents in zip(members, _divide(total, len(members), rng)):
+                splits.append(ExpenseSplit(
+                    expense=expense, member_id=member_id, share=Decimal(cents) / 100
+                ))
+        Expense.objects.bulk_update(
+            expenses, ['created_at', 'total_amount', 'payment_count', 'split_count']
+        )
+        ExpensePayment.objects.bulk_create(payments)
+        ExpenseSplit.objects.bulk_create(splits)
+
+    ledger.rebuild_group(group.id)
+    ledger.rebuild_rollups(group.id)
+    Group.objects.filter(pk=group.id).update(version=1)
+    group.refresh_from_db()
+    return group
+
+
+def _divide(total, parts, rng):
+    """Split ``total`` cents into ``parts`` positive random amounts."""
+    if parts == 1:
+        return [total]
+    cuts = sorted(rng.sample(range(1, total), parts - 1))
+    return [b - a for a, b in zip([0] + cuts, cuts + [total])]
+
+
+def endpoints(group):
+    """(name, method, path, body) of every request that is measured."""
+    members = list(
+        GroupMember.objects.filter(group=group).order_by('id').values_list('user_id', flat=True)[:2]
+    )
+    new_expense = {
+        'description': 'bench',
+        'payments': [{'payer': members[0], 'amount': '20.00'}, {'payer': members[1], 'amount': '10.00'}],
+        'splits': [{'member': uid, 'share': '15.00'} for uid in members],
+    }
+    base = f'/api/groups/{group.id}'
+    return [
+        ('group_report', 'get', f'{base}/report/', None),
+        # A period report is rendered inline, so this times a full render
+        ('download_report_pdf', 'get', f'{base}/report/pdf/?from=1970-01-01', None),
+        ('expense_list', 'get', f'{base}/expenses/', None),
+        ('expense_create', 'post', f'{base}/expenses/', new_expense),
+        ('group_list', 'get', '/api/groups/', None),
+    ]
+
+
+def reset():
+    """Drop everything a request could reuse from the one before it."""
+    cache.clear()
+    group_cache.get_backend().clear()
+    SettlementPlan.objects.all().delete()
+
+
+def measure(client, method, path, body, repeat):
+    """Time a request ``repeat`` times, then count its queries and memory once.
+
+    The response cache, the group state cache and the stored settlement
+    plans are reset before every request, outside what is measured, so each
+    one does its full (cold) work. tracemalloc slows things down, so queries
+    and memory get their own run outside the timed ones.
+
+    Queries are counted by the metrics middleware's SQL hook, which follows
+    the request onto the offload pool and the writer thread; without the
+    middleware the count is None (n/a).
+    """
+    def call():
+        if method == 'post':
+            response = client.post(path, json.dumps(body), content_type='application/json')
+        else:
+            response = client.get(path)
+        if response.streaming:
+            # Drain streamed bodies so their work is counted
+            b''.join(response)
+        return response
+
+    timings = []
+    for _ in range(repeat):
+        reset()
+        started = time.perf_counter()
+        response = call()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    reset()
+    counted = 'splitter.middleware.MetricsMiddleware' in settings.MIDDLEWARE
+    before = metrics.registry.queries()
+    tracemalloc.start()
+    try:
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    queries = metrics.registry.queries() - before if counted else None
+
+    return {
+        'status': response.status_code,
+        'median_ms': round(statistics.median(timings), 2),
+        'min_ms': round(min(timings), 2),
+        'queries': queries,
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, max_time, max_memory, max_queries):
+    """Regressions of ``results`` against ``baseline`` as readable strings."""
+    regressions = []
+    for scale, measured in results.items():
+        for name, now in measured.items():
+            before = baseline.get(scale, {}).get(name)
+            if before is None:
+                continue
+            where = f'{scale} {name}'
+            if now['median_ms'] > before['median_ms'] * (1 + max_time):
+                regressions.append(
+                    f"{where}: median {now['median_ms']}ms vs {before['median_ms']}ms"
+                )
+            if now['peak_kb'] > before['peak_kb'] * (1 + max_memory):
+                regressions.append(
+                    f"{where}: peak memory {now['peak_kb']}KB vs {before['peak_kb']}KB"
+                )
+            counted = now['queries'] is not None and before['queries'] is not None
+            if counted and now['queries'] > before['queries'] + max_queries:
+                regressions.append(
+                    f"{where}: {now['queries']} queries vs {before['queries']}"
+                )
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the report, PDF, expense and group endpoints on seeded synthetic '
+            'groups in a throwaway test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='append', dest='scales',
+                            help='MEMBERSxEXPENSES to seed, can be repeated '
+                                 f'(default: {" ".join(DEFAULT_SCALES)}).')
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help='Only measure this endpoint (can be repeated).')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Timed requests per endpoint; the median is reported.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='bench.json',
+                            help='Where to write the results as JSON.')
+        parser.add_argument('--baseline',
+                            help='Results of an earlier run to compare against.')
+        parser.add_argument('--max-time-regression', type=float, default=0.25,
+                            help='Allowed relative growth of the median time (default 0.25).')
+        parser.add_argument('--max-memory-regression', type=float, default=0.25,
+                            help='Allowed relative growth of peak memory (default 0.25).')
+        parser.add_argument('--max-query-increase', type=int, default=0,
+                            help='Allowed extra SQL queries per request (default 0).')
+
+    def handle(self, *args, **options):
+        scales = [(label, *parse_scale(label)) for label in options['scales'] or DEFAULT_SCALES]
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as fh:
+                baseline = json.load(fh)['results']
+
+        # Seed into a test database so the real one is never touched
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = self.run(scales, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'seed': options['seed'],
+                'repeat': options['repeat'],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'results': results,
+        }
+        Path(options['output']).write_text(json.dumps(report, indent=2) + '\n')
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            regressions = compare(
+                results, baseline, options['max_time_regression'],
+                options['max_memory_regression'], options['max_query_increase'],
+            )
+            for line in regressions:
+                self.stderr.write(line)
+            if regressions:
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def run(self, scales, options):
+        client = Client()
+        results = {}
+        for label, n_members, n_expenses in scales:
+            started = time.perf_counter()
+            group = seed_group(label, n_members, n_expenses, options['seed'])
+            self.stdout.write(
+                f'{label}: seeded {n_members} members, {n_expenses} expenses '
+                f'in {time.perf_counter() - started:.1f}s'
+            )
+            results[label] = {}
+            for name, method, path, body in endpoints(group):
+                if options['endpoints'] and name not in options['endpoints']:
+                    continue
+                result = measure(client, method, path, body, options['repeat'])
+                results[label][name] = result
+                queries = 'n/a' if result['queries'] is None else result['queries']
+                self.stdout.write(
+                    f"  {name:<20} {result['median_ms']:>10.2f} ms  {queries:>4} queries  "
+                    f"{result['peak_kb']:>10.1f} KB  [{result['status']}]"
+                )
+        return results
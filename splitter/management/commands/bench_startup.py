@@ -0,0 +1,125 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a fresh worker does before it can serve its first request; it then
+# prints the wall-clock time, so the parent can time it from its own spawn
+STARTUP = 'import time, django; django.setup(); import {module}; print(repr(time.time()))'
+
+
+def parse_importtime(output):
+    """``[(depth, name, self_us, cumulative_us)]`` from ``-X importtime`` output."""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        stripped = name.lstrip(' ')
+        rows.append(((len(name) - len(stripped) - 1) // 2, stripped, int(own), int(cumulative)))
+    return rows
+
+
+def subtree(rows, module):
+    """Rows of the top-level import of ``module`` and everything it pulled in.
+
+    ``-X importtime`` prints a module after its own imports, so they are
+    the deeper rows just before it.
+    """
+    for end, (depth, name, _, _) in enumerate(rows):
+        if depth == 0 and name == module:
+            break
+    else:
+        raise CommandError(f'{module} was not imported (already loaded by django.setup()?)')
+    start = end
+    while start > 0 and rows[start - 1][0] > 0:
+        start -= 1
+    return rows[start:end + 1]
+
+
+class Command(BaseCommand):
+    help = ('Time a cold worker start, from spawning the interpreter until ROOT_URLCONF is imported, '
+            'and fail when it goes over a budget or loads a forbidden module.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default=settings.ROOT_URLCONF,
+                            help='Module imported after django.setup() (default: ROOT_URLCONF).')
+        parser.add_argument('--budget', type=float, default=1000,
+                            help='Maximum median time from process start until --module is imported, '
+                                 'in ms (default 1000).')
+        parser.add_argument('--forbid', action='append',
+                            help='Package that must not be imported at startup (can be repeated; '
+                                 'default: reportlab).')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Fresh interpreters to time; the median is compared (default 5).')
+        parser.add_argument('--top', type=int, default=10, help='Heaviest imports to list.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        module = options['module']
+        forbidden = options['forbid'] or ['reportlab']
+
+        # The first run also writes any missing .pyc files, so it isn't counted
+        self.start(module)
+        total_ms = statistics.median(self.start(module) for _ in range(options['repeat']))
+        self.stdout.write(
+            f'Process start to {module} imported: {total_ms:.1f} ms '
+            f'(median of {options["repeat"]}, budget {options["budget"]:g} ms)'
+        )
+
+        # One more run under -X importtime (which slows imports down) for the breakdown
+        rows = self.importtime(module)
+        module_ms = subtree(rows, module)[-1][3] / 1000
+        # Interpreter startup, settings and django.setup(), i.e. the app registry
+        setup_ms = sum(
+            cumulative for depth, name, _, cumulative in rows if depth == 0 and name != module
+        ) / 1000
+        self.stdout.write(
+            f'Under -X importtime: imports before {module} {setup_ms:.1f} ms, {module} {module_ms:.1f} ms'
+        )
+
+        # Heaviest imports, by their own time summed per package
+        packages = {}
+        for _, name, own, _ in rows:
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0) + own
+        for package, own in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f'  {own / 1000:8.1f} ms  {package}')
+
+        loaded = {name for _, name, _, _ in rows}
+        problems = [
+            f'{package} is imported at startup'
+            for package in forbidden
+            if any(name == package or name.startswith(package + '.') for name in loaded)
+        ]
+        if total_ms > options['budget']:
+            problems.append(
+                f'starting a worker took {total_ms:.1f} ms, over the {options["budget"]:g} ms budget'
+            )
+        if problems:
+            raise CommandError('; '.join(problems))
+        self.stdout.write(self.style.SUCCESS('Startup within budget'))
+
+    def spawn(self, module, *flags):
+        result = subprocess.run(
+            [sys.executable, *flags, '-c', STARTUP.format(module=module)],
+            cwd=settings.BASE_DIR, env=os.environ.copy(), capture_output=True, text=True
+        )
+        if result.returncode:
+            raise CommandError(f'Starting a worker failed:\n{result.stderr[-2000:]}')
+        return result
+
+    def start(self, module):
+        """Milliseconds from spawning a worker until it has imported ``module``."""
+        spawned = time.time()
+        result = self.spawn(module)
+        # Interpreter startup included; its shutdown is not
+        return (float(result.stdout.splitlines()[-1]) - spawned) * 1000
+
+    def importtime(self, module):
+        return parse_importtime(self.spawn(module, '-X', 'importtime').stderr)
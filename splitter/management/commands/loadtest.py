@@ -0,0 +1,150 @@
+import asyncio
+import time
+import warnings
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from splitter.management.commands.bench import parse_scale, seed_group
+from splitter.management.commands.stress_writes import percentile
+
+DEFAULT_CONCURRENCY = [1, 10, 50]
+
+# Without a cache every report is computed, which is the load being tested
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+def read_paths(group):
+    base = f'/api/groups/{group.id}'
+    return {
+        'group_report': f'{base}/report/',
+        'group_members': f'{base}/members/list/',
+        'expense_list': f'{base}/expenses/',
+    }
+
+
+def summarize(timings):
+    return {
+        'requests': len(timings),
+        'p50_ms': round(percentile(timings, 50), 1),
+        'p95_ms': round(percentile(timings, 95), 1),
+        'max_ms': round(max(timings), 1),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Load-test the async read endpoints in-process through the ASGI handler: many '
+            'concurrent report, member and expense-list readers, optionally alongside PDF renders.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, action='append',
+                            help='Concurrent readers, can be repeated '
+                                 f'(default: {" ".join(map(str, DEFAULT_CONCURRENCY))}).')
+        parser.add_argument('--duration', type=float, default=5.0,
+                            help='Seconds to run each concurrency level.')
+        parser.add_argument('--scale', default='20x5000', help='MEMBERSxEXPENSES of the seeded group.')
+        parser.add_argument('--pdf', type=int, default=1,
+                            help='Period PDF renders kept running alongside the readers (default 1).')
+        parser.add_argument('--cache', action='store_true',
+                            help='Keep the response cache on (by default every report is computed).')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        n_members, n_expenses = parse_scale(options['scale'])
+        levels = options['concurrency'] or DEFAULT_CONCURRENCY
+        if min(levels) < 1 or options['duration'] <= 0:
+            raise CommandError('--concurrency and --duration must be positive')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            group = seed_group(options['scale'], n_members, n_expenses, options['seed'])
+            self.stdout.write(f"Seeded {options['scale']}; {options['duration']}s per level, "
+                              f"{options['pdf']} concurrent PDF render(s)")
+            caches = {} if options['cache'] else {'CACHES': NO_CACHE}
+            with override_settings(**caches):
+                for level in levels:
+                    self.report(level, asyncio.run(self.run(group, level, options)))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    async def run(self, group, concurrency, options):
+        paths = read_paths(group)
+        names = list(paths)
+        timings = {name: [] for name in names}
+        pdf_timings = []
+        errors = []
+        lag = [0.0]
+        # First requests pay for imports and URL resolver setup
+        warm = AsyncClient()
+        for path in paths.values():
+            await warm.get(path)
+        deadline = time.perf_counter() + options['duration']
+
+        async def reader(n):
+            client = AsyncClient()
+            i = n
+            while time.perf_counter() < deadline:
+                name = names[i % len(names)]
+                i += 1
+                started = time.perf_counter()
+                response = await client.get(paths[name])
+                if response.status_code != 200:
+                    errors.append(f'{name}: {response.status_code}')
+                timings[name].append((time.perf_counter() - started) * 1000)
+
+        async def renderer():
+            client = AsyncClient()
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.get(f'/api/groups/{group.id}/report/pdf/?from=1970-01-01')
+                if response.status_code != 200:
+                    errors.append(f'pdf: {response.status_code}')
+                with warnings.catch_warnings():
+                    # Django reads the file response in a worker thread, as an ASGI server would
+                    warnings.simplefilter('ignore')
+                    b''.join([chunk async for chunk in response])
+                pdf_timings.append((time.perf_counter() - started) * 1000)
+
+        async def loop_lag():
+            # How late a 10ms sleep wakes up: high when something blocks the loop
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lag[0] = max(lag[0], (time.perf_counter() - started - 0.01) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(reader(n) for n in range(concurrency)),
+            *(renderer() for _ in range(options['pdf'])),
+            loop_lag(),
+        )
+        elapsed = time.perf_counter() - started
+        return {
+            'concurrency': concurrency,
+            'elapsed': elapsed,
+            'reads': {name: summarize(t) for name, t in timings.items() if t},
+            'pdf': summarize(pdf_timings) if pdf_timings else None,
+            'loop_lag_ms': round(lag[0], 1),
+            'errors': errors,
+        }
+
+    def report(self, level, result):
+        total = sum(r['requests'] for r in result['reads'].values())
+        self.stdout.write(
+            f"concurrency {level}: {total / result['elapsed']:.0f} reads/s, "
+            f"max event loop lag {result['loop_lag_ms']}ms"
+        )
+        for name, r in result['reads'].items():
+            self.stdout.write(
+                f"  {name:<16} {r['requests']:>6} req  p50 {r['p50_ms']:>8.1f}ms  "
+                f"p95 {r['p95_ms']:>8.1f}ms  max {r['max_ms']:>8.1f}ms"
+            )
+        if result['pdf']:
+            r = result['pdf']
+            self.stdout.write(f"  {'pdf (period)':<16} {r['requests']:>6} req  p50 {r['p50_ms']:>8.1f}ms")
+        if result['errors']:
+            raise CommandError(f"{len(result['errors'])} failed request(s), e.g. {result['errors'][0]}")
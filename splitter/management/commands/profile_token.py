@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from splitter import profiling
+
+
+class Command(BaseCommand):
+    help = ('Print a signed token that lets API clients profile requests as a staff user '
+            '(send it as ?_profile=<token> or the X-Splitter-Profile header).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError(f"No user named {options['username']}")
+        if not (user.is_active and user.is_staff):
+            raise CommandError(f'{user.username} is not an active staff user')
+        self.stdout.write(profiling.make_token(user))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from splitter import ledger
+from splitter.models import Group
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored totals and line counts of expenses from their lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group', type=int, action='append', dest='groups',
+                            help='Only rebuild this group id (can be repeated).')
+        parser.add_argument('--check', action='store_true',
+                            help='Report drift without writing; exit non-zero if any is found.')
+
+    def handle(self, *args, **options):
+        groups = Group.objects.order_by('id')
+        if options['groups']:
+            groups = groups.filter(pk__in=options['groups'])
+
+        drifted = 0
+        for group_id in groups.values_list('id', flat=True):
+            drift = ledger.rebuild_expense_totals(group_id, fix=not options['check'])
+            for expense_id, stored, expected in drift:
+                self.stdout.write(
+                    f'group {group_id} expense {expense_id}: stored total/payments/splits='
+                    f'{stored[0]}/{stored[1]}/{stored[2]}, '
+                    f'expected {expected[0]}/{expected[1]}/{expected[2]}'
+                )
+            drifted += len(drift)
+
+        if options['check'] and drifted:
+            raise CommandError(f'{drifted} expense(s) out of sync')
+        action = 'found' if options['check'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{drifted} drifted expense(s) {action}'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from splitter import ledger
+from splitter.models import Group
+
+
+class Command(BaseCommand):
+    help = 'Backfill or repair the per-member daily rollups from the raw expense rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group', type=int, action='append', dest='groups',
+                            help='Only rebuild this group id (can be repeated).')
+        parser.add_argument('--check', action='store_true',
+                            help='Report drift without writing; exit non-zero if any is found.')
+
+    def handle(self, *args, **options):
+        groups = Group.objects.order_by('id')
+        if options['groups']:
+            groups = groups.filter(pk__in=options['groups'])
+
+        drifted = 0
+        for group_id in groups.values_list('id', flat=True):
+            drift = ledger.rebuild_rollups(group_id, fix=not options['check'])
+            for (user_id, day), (paid, owed), (exp_paid, exp_owed) in drift:
+                self.stdout.write(
+                    f'group {group_id} user {user_id} on {day}: rollup paid={paid} owed={owed}, '
+                    f'expected paid={exp_paid} owed={exp_owed}'
+                )
+            drifted += len(drift)
+
+        if options['check'] and drifted:
+            raise CommandError(f'{drifted} rollup row(s) out of sync')
+        action = 'found' if options['check'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{drifted} drifted row(s) {action}'))
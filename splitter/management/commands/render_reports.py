@@ -0,0 +1,111 @@
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from splitter import pdf_batch
+from splitter.management.commands.bench import parse_scale, seed_group
+from splitter.models import Group
+from splitter.settlement import DEFAULT_SOLVER, SOLVERS
+
+
+class _Discard:
+    def write(self, data):
+        return len(data)
+
+
+class Command(BaseCommand):
+    help = ('Render the settlement PDF of many groups on a process pool into one ZIP archive, '
+            'or benchmark PDFs per second with --bench.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group', type=int, action='append', dest='groups',
+                            help='Only render this group id (can be repeated; default: all groups).')
+        parser.add_argument('--output', '-o', help='ZIP file to write.')
+        parser.add_argument('--solver', default=DEFAULT_SOLVER, choices=sorted(SOLVERS))
+        parser.add_argument('--workers', type=int, action='append',
+                            help='Rendering processes (default: PDF_BATCH_WORKERS). With --bench '
+                                 'it can be repeated to compare several counts.')
+        parser.add_argument('--bench', action='store_true',
+                            help='Render synthetic groups from a throwaway database instead, '
+                                 'discarding the output, and report PDFs per second.')
+        parser.add_argument('--bench-groups', type=int, default=32, help='Groups seeded for --bench.')
+        parser.add_argument('--scale', default='10x200', help='MEMBERSxEXPENSES of each --bench group.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        levels = options['workers'] or [settings.PDF_BATCH_WORKERS]
+        if min(levels) < 1:
+            raise CommandError('--workers must be at least 1')
+        if options['bench']:
+            return self.bench(levels, options)
+        if not options['output']:
+            raise CommandError('--output is required (or use --bench)')
+        if len(levels) > 1:
+            raise CommandError('--workers can only be repeated with --bench')
+
+        groups = Group.objects.order_by('id')
+        if options['groups']:
+            groups = groups.filter(pk__in=options['groups'])
+        group_ids = list(groups.values_list('id', flat=True))
+        if options['groups']:
+            # Ids that don't exist are still listed in the archive's errors.txt
+            group_ids += sorted(set(options['groups']) - set(group_ids))
+
+        with open(options['output'], 'wb') as out:
+            stats = self.render(group_ids, out, levels[0], options['solver'])
+        if stats['missing']:
+            self.stderr.write(f"Groups not found: {', '.join(map(str, stats['missing']))}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {stats['pdfs']} PDF(s) to {options['output']} in {stats['seconds']:.1f}s "
+            f"({stats['pdfs'] / stats['seconds']:.1f} PDFs/s with {levels[0]} worker(s))"
+        ))
+
+    def render(self, group_ids, out, workers, solver, warm_up=False):
+        pool = pdf_batch.make_pool(workers)
+        try:
+            if warm_up:
+                # Start every worker (Django setup, imports, styles) before timing
+                for _ in pdf_batch.render_many(group_ids[:workers], solver, pool, workers):
+                    pass
+            return pdf_batch.write_zip(group_ids, out, solver, pool, workers)
+        finally:
+            pool.shutdown()
+
+    def bench(self, levels, options):
+        n_members, n_expenses = parse_scale(options['scale'])
+        if options['bench_groups'] < 1:
+            raise CommandError('--bench-groups must be at least 1')
+
+        setup_test_environment()
+        with tempfile.TemporaryDirectory() as tmp:
+            # The worker processes need a database they can open themselves
+            connection.settings_dict['TEST']['NAME'] = str(Path(tmp) / 'render.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                group_ids = [
+                    seed_group(f"{options['scale']}-{n}", n_members, n_expenses, options['seed']).id
+                    for n in range(options['bench_groups'])
+                ]
+                # Let the workers see the seeded rows
+                connection.close()
+                self.stdout.write(
+                    f"Seeded {len(group_ids)} groups of {options['scale']}; {os.cpu_count()} CPU(s)"
+                )
+                baseline = None
+                for workers in levels:
+                    stats = self.render(group_ids, _Discard(), workers, options['solver'], warm_up=True)
+                    rate = stats['pdfs'] / stats['seconds']
+                    baseline = baseline or rate
+                    self.stdout.write(
+                        f"  {workers:>3} worker(s): {stats['pdfs']} PDFs in {stats['seconds']:.2f}s, "
+                        f"{rate:.1f} PDFs/s ({rate / baseline:.2f}x), "
+                        f"{stats['bytes'] / stats['pdfs'] / 1024:.0f} KiB per PDF"
+                    )
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
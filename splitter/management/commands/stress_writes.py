@@ -0,0 +1,220 @@
+import json
+import random
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from splitter import ledger, writer
+from splitter.models import Expense, Group, GroupMember
+
+User = get_user_model()
+
+# Members every stress expense is shared between
+SEED_MEMBERS = 8
+
+
+def percentile(values, pct):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+class Outcome:
+    """Results collected from the worker threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.write_ms = []
+        self.read_ms = []
+        self.expenses = 0
+        self.lock_errors = 0
+        self.failures = []
+
+    def fail(self, what):
+        with self.lock:
+            self.failures.append(what)
+
+
+class Command(BaseCommand):
+    help = ('Hammer the expense, member and user creation endpoints from parallel threads '
+            'on a throwaway SQLite file database and fail on any "database is locked" error.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=16, help='Parallel writer threads.')
+        parser.add_argument('--requests', type=int, default=50, help='Write requests per writer.')
+        parser.add_argument('--readers', type=int, default=4,
+                            help='Threads fetching the group report while the writers run.')
+        parser.add_argument('--no-queue', action='store_true',
+                            help='Write directly from the request threads (SQLITE_WRITE_QUEUE off).')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This stress test is for the SQLite backend')
+        if options['writers'] < 1 or options['requests'] < 1:
+            raise CommandError('--writers and --requests must be at least 1')
+
+        setup_test_environment()
+        with tempfile.TemporaryDirectory() as tmp:
+            # A file database: an in-memory one has neither WAL nor the queue
+            connection.settings_dict['TEST']['NAME'] = str(Path(tmp) / 'stress.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                # Real password hashing is CPU-bound and would drown out the database
+                fast_hashing = ['django.contrib.auth.hashers.MD5PasswordHasher']
+                with override_settings(SQLITE_WRITE_QUEUE=not options['no_queue'],
+                                       PASSWORD_HASHERS=fast_hashing):
+                    self.run(options)
+            finally:
+                writer.get_queue().stop()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+    def run(self, options):
+        users = [User.objects.create_user(f'stress-{i}', password='!') for i in range(SEED_MEMBERS)]
+        group = Group.objects.create(name='stress', created_by=users[0])
+        for user in users:
+            GroupMember.objects.create(group=group, user=user)
+            ledger.ensure_member(group.id, user.id)
+        member_ids = [u.id for u in users]
+        queue = writer.get_queue()
+        batches_before, jobs_before = queue.batches, queue.jobs
+
+        outcome = Outcome()
+        done = threading.Event()
+        writers = [
+            threading.Thread(target=self.write, args=(n, group.id, member_ids, options, outcome))
+            for n in range(options['writers'])
+        ]
+        readers = [
+            threading.Thread(target=self.read, args=(group.id, done, outcome))
+            for _ in range(options['readers'])
+        ]
+        started = time.perf_counter()
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        for thread in readers:
+            thread.join()
+
+        stored = Expense.objects.filter(group=group).count()
+        drift = ledger.rebuild_group(group.id, fix=False) + ledger.rebuild_rollups(group.id, fix=False)
+        writes = len(outcome.write_ms)
+        mode = 'direct' if options['no_queue'] else 'write queue'
+        self.stdout.write(
+            f"{options['writers']} writers x {options['requests']} requests ({mode}), "
+            f"{options['readers']} readers"
+        )
+        self.stdout.write(
+            f'  writes: {writes} in {elapsed:.2f}s ({writes / elapsed:.0f}/s), '
+            f'p50 {percentile(outcome.write_ms, 50):.1f}ms, p95 {percentile(outcome.write_ms, 95):.1f}ms'
+        )
+        if outcome.read_ms:
+            self.stdout.write(
+                f'  reads:  {len(outcome.read_ms)}, p50 {percentile(outcome.read_ms, 50):.1f}ms, '
+                f'p95 {percentile(outcome.read_ms, 95):.1f}ms'
+            )
+        if not options['no_queue']:
+            batches = queue.batches - batches_before
+            jobs = queue.jobs - jobs_before
+            self.stdout.write(f'  writer: {jobs} jobs in {batches} commits ({jobs / max(batches, 1):.1f}/commit)')
+        self.stdout.write(f'  lock errors: {outcome.lock_errors}, other failures: {len(outcome.failures)}')
+        for failure in outcome.failures[:10]:
+            self.stderr.write(f'  {failure}')
+
+        if stored != outcome.expenses:
+            outcome.fail(f'{stored} expenses stored, {outcome.expenses} created')
+        if drift:
+            outcome.fail(f'{len(drift)} ledger/rollup row(s) out of sync')
+        if outcome.lock_errors or outcome.failures:
+            raise CommandError(
+                f'{outcome.lock_errors} lock error(s), {len(outcome.failures)} other failure(s)'
+            )
+        self.stdout.write(self.style.SUCCESS('No lock errors; ledger and rollups consistent'))
+
+    def write(self, n, group_id, member_ids, options, outcome):
+        rng = random.Random(f"{options['seed']}:{n}")
+        client = Client()
+        try:
+            for i in range(options['requests']):
+                if i % 10 == 9:
+                    # A new user joining the group
+                    requests = [
+                        ('/api/users/create/', {'username': f'joiner-{n}-{i}'}),
+                        (f'/api/groups/{group_id}/members/', None),
+                    ]
+                else:
+                    payers = rng.sample(member_ids, 2)
+                    sharers = rng.sample(member_ids, 3)
+                    requests = [(f'/api/groups/{group_id}/expenses/', {
+                        'description': f'stress {n}-{i}',
+                        'payments': [{'payer': uid, 'amount': '15.00'} for uid in payers],
+                        'splits': [{'member': uid, 'share': '10.00'} for uid in sharers],
+                    })]
+                user_id = None
+                for path, body in requests:
+                    if body is None:
+                        body = {'user_id': user_id}
+                    response = self.timed_post(client, path, body, outcome)
+                    if response is None:
+                        break
+                    if response.status_code >= 400:
+                        outcome.fail(f'POST {path} -> {response.status_code}: {response.content[:200]!r}')
+                        break
+                    if path.endswith('/expenses/'):
+                        with outcome.lock:
+                            outcome.expenses += 1
+                    user_id = response.json().get('id')
+        finally:
+            connection.close()
+
+    def timed_post(self, client, path, body, outcome):
+        started = time.perf_counter()
+        try:
+            response = client.post(path, json.dumps(body), content_type='application/json')
+        except OperationalError as exc:
+            with outcome.lock:
+                if 'locked' in str(exc):
+                    outcome.lock_errors += 1
+                else:
+                    outcome.failures.append(f'POST {path}: {exc}')
+            return None
+        except Exception as exc:
+            outcome.fail(f'POST {path}: {exc!r}')
+            return None
+        with outcome.lock:
+            outcome.write_ms.append((time.perf_counter() - started) * 1000)
+        return response
+
+    def read(self, group_id, done, outcome):
+        client = Client()
+        try:
+            while not done.is_set():
+                started = time.perf_counter()
+                try:
+                    response = client.get(f'/api/groups/{group_id}/report/')
+                except OperationalError as exc:
+                    with outcome.lock:
+                        if 'locked' in str(exc):
+                            outcome.lock_errors += 1
+                        else:
+                            outcome.failures.append(f'GET report: {exc}')
+                    continue
+                if response.status_code != 200:
+                    outcome.fail(f'GET report -> {response.status_code}')
+                    continue
+                with outcome.lock:
+                    outcome.read_ms.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection.close()
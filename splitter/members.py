@@ -0,0 +1,122 @@
+"""Adding many people to a group in one request.
+
+Each entry is a username, or an object with a ``username`` and/or
+``email``. All entries are resolved against existing users with a single
+``IN`` query; the missing users, memberships and ledger rows are then
+written with one ``bulk_create`` each, whatever the number of entries.
+
+Users created here get an unusable password instead of a hashed default:
+hashing is deliberately slow, and doing it per person would dominate the
+request. They can be given a password later like any other account.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db.models import Q
+
+from .models import GroupMember
+from .signals import mark_group_changed
+from . import ledger
+
+User = get_user_model()
+
+USERNAME_MAX_LENGTH = User._meta.get_field('username').max_length
+
+
+class EntryError(ValueError):
+    pass
+
+
+def parse_entries(entries):
+    """Normalise the request's entries to unique ``(username, email)`` pairs.
+
+    Either value may be None, but not both. Raises ``EntryError`` naming
+    the first malformed entry.
+    """
+    if not isinstance(entries, list) or not entries:
+        raise EntryError('members must be a non-empty list')
+    parsed = []
+    seen = set()
+    for index, entry in enumerate(entries):
+        if isinstance(entry, str):
+            entry = {'username': entry}
+        if not isinstance(entry, dict):
+            raise EntryError(f'members[{index}] must be a username or an object')
+        username = entry.get('username')
+        email = entry.get('email')
+        if not isinstance(username, (str, type(None))) or not isinstance(email, (str, type(None))):
+            raise EntryError(f'members[{index}]: username and email must be strings')
+        username = (username or '').strip() or None
+        email = User.objects.normalize_email((email or '').strip()) or None
+        if username is None and email is None:
+            raise EntryError(f'members[{index}] needs a username or an email')
+        if username is not None and len(username) > USERNAME_MAX_LENGTH:
+            raise EntryError(f'members[{index}]: username is longer than {USERNAME_MAX_LENGTH} characters')
+        key = (username, email)
+        if key not in seen:
+            seen.add(key)
+            parsed.append(key)
+    return parsed
+
+
+def add_members(group, entries):
+    """Get or create the users of ``entries`` and make them all members.
+
+    ``entries`` comes from ``parse_entries``. Entries with a username are
+    matched by username, email-only ones by email. Returns one dict per
+    entry, in order. Must run inside a transaction.
+    """
+    usernames = {username for username, _ in entries if username is not None}
+    emails = {email for username, email in entries if username is None}
+    by_username = {}
+    by_email = {}
+    # Email-only newcomers get their email as username, so look those up too
+    lookup = Q(username__in=usernames | emails) | Q(email__in=emails)
+    for user in User.objects.filter(lookup).order_by('id'):
+        by_username[user.username] = user
+        by_email.setdefault(user.email, user)
+
+    def existing(username, email):
+        if username is not None:
+            return by_username.get(username)
+        return by_email.get(email) or by_username.get(email)
+
+    missing = {}
+    for username, email in entries:
+        if existing(username, email) is None:
+            missing.setdefault(username or email, email or f'{username}@example.com')
+    unusable = make_password(None)
+    created = User.objects.bulk_create([
+        User(username=username, email=email, password=unusable)
+        for username, email in missing.items()
+    ])
+    for user in created:
+        by_username[user.username] = user
+        by_email.setdefault(user.email, user)
+    created_ids = {user.id for user in created}
+
+    users = [existing(username, email) or by_username[username or email] for username, email in entries]
+    user_ids = {user.id for user in users}
+    already = set(
+        GroupMember.objects.filter(group=group, user_id__in=user_ids).values_list('user_id', flat=True)
+    )
+    joined = user_ids - already
+    if joined:
+        GroupMember.objects.bulk_create([GroupMember(group=group, user_id=uid) for uid in sorted(joined)])
+        ledger.ensure_members(group.id, joined)
+        # bulk_create skips the post_save signal that bumps the version
+        mark_group_changed(group.id)
+
+    results = []
+    reported = set()
+    for user in users:
+        # Two entries can name the same person; only the first one added them
+        first = user.id not in reported
+        reported.add(user.id)
+        results.append({
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'user_created': first and user.id in created_ids,
+            'member_created': first and user.id in joined,
+        })
+    return results
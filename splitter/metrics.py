@@ -0,0 +1,215 @@
+"""In-process request, SQL and PDF render metrics.
+
+Every series keeps a fixed array of bucket counts, allocated the first time
+the series is seen, so recording a request is a few bisects and integer
+increments under one lock. ``render()`` writes everything out in the
+Prometheus text exposition format. Counts are per process.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+# Upper bounds of the histogram buckets; +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+PDF_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# SQL statements kept per request for the slow-request log
+MAX_CAPTURED_STATEMENTS = 1000
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        # bisect_left puts a value equal to a bound in that bound's bucket (le)
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class RouteStats:
+    __slots__ = ('latency', 'queries', 'sql_seconds', 'statuses', 'slow')
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql_seconds = 0.0
+        self.statuses = {}
+        self.slow = 0
+
+
+class RequestStats:
+    """SQL issued while serving one request."""
+    __slots__ = ('queries', 'sql_seconds', 'statements')
+
+    def __init__(self, capture=False):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements = [] if capture else None
+
+
+# The request being served in this context, read by the SQL hook below
+current_request = contextvars.ContextVar('splitter_metrics_request', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    """Database execute wrapper that charges each query to the current request.
+
+    It is installed once on every connection, and looks the request up via a
+    context variable so it also follows views run by ``sync_to_async``.
+    """
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.queries += 1
+        stats.sql_seconds += elapsed
+        if stats.statements is not None and len(stats.statements) < MAX_CAPTURED_STATEMENTS:
+            stats.statements.append((elapsed, sql))
+
+
+def install(connection, **kwargs):
+    """``connection_created`` receiver adding the SQL hook to a connection."""
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._pdf = {}
+
+    def record_request(self, route, method, status, seconds, stats, slow=False):
+        key = (route, method)
+        with self._lock:
+            route_stats = self._routes.get(key)
+            if route_stats is None:
+                route_stats = self._routes[key] = RouteStats()
+            route_stats.latency.observe(seconds)
+            route_stats.queries.observe(stats.queries)
+            route_stats.sql_seconds += stats.sql_seconds
+            route_stats.statuses[status] = route_stats.statuses.get(status, 0) + 1
+            if slow:
+                route_stats.slow += 1
+
+    def record_pdf_render(self, kind, seconds):
+        with self._lock:
+            histogram = self._pdf.get(kind)
+            if histogram is None:
+                histogram = self._pdf[kind] = Histogram(PDF_BUCKETS)
+            histogram.observe(seconds)
+
+    def queries(self):
+        """SQL queries charged to all requests recorded so far."""
+        with self._lock:
+            return sum(int(stats.queries.sum) for stats in self._routes.values())
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self._pdf.clear()
+
+    def render(self):
+        with self._lock:
+            routes = sorted(self._routes.items())
+            pdf = sorted(self._pdf.items())
+            out = []
+
+            _header(out, 'splitter_http_request_duration_seconds', 'histogram',
+                    'Time to produce a response, by route pattern and method.')
+            for (route, method), stats in routes:
+                _histogram(out, 'splitter_http_request_duration_seconds',
+                           {'route': route, 'method': method}, stats.latency)
+
+            _header(out, 'splitter_http_responses_total', 'counter',
+                    'Responses by route pattern, method and status code.')
+            for (route, method), stats in routes:
+                for status, count in sorted(stats.statuses.items()):
+                    labels = _labels({'route': route, 'method': method, 'status': str(status)})
+                    out.append(f'splitter_http_responses_total{labels} {count}')
+
+            _header(out, 'splitter_db_queries_per_request', 'histogram',
+                    'SQL queries issued per request.')
+            for (route, method), stats in routes:
+                _histogram(out, 'splitter_db_queries_per_request',
+                           {'route': route, 'method': method}, stats.queries)
+
+            _header(out, 'splitter_db_query_duration_seconds_total', 'counter',
+                    'Time spent executing SQL, by route pattern and method.')
+            for (route, method), stats in routes:
+                labels = _labels({'route': route, 'method': method})
+                out.append(f'splitter_db_query_duration_seconds_total{labels} {stats.sql_seconds:.6f}')
+
+            _header(out, 'splitter_slow_requests_total', 'counter',
+                    'Requests slower than METRICS_SLOW_REQUEST_SECONDS.')
+            for (route, method), stats in routes:
+                labels = _labels({'route': route, 'method': method})
+                out.append(f'splitter_slow_requests_total{labels} {stats.slow}')
+
+            _header(out, 'splitter_pdf_render_seconds', 'histogram',
+                    'Report PDF render time; kind is full or period.')
+            for kind, histogram in pdf:
+                _histogram(out, 'splitter_pdf_render_seconds', {'kind': kind}, histogram)
+
+        _group_state_cache(out)
+        return '\n'.join(out) + '\n'
+
+
+GROUP_STATE_CACHE_METRICS = {
+    'entries': ('gauge', 'Groups held in the group state cache.'),
+    'bytes': ('gauge', 'Estimated size of the cached group states.'),
+    'max_bytes': ('gauge', 'GROUP_STATE_CACHE_MAX_BYTES.'),
+    'hits': ('counter', 'Group state cache lookups answered from memory.'),
+    'misses': ('counter', 'Group state cache lookups that loaded from the database.'),
+    'evictions': ('counter', 'Group states evicted to stay under the memory cap.'),
+    'invalidations': ('counter', 'Cached group states dropped after a write.'),
+}
+
+
+def _group_state_cache(out):
+    from .group_cache import get_backend
+    stats = get_backend().stats()
+    for key, (kind, help_text) in GROUP_STATE_CACHE_METRICS.items():
+        if key in stats:
+            name = f'splitter_group_state_cache_{key}' + ('_total' if kind == 'counter' else '')
+            _header(out, name, kind, help_text)
+            out.append(f'{name} {stats[key]}')
+
+
+def _header(out, name, kind, help_text):
+    out.append(f'# HELP {name} {help_text}')
+    out.append(f'# TYPE {name} {kind}')
+
+
+def _labels(labels):
+    def escape(value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _histogram(out, name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.bounds + (float('inf'),), histogram.counts):
+        cumulative += count
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        out.append(f"{name}_bucket{_labels({**labels, 'le': le})} {cumulative}")
+    out.append(f'{name}_sum{_labels(labels)} {histogram.sum:.6f}')
+    out.append(f'{name}_count{_labels(labels)} {cumulative}')
+
+
+registry = Registry()
+
+
+def observe_pdf_render(kind, seconds):
+    registry.record_pdf_render(kind, seconds)
@@ -0,0 +1,71 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+slow_logger = logging.getLogger('splitter.slow_requests')
+
+
+class MetricsMiddleware:
+    """Record latency, status and SQL of every request in ``metrics.registry``.
+
+    With ``METRICS_SLOW_REQUEST_SECONDS`` set, the SQL of each request is
+    also kept and requests slower than that are logged to
+    ``splitter.slow_requests`` with their slowest statements.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_seconds = settings.METRICS_SLOW_REQUEST_SECONDS
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats = metrics.RequestStats(capture=self.slow_seconds is not None)
+        token = metrics.current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+        self.record(request, response, time.perf_counter() - started, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = metrics.RequestStats(capture=self.slow_seconds is not None)
+        token = metrics.current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+        self.record(request, response, time.perf_counter() - started, stats)
+        return response
+
+    def record(self, request, response, seconds, stats):
+        match = getattr(request, 'resolver_match', None)
+        # The URL pattern, not the path, keeps the number of series bounded
+        route = match.route if match is not None else '<unmatched>'
+        slow = self.slow_seconds is not None and seconds >= self.slow_seconds
+        metrics.registry.record_request(
+            route, request.method, response.status_code, seconds, stats, slow=slow
+        )
+        if slow:
+            self.log_slow(request, response, seconds, stats)
+
+    def log_slow(self, request, response, seconds, stats):
+        slowest = sorted(stats.statements, reverse=True)[:settings.METRICS_SLOW_SQL_LIMIT]
+        lines = [
+            f'{request.method} {request.get_full_path()} -> {response.status_code} '
+            f'in {seconds * 1000:.1f}ms, {stats.queries} queries ({stats.sql_seconds * 1000:.1f}ms SQL)'
+        ]
+        lines.extend(f'  {elapsed * 1000:8.2f}ms  {sql}' for elapsed, sql in slowest)
+        slow_logger.warning('\n'.join(lines))
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_balances(apps, schema_editor):
+    GroupMember = apps.get_model('splitter', 'GroupMember')
+    ExpensePayment = apps.get_model('splitter', 'ExpensePayment')
+    ExpenseSplit = apps.get_model('splitter', 'ExpenseSplit')
+    MemberBalance = apps.get_model('splitter', 'MemberBalance')
+
+    totals = {}
+    for group_id, user_id in GroupMember.objects.values_list('group_id', 'user_id'):
+        totals[(group_id, user_id)] = [0, 0]
+    paid_rows = ExpensePayment.objects.values_list('expense__group_id', 'payer_id').annotate(total=Sum('amount'))
+    for group_id, user_id, total in paid_rows:
+        totals.setdefault((group_id, user_id), [0, 0])[0] = total
+    owed_rows = ExpenseSplit.objects.values_list('expense__group_id', 'member_id').annotate(total=Sum('share'))
+    for group_id, user_id, total in owed_rows:
+        totals.setdefault((group_id, user_id), [0, 0])[1] = total
+
+    MemberBalance.objects.bulk_create([
+        MemberBalance(group_id=group_id, user_id=user_id, paid=paid, owed=owed, net=paid - owed)
+        for (group_id, user_id), (paid, owed) in totals.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('splitter', '0002_remove_expense_amount_remove_expense_payer_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('owed', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('net', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='splitter.group')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('group', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
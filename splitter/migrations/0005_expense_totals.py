@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:35
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_totals(apps, schema_editor):
+    Expense = apps.get_model('splitter', 'Expense')
+    ExpensePayment = apps.get_model('splitter', 'ExpensePayment')
+    ExpenseSplit = apps.get_model('splitter', 'ExpenseSplit')
+
+    totals = {}
+    for expense_id, count in ExpensePayment.objects.values_list('expense_id').annotate(n=Count('id')):
+        totals.setdefault(expense_id, [0, 0, 0])[1] = count
+    split_rows = ExpenseSplit.objects.values_list('expense_id').annotate(total=Sum('share'), n=Count('id'))
+    for expense_id, total, count in split_rows:
+        row = totals.setdefault(expense_id, [0, 0, 0])
+        row[0], row[2] = total, count
+
+    Expense.objects.bulk_update([
+        Expense(id=expense_id, total_amount=total, payment_count=payments, split_count=splits)
+        for expense_id, (total, payments, splits) in totals.items()
+    ], ['total_amount', 'payment_count', 'split_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('splitter', '0004_group_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='payment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='split_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['group', 'created_at', 'id'], name='expense_group_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expensepayment',
+            index=models.Index(fields=['payer', 'expense'], name='payment_payer_expense_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expensesplit',
+            index=models.Index(fields=['member', 'expense'], name='split_member_expense_idx'),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    ExpensePayment = apps.get_model('splitter', 'ExpensePayment')
+    ExpenseSplit = apps.get_model('splitter', 'ExpenseSplit')
+    DailyBalance = apps.get_model('splitter', 'DailyBalance')
+
+    totals = {}
+    paid_rows = (
+        ExpensePayment.objects.annotate(day=TruncDate('expense__created_at'))
+        .values_list('expense__group_id', 'payer_id', 'day').annotate(total=Sum('amount')).order_by()
+    )
+    for group_id, user_id, day, total in paid_rows:
+        totals.setdefault((group_id, user_id, day), [0, 0])[0] = total
+    owed_rows = (
+        ExpenseSplit.objects.annotate(day=TruncDate('expense__created_at'))
+        .values_list('expense__group_id', 'member_id', 'day').annotate(total=Sum('share')).order_by()
+    )
+    for group_id, user_id, day, total in owed_rows:
+        totals.setdefault((group_id, user_id, day), [0, 0])[1] = total
+
+    DailyBalance.objects.bulk_create([
+        DailyBalance(group_id=group_id, user_id=user_id, day=day, paid=paid, owed=owed)
+        for (group_id, user_id, day), (paid, owed) in totals.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('splitter', '0005_expense_totals'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('owed', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to='splitter.group')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['group', 'day'], name='dailybalance_group_day_idx')],
+                'unique_together': {('group', 'user', 'day')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
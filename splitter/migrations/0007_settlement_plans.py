@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('splitter', '0006_dailybalance'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SettlementPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('solver', models.CharField(max_length=20)),
+                ('version', models.PositiveBigIntegerField()),
+                ('history_from', models.PositiveBigIntegerField()),
+                ('solver_used', models.CharField(max_length=20)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='settlement_plans', to='splitter.group')),
+            ],
+            options={
+                'unique_together': {('group', 'solver')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SettlementTransfer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('position', models.PositiveIntegerField()),
+                ('added_version', models.PositiveBigIntegerField()),
+                ('removed_version', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('creditor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('debtor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfers', to='splitter.settlementplan')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['plan', 'removed_version'], name='transfer_plan_removed_idx')],
+            },
+        ),
+    ]
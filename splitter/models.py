@@ -7,6 +7,8 @@ class Group(models.Model):
     name = models.CharField(max_length=200)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_groups')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped by every write that can change the group's report
+    version = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
         return self.name
@@ -25,18 +27,31 @@ class Expense(models.Model):
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='expenses')
     description = models.CharField(max_length=500, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Stored sum of the splits and line counts, written together with the
+    # lines (see ledger.line_totals); rebuild_expense_totals repairs drift
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    payment_count = models.PositiveIntegerField(default=0)
+    split_count = models.PositiveIntegerField(default=0)
 
-    def __str__(self):
-        return f"{self.description} for {self.group.name}"
+    class Meta:
+        indexes = [
+            # Listing pages, period reports and exports walk a group by date
+            models.Index(fields=['group', 'created_at', 'id'], name='expense_group_created_idx'),
+        ]
 
-    def total_amount(self):
-        return sum(payment.amount for payment in self.payments.all())
+    def __str__(self):
+        return f"{self.description} ({self.total_amount})"
 
 class ExpensePayment(models.Model):
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='payments')
     payer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expense_payments')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['payer', 'expense'], name='payment_payer_expense_idx'),
+        ]
+
     def __str__(self):
         return f"{self.payer.username} paid {self.amount} for {self.expense.description}"
 
@@ -45,5 +60,76 @@ class ExpenseSplit(models.Model):
     member = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expense_splits')
     share = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['member', 'expense'], name='split_member_expense_idx'),
+        ]
+
     def __str__(self):
         return f"{self.member.username} owes {self.share} for {self.expense.description}"
+
+class MemberBalance(models.Model):
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='balances')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='group_balances')
+    paid = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    owed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    net = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('group', 'user')
+
+    def __str__(self):
+        return f"{self.user.username} net {self.net} in {self.group.name}"
+
+class DailyBalance(models.Model):
+    """What a member paid and owed in a group on one day (a rollup of the lines)."""
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='daily_balances')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_balances')
+    day = models.DateField()
+    paid = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    owed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('group', 'user', 'day')
+        indexes = [
+            models.Index(fields=['group', 'day'], name='dailybalance_group_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} on {self.day}: paid {self.paid} owed {self.owed}"
+
+class SettlementPlan(models.Model):
+    """The stored settlement plan of a group for one solver (see splitter.plans)."""
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='settlement_plans')
+    solver = models.CharField(max_length=20)
+    # Group version the current transfers settle, and the oldest version a
+    # diff can still be computed from (older transfers have been pruned)
+    version = models.PositiveBigIntegerField()
+    history_from = models.PositiveBigIntegerField()
+    # Solver that produced the plan the transfers were last rebuilt from
+    solver_used = models.CharField(max_length=20)
+
+    class Meta:
+        unique_together = ('group', 'solver')
+
+    def __str__(self):
+        return f"{self.solver} plan of group {self.group_id} at version {self.version}"
+
+class SettlementTransfer(models.Model):
+    """One transfer of a plan, valid from ``added_version`` until ``removed_version``."""
+    plan = models.ForeignKey(SettlementPlan, on_delete=models.CASCADE, related_name='transfers')
+    debtor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    creditor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    # Display order; a transfer whose amount changes keeps its place
+    position = models.PositiveIntegerField()
+    added_version = models.PositiveBigIntegerField()
+    removed_version = models.PositiveBigIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['plan', 'removed_version'], name='transfer_plan_removed_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.debtor_id} pays {self.creditor_id} {self.amount}"
@@ -0,0 +1,78 @@
+"""Bounded thread pool for the CPU-heavy parts of async views.
+
+Settlement solving and PDF building would stall every other request if
+they ran on the event loop, and ``sync_to_async`` would queue them behind
+all other sync code on its single shared thread. ``run()`` sends them to a
+pool of ``ASYNC_CPU_WORKERS`` threads instead; work beyond that waits in
+the pool's queue, so a burst of renders can't take over the process.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from . import profiling
+
+_executor = None
+_workers = 0
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor, _workers
+    with _executor_lock:
+        if _executor is None:
+            _workers = settings.ASYNC_CPU_WORKERS
+            _executor = ThreadPoolExecutor(max_workers=_workers, thread_name_prefix='offload')
+        return _executor
+
+
+def shutdown():
+    """Finish the queued work and stop the pool's threads.
+
+    Pool threads keep their connections between jobs like request threads
+    (``CONN_MAX_AGE``), so each one closes its own before it exits.
+    """
+    global _executor
+    with _executor_lock:
+        executor, workers, _executor = _executor, _workers, None
+    if executor is None:
+        return
+    # Every thread waits at the barrier, so each takes exactly one of these
+    barrier = threading.Barrier(workers)
+
+    def close():
+        barrier.wait()
+        connections.close_all()
+
+    for _ in range(workers):
+        executor.submit(close)
+    executor.shutdown()
+
+
+def _call(context, fn, args, kwargs):
+    sampler = context.get(profiling.current)
+    try:
+        if sampler is None:
+            return context.run(fn, *args, **kwargs)
+        # The request is being profiled, and this thread works for it
+        with sampler.working():
+            return context.run(fn, *args, **kwargs)
+    finally:
+        # Pool threads outlive requests, so expire their connections like one
+        close_old_connections()
+
+
+async def run(fn, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)`` on the pool and await its result.
+
+    ``fn`` runs in a copy of the caller's context, so per-request metrics
+    still see its SQL, and a profiled request its calls.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(_call, contextvars.copy_context(), fn, args, kwargs)
+    return await loop.run_in_executor(get_executor(), call)
@@ -0,0 +1,252 @@
+"""ReportLab rendering of a group's settlement report.
+
+The expense history is read with a server-side iterator and laid out as a
+series of page-sized tables, each repeating the header row. Flowables are
+generated lazily while ReportLab consumes them, so memory stays bounded
+however long the history is.
+
+ReportLab is slow to import, so nothing imports this module until a PDF
+is rendered and workers that never render one start without it.
+"""
+import functools
+import time
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.enums import TA_CENTER
+from django.conf import settings
+
+from .models import Group, GroupMember, Expense
+from .settlement import DEFAULT_SOLVER
+from . import engine, group_cache, metrics
+
+
+class LazyFlowables(list):
+    """Flowable list that refills itself from a generator as it is consumed.
+
+    ``BaseDocTemplate.build`` pops flowables off the front and checks
+    ``len()`` before each one, so topping up there keeps only a small
+    window of the document alive at a time.
+    """
+
+    def __init__(self, source):
+        super().__init__()
+        self._source = iter(source)
+
+    def __len__(self):
+        while self._source is not None and list.__len__(self) < 2:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+        return list.__len__(self)
+
+
+class ReportStyles:
+    """Paragraph and table styles of the report, shared by every render."""
+
+    def __init__(self):
+        sheet = getSampleStyleSheet()
+        self.normal = sheet['Normal']
+        self.title = ParagraphStyle(
+            'CustomTitle',
+            parent=sheet['Heading1'],
+            fontSize=24,
+            textColor=colors.HexColor('#667eea'),
+            spaceAfter=30,
+            alignment=TA_CENTER
+        )
+        self.heading = ParagraphStyle(
+            'CustomHeading',
+            parent=sheet['Heading2'],
+            fontSize=16,
+            textColor=colors.HexColor('#333333'),
+            spaceAfter=12,
+            spaceBefore=20
+        )
+        self.balance_table = _table_style(amount_column=1, header_size=12)
+        self.settlement_table = _table_style(amount_column=2, header_size=12)
+        self.expense_table = _table_style(
+            amount_column=1, header_size=10,
+            extra=[('FONTSIZE', (0, 1), (-1, -1), 8), ('VALIGN', (0, 0), (-1, -1), 'TOP')]
+        )
+
+
+def _table_style(amount_column, header_size, extra=()):
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('ALIGN', (amount_column, 0), (amount_column, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), header_size),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f5f5f5')]),
+        *extra
+    ])
+
+
+@functools.cache
+def get_styles():
+    """The ``ReportStyles`` of this process, built on first use."""
+    return ReportStyles()
+
+
+def render_group_report(group_id, out, solver=DEFAULT_SOLVER, start=None, end=None):
+    """Write the settlement report PDF of a group to the file object ``out``.
+
+    With ``start``/``end`` (dates, inclusive) the balances, settlements and
+    history cover only the expenses of that period. Returns the name of the
+    settlement solver that produced the plan.
+    """
+    started = time.perf_counter()
+    group = Group.objects.get(pk=group_id)
+    members = list(GroupMember.objects.filter(group=group).select_related('user'))
+    member_ids = [m.user.id for m in members]
+
+    if start is None and end is None:
+        # The group's stored plan, as the report and live page show it
+        state = group_cache.get_state(group.id)
+        net_balance = dict(zip(state.user_ids, state.net))
+        settlements, used = state.plan(solver)
+    else:
+        result = engine.group_report(
+            group.id, member_ids, source='rollups', solver=solver, period=(start, end)
+        )
+        net_balance, settlements, used = result.net_by_user(), result.settlements, result.solver
+
+    expenses = Expense.objects.filter(group=group)
+    if start is not None:
+        expenses = expenses.filter(created_at__date__gte=start)
+    if end is not None:
+        expenses = expenses.filter(created_at__date__lte=end)
+
+    doc = SimpleDocTemplate(out, pagesize=letter, topMargin=0.75*inch, bottomMargin=0.75*inch)
+    doc.build(LazyFlowables(
+        _report_flowables(group, members, net_balance, settlements, expenses, start, end)
+    ))
+    kind = 'full' if start is None and end is None else 'period'
+    metrics.observe_pdf_render(kind, time.perf_counter() - started)
+    return used
+
+
+def _period_label(start, end):
+    if start and end:
+        return f"{start:%Y-%m-%d} to {end:%Y-%m-%d}"
+    if start:
+        return f"from {start:%Y-%m-%d}"
+    return f"until {end:%Y-%m-%d}"
+
+
+def _report_flowables(group, members, net_balance, settlements, expenses, start, end):
+
+    user_id_to_name = {}
+    for m in members:
+        user_id_to_name[m.user.id] = m.user.username
+
+    styles = get_styles()
+
+    # Title
+    title = Paragraph(f"Settlement Report: {group.name}", styles.title)
+    yield title
+    if start or end:
+        yield Paragraph(f"Period: {_period_label(start, end)}", styles.normal)
+    yield Spacer(1, 0.3*inch)
+
+    # Member Balances Section
+    balances_heading = Paragraph("Member Balances", styles.heading)
+    yield balances_heading
+
+    balance_data = [['Member', 'Balance']]
+    for m in members:
+        balance = net_balance.get(m.user.id, 0) / 100
+        balance_str = f"${balance:+.2f}" if balance != 0 else "$0.00"
+        balance_data.append([m.user.username, balance_str])
+
+    balance_table = Table(balance_data, colWidths=[3*inch, 2*inch])
+    balance_table.setStyle(styles.balance_table)
+    yield balance_table
+    yield Spacer(1, 0.4*inch)
+
+    # Settlements Section
+    settlements_heading = Paragraph("Settlements Needed", styles.heading)
+    yield settlements_heading
+
+    if settlements:
+        settlement_data = [['From', 'To', 'Amount']]
+        for debtor, creditor, cents in settlements:
+            from_user = user_id_to_name.get(debtor, 'Unknown')
+            to_user = user_id_to_name.get(creditor, 'Unknown')
+            settlement_data.append([from_user, to_user, f"${cents / 100:.2f}"])
+
+        settlement_table = Table(settlement_data, colWidths=[2*inch, 2*inch, 1.5*inch])
+        settlement_table.setStyle(styles.settlement_table)
+        yield settlement_table
+    else:
+        all_settled = Paragraph("All settled up! 🎉", styles.normal)
+        yield all_settled
+
+    yield Spacer(1, 0.4*inch)
+
+    # Expense History Section
+    expense_history_heading = Paragraph("Expense History", styles.heading)
+    yield expense_history_heading
+
+    rows_per_table = settings.PDF_EXPENSE_ROWS_PER_TABLE
+    expense_data = None
+    for row in _expense_rows(expenses, user_id_to_name, rows_per_table):
+        if expense_data is None:
+            expense_data = [EXPENSE_HEADER]
+        expense_data.append(row)
+        if len(expense_data) > rows_per_table:
+            yield _expense_table(expense_data)
+            expense_data = [EXPENSE_HEADER]
+
+    if expense_data is None:
+        no_expenses = Paragraph("No expenses recorded yet.", styles.normal)
+        yield no_expenses
+    elif len(expense_data) > 1:
+        yield _expense_table(expense_data)
+
+
+EXPENSE_HEADER = ['Description', 'Total', 'Paid By', 'Split Among']
+
+
+def _expense_rows(expenses, user_id_to_name, chunk_size):
+    expenses = expenses.order_by('created_at', 'id').prefetch_related('payments', 'splits')
+    for exp in expenses.iterator(chunk_size=chunk_size):
+        total_exp = exp.total_amount
+
+        # Get payers info
+        payers_info = []
+        for payment in exp.payments.all():
+            payer_name = user_id_to_name.get(payment.payer_id, 'Unknown')
+            payers_info.append(f"{payer_name} (${payment.amount:.2f})")
+        payers_str = ', '.join(payers_info) if payers_info else 'N/A'
+
+        # Get split members info
+        split_members = []
+        for split in exp.splits.all():
+            member_name = user_id_to_name.get(split.member_id, 'Unknown')
+            split_members.append(f"{member_name} (${split.share:.2f})")
+        splits_str = ', '.join(split_members) if split_members else 'N/A'
+
+        yield [
+            exp.description or 'No description',
+            f"${total_exp:.2f}",
+            payers_str,
+            splits_str
+        ]
+
+
+def _expense_table(expense_data):
+    expense_table = Table(
+        expense_data, colWidths=[1.8*inch, 0.8*inch, 1.8*inch, 1.8*inch], repeatRows=1
+    )
+    expense_table.setStyle(get_styles().expense_table)
+    return expense_table
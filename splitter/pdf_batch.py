@@ -0,0 +1,135 @@
+"""Settlement PDFs of many groups, rendered on a process pool into one ZIP.
+
+ReportLab layout is pure-Python CPU work, so threads would take turns on
+the GIL; separate processes let a batch use every core. Each worker sets
+up Django, opens its own database connection and builds the report styles
+once, then renders one group per task. At most two tasks per worker are in
+flight, so a slow consumer (a client downloading the ZIP) holds back the
+rendering instead of letting finished PDFs pile up in memory.
+
+The archive is written with ``zipfile`` to a sink that hands each finished
+entry straight to the caller, so a ZIP of any size streams in bounded
+memory. Entries are stored uncompressed: the PDFs are already compressed.
+"""
+import multiprocessing
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.utils.text import slugify
+
+from .settlement import DEFAULT_SOLVER
+from . import pdf_worker
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def make_pool(workers):
+    # "spawn" rather than fork: a forked worker would share the parent's
+    # SQLite handles and any threads it had running
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=pdf_worker.init, initargs=(str(connection.settings_dict['NAME']),)
+    )
+
+
+def get_pool():
+    """The process-wide pool of ``PDF_BATCH_WORKERS`` used by the API and admin."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = make_pool(settings.PDF_BATCH_WORKERS)
+        return _pool
+
+
+def render_many(group_ids, solver=DEFAULT_SOLVER, pool=None, workers=None):
+    """Yield ``(group_id, name, pdf_bytes)`` for each id, in order.
+
+    ``name`` and ``pdf_bytes`` are None for groups that don't exist. Without
+    a ``pool`` (made by ``make_pool(workers)``) the shared one is used.
+    """
+    if pool is None:
+        pool, workers = get_pool(), settings.PDF_BATCH_WORKERS
+    pending = deque()
+    for group_id in group_ids:
+        pending.append(pool.submit(pdf_worker.render, group_id, solver))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def entry_name(group_id, name):
+    return f'settlement_report_{group_id}_{slugify(name) or "group"}.pdf'
+
+
+class _Sink:
+    """Unseekable file object collecting what ``zipfile`` writes."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def zip_stream(rendered, stats=None):
+    """Yield the bytes of a ZIP of ``render_many`` output, one entry at a time.
+
+    Missing groups are listed in an ``errors.txt`` entry at the end. When
+    given, ``stats`` (a dict) receives the number of PDFs and bytes written.
+    """
+    sink = _Sink()
+    missing = []
+    count = size = 0
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for group_id, name, data in rendered:
+            if data is None:
+                missing.append(group_id)
+                continue
+            archive.writestr(entry_name(group_id, name), data)
+            count += 1
+            size += len(data)
+            yield sink.take()
+        if missing:
+            archive.writestr('errors.txt', ''.join(f'group {group_id}: not found\n' for group_id in missing))
+    yield sink.take()
+    if stats is not None:
+        stats.update(pdfs=count, bytes=size, missing=missing)
+
+
+def write_zip(group_ids, out, solver=DEFAULT_SOLVER, pool=None, workers=None):
+    """Render ``group_ids`` into a ZIP written to the file object ``out``.
+
+    Returns ``{'pdfs', 'bytes', 'missing', 'seconds'}``.
+    """
+    stats = {}
+    started = time.perf_counter()
+    for chunk in zip_stream(render_many(group_ids, solver, pool, workers), stats):
+        out.write(chunk)
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+def zip_response(group_ids, solver=DEFAULT_SOLVER):
+    """Streaming download of the ZIP, rendered on the shared pool."""
+    response = StreamingHttpResponse(
+        zip_stream(render_many(group_ids, solver)), content_type='application/zip'
+    )
+    response['Content-Disposition'] = 'attachment; filename="settlement_reports.zip"'
+    return response
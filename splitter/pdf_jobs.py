@@ -0,0 +1,156 @@
+"""Background rendering and on-disk caching of report PDFs.
+
+Rendering runs on a local thread pool instead of the request thread. Each
+finished PDF is stored under ``PDF_CACHE_DIR`` keyed by group id, group
+change-version and settlement solver, so downloads of an unchanged group
+are served from disk without rendering anything. A job is identified by
+the same key, so concurrent requests for one version share one render.
+
+``splitter.pdf`` (and with it ReportLab) is only imported by the first
+render, so processes that never build a PDF don't pay for loading it.
+"""
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+
+_executor = None
+_executor_lock = threading.Lock()
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def cache_dir():
+    path = Path(settings.PDF_CACHE_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def job_id_for(group_id, version, solver):
+    return f'{group_id}-{version}-{solver}'
+
+
+def cached_report(group_id, version, solver):
+    """Path of the rendered PDF for this group version, or None."""
+    matches = sorted(cache_dir().glob(f'group{job_id_for(group_id, version, solver)}-*.pdf'))
+    return matches[0] if matches else None
+
+
+def solver_of(path):
+    """Name of the solver that actually produced a cached report."""
+    return Path(path).stem.rsplit('-', 1)[1]
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PDF_RENDER_WORKERS, thread_name_prefix='pdf-render'
+            )
+        return _executor
+
+
+class RenderJob:
+    def __init__(self, group_id, version, solver):
+        self.id = job_id_for(group_id, version, solver)
+        self.group_id = group_id
+        self.version = version
+        self.solver = solver
+        self.future = None
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return 'pending'
+        return 'failed' if self.future.exception() else 'done'
+
+    def status_url(self):
+        return reverse('report-pdf-job', kwargs={'job_id': self.id})
+
+    def as_dict(self):
+        data = {'job_id': self.id, 'status': self.status, 'status_url': self.status_url()}
+        if self.status == 'done':
+            url = reverse('download-report-pdf', kwargs={'group_id': self.group_id})
+            data['download_url'] = f'{url}?solver={self.solver}'
+        elif self.status == 'failed':
+            data['error'] = str(self.future.exception())
+        return data
+
+
+def render_period(group_id, solver, start=None, end=None):
+    """Render a one-off report of a period, uncached: ``(file, solver used)``.
+
+    The file is a spool positioned at its start; it only touches disk for
+    documents over ``PDF_SPOOL_MAX_MEMORY``.
+    """
+    from . import pdf
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.PDF_SPOOL_MAX_MEMORY)
+    used = pdf.render_group_report(group_id, spool, solver=solver, start=start, end=end)
+    spool.seek(0)
+    return spool, used
+
+
+def _render(job):
+    from . import pdf
+    target = cache_dir()
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=target, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                used = pdf.render_group_report(job.group_id, out, solver=job.solver)
+            final = target / f'group{job.id}-{used}.pdf'
+            # Publish atomically so readers never see a half-written file
+            os.replace(tmp_path, final)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        # Older versions of this group can no longer be requested
+        for stale in target.glob(f'group{job.group_id}-*.pdf'):
+            if stale != final and not stale.name.startswith(f'group{job.group_id}-{job.version}-'):
+                stale.unlink(missing_ok=True)
+        return final
+    finally:
+        connections.close_all()
+
+
+def submit(group_id, version, solver):
+    """Queue a render of this group version, reusing a job already queued."""
+    job_id = job_id_for(group_id, version, solver)
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None and job.status != 'failed':
+            return job
+        job = RenderJob(group_id, version, solver)
+        job.future = _get_executor().submit(_render, job)
+        _jobs[job_id] = job
+        # Forget finished jobs; their output lives on in the cache
+        for old_id in [k for k, j in _jobs.items() if j.future.done() and k != job_id]:
+            del _jobs[old_id]
+        return job
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        return job
+
+    # Finished jobs are dropped from memory but their PDF stays cached
+    try:
+        group_id, version, solver = job_id.split('-', 2)
+        group_id, version = int(group_id), int(version)
+    except ValueError:
+        return None
+    path = cached_report(group_id, version, solver)
+    if path is None:
+        return None
+    job = RenderJob(group_id, version, solver)
+    job.future = Future()
+    job.future.set_result(path)
+    return job
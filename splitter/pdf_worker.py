@@ -0,0 +1,29 @@
+"""Entry points of the ``pdf_batch`` worker processes.
+
+Workers are spawned, so this module is imported before Django is set up
+and must not import models at module level.
+"""
+import io
+
+
+def init(db_name):
+    # The name carries over a database chosen at runtime, e.g. the
+    # throwaway one of render_reports --bench
+    import django
+    django.setup()
+    from django.db import connection
+    from . import pdf
+    connection.settings_dict['NAME'] = db_name
+    pdf.get_styles()
+
+
+def render(group_id, solver):
+    """``(group_id, name, pdf_bytes)``; name and bytes are None for a missing group."""
+    from .models import Group
+    from . import pdf
+    name = Group.objects.filter(pk=group_id).values_list('name', flat=True).first()
+    if name is None:
+        return group_id, None, None
+    out = io.BytesIO()
+    pdf.render_group_report(group_id, out, solver=solver)
+    return group_id, name, out.getvalue()
@@ -0,0 +1,381 @@
+"""Stored settlement plans, kept stable across changes and diffable by version.
+
+Each group has one ``SettlementPlan`` per solver. Its transfers are rows
+valid from the group version that added them until the one that removed
+them, so the changes since any version a client has seen are two simple
+queries. The plan is brought up to date lazily, the first time it is read
+after the group changed: ``settlement.adjust`` carries the previous
+transfers over to the new balances instead of solving from scratch, so one
+new expense only moves the transfers of the people it involves. If that
+leaves more than ``SETTLEMENT_PLAN_MAX_EXTRA_TRANSFERS`` transfers beyond
+a fresh solve, the fresh plan is used instead; transfers it shares with
+the old plan still keep their rows and positions.
+
+Reads never wait on the write queue: the updated plan is worked out on the
+reader's connection from the stored one, served straight away and saved
+with ``writer.defer``. Until it is saved it is kept in memory, and later
+versions are worked out from it rather than from the older stored plan,
+so every reader in the process serves the same plan for a version however
+the saves interleave with the reads.
+
+Removed transfers are pruned once they are ``SETTLEMENT_PLAN_HISTORY``
+versions old; a client asking for changes since before that gets the whole
+plan again, marked ``reset``.
+"""
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Q
+
+from .models import SettlementPlan, SettlementTransfer
+from .settlement import adjust, solve
+from . import engine, writer
+
+# The latest plan worked out by a reader and queued for saving, per (group,
+# solver); dropped once it is stored
+_unsaved = {}
+# How many entries have been dropped; a reader that saw this change may
+# have read the stored plan from before the save
+_dropped = 0
+_unsaved_lock = threading.Lock()
+
+
+class _Plan:
+    """A plan as readers see it: stored, or worked out and queued for saving.
+
+    ``rows`` are the open transfers as ``(debtor, creditor, cents, position,
+    added_version)`` in position order; ``removed`` the transfers closed
+    since the stored plan, with their ``removed_version`` appended.
+    ``next_position`` is None when it still has to be read from the table.
+    """
+    __slots__ = ('version', 'rows', 'removed', 'used', 'next_position')
+
+    def __init__(self, version, rows, removed, used, next_position):
+        self.version = version
+        self.rows = rows
+        self.removed = removed
+        self.used = used
+        self.next_position = next_position
+
+
+def _open_at(version):
+    """Transfers open at ``version``.
+
+    Reads outside a transaction don't share a snapshot, so a save may
+    commit between reading a plan and its transfers; going by the plan's
+    own version keeps the two consistent.
+    """
+    return Q(added_version__lte=version) & (
+        Q(removed_version__isnull=True) | Q(removed_version__gt=version)
+    )
+
+
+def _open_rows(plan):
+    """``(pk, debtor, creditor, cents, position, added_version)`` of the
+    plan's current transfers, in position order."""
+    if plan is None:
+        return []
+    return list(
+        plan.transfers.filter(_open_at(plan.version)).order_by('position')
+        .values_list('id', 'debtor_id', 'creditor_id', engine.cents_column('amount'),
+                     'position', 'added_version')
+    )
+
+
+def _next_position(plan):
+    if plan is None:
+        return 0
+    last = plan.transfers.filter(added_version__lte=plan.version).aggregate(last=Max('position'))['last']
+    return 0 if last is None else last + 1
+
+
+def _reconcile(open_rows, settlements, next_position):
+    """Match a new plan against the open rows by (debtor, creditor).
+
+    ``open_rows`` are ``(pk, debtor, creditor, cents, position,
+    added_version)``. Returns ``(rows, closed)``: the new plan as
+    ``(debtor, creditor, cents, position, added_version)`` in position
+    order, ``added_version`` being None for rows still to be written, and
+    the open rows it replaces or drops. A transfer whose amount changed
+    keeps its position.
+    """
+    by_pair = {(row[1], row[2]): row for row in open_rows}
+    rows = []
+    closed = []
+    for debtor, creditor, cents in settlements:
+        old = by_pair.pop((debtor, creditor), None)
+        if old is not None and old[3] == cents:
+            rows.append((debtor, creditor, cents, old[4], old[5]))
+            continue
+        if old is not None:
+            closed.append(old)
+            position = old[4]
+        else:
+            position = next_position
+            next_position += 1
+        rows.append((debtor, creditor, cents, position, None))
+    closed.extend(by_pair.values())
+    rows.sort(key=lambda row: row[3])
+    return rows, closed
+
+
+def _latest(plan, open_rows, seen):
+    """The newest plan readers know of: the unsaved one ``seen`` (looked up
+    before the stored ``plan`` was read) when it is newer, else the stored one."""
+    if seen is not None and (plan is None or seen.version > plan.version):
+        return seen
+    if plan is None:
+        return None
+    return _Plan(plan.version, [row[1:] for row in open_rows], [], plan.solver_used, None)
+
+
+def _advance(state, solver, plan, base, solved=None):
+    """``base`` carried over to the balances of ``state``, as a new ``_Plan``.
+
+    ``solved`` is the fresh solve of the balances, when already done. If
+    carrying over leaves too many extra transfers, the fresh plan is used.
+    """
+    user_ids, net = state.arrays()
+    settlements, used = solved or solve(user_ids, net, solver)
+    if base is not None:
+        adjusted = adjust([row[:3] for row in base.rows], user_ids, net)
+        if len(adjusted) <= len(settlements) + settings.SETTLEMENT_PLAN_MAX_EXTRA_TRANSFERS:
+            settlements, used = adjusted, base.used
+    if base is None or base.next_position is None:
+        next_position = _next_position(plan)
+    else:
+        next_position = base.next_position
+    rows, closed = _reconcile(
+        [(None, *row) for row in base.rows] if base is not None else [], settlements, next_position
+    )
+    version = state.version
+    rows = [row[:4] + (version if row[4] is None else row[4],) for row in rows]
+    removed = (base.removed if base is not None else []) + [row[1:] + (version,) for row in closed]
+    next_position = max([next_position] + [row[3] + 1 for row in rows])
+    return _Plan(version, rows, removed, used, next_position)
+
+
+def _stored(group_id, solver):
+    plan = SettlementPlan.objects.filter(group_id=group_id, solver=solver).first()
+    return plan, _open_rows(plan)
+
+
+def _plan_of(state, solver, plan, open_rows, seen, solved=None):
+    """``(_Plan of state, stored plan it follows)``, the first queued for
+    saving if it is new.
+
+    ``seen`` is ``(_unsaved's entry, _dropped)`` as they were before
+    ``plan`` was read. If an entry was stored meanwhile, ``plan`` may be
+    older than it and is read again.
+    """
+    key = (state.group_id, solver)
+    seen, dropped = seen
+    while True:
+        base = _latest(plan, open_rows, seen)
+        if base is not None and base.version >= state.version:
+            return base, plan
+        pending = _advance(state, solver, plan, base, solved)
+        with _unsaved_lock:
+            latest = _unsaved.get(key)
+            # Entries are never reused, but "none" is: it only still holds
+            # if nothing was dropped
+            if latest is seen and (seen is not None or dropped == _dropped):
+                _unsaved[key] = pending
+                break
+            dropped = _dropped
+        # Another reader queued a plan meanwhile; go on from that one
+        seen = latest
+        if seen is None:
+            # ... or it was stored
+            plan, open_rows = _stored(*key)
+    writer.defer(lambda: _save(key))
+    return pending, plan
+
+
+def _unsaved_plan(group_id, solver):
+    with _unsaved_lock:
+        return _unsaved.get((group_id, solver)), _dropped
+
+
+def current(state, solver):
+    """``(settlements, solver used)`` of the stored plan of a ``GroupState``.
+
+    Two queries when the plan is current; otherwise it is brought up to
+    date in memory and saved in the background.
+    """
+    seen = _unsaved_plan(state.group_id, solver)
+    latest, _ = _plan_of(state, solver, *_stored(state.group_id, solver), seen)
+    return [row[:3] for row in latest.rows], latest.used
+
+
+def _forget(key, version=None):
+    """Drop the unsaved plan of ``key`` if it is stored (up to ``version``),
+    or in any case if ``version`` is None."""
+    global _dropped
+    with _unsaved_lock:
+        latest = _unsaved.get(key)
+        if latest is not None and (version is None or latest.version <= version):
+            del _unsaved[key]
+            _dropped += 1
+
+
+def _save(key):
+    try:
+        version = _write(*key)
+    except Exception:
+        # Later plans were worked out from this one; start again from the table
+        _forget(key)
+        raise
+    if version is not None:
+        # Readers go by the stored plan once the write is visible to them
+        transaction.on_commit(lambda: _forget(key, version))
+
+
+def _write(group_id, solver):
+    """Store the latest unsaved plan of a group as it was served.
+
+    Rows keep the positions and versions readers saw, and transfers that
+    were added and removed again before a save are stored as well, so the
+    history diffs are read from matches what was served, however saves
+    were queued. Returns the version stored, or None.
+    """
+    with _unsaved_lock:
+        pending = _unsaved.get((group_id, solver))
+    if pending is None:
+        return None
+    plan = (
+        SettlementPlan.objects.select_for_update()
+        .filter(group_id=group_id, solver=solver).first()
+    )
+    if plan is not None and plan.version >= pending.version:
+        # Someone else got there first
+        return plan.version
+    if plan is None:
+        try:
+            with transaction.atomic():
+                plan = SettlementPlan.objects.create(
+                    group_id=group_id, solver=solver, version=pending.version,
+                    history_from=pending.version, solver_used=pending.used
+                )
+        except IntegrityError:
+            return None
+
+    stored = {row[1:]: row[0] for row in _open_rows(plan)}
+    served = set(pending.rows)
+    removed_at = {row[:5]: row[5] for row in pending.removed}
+    closed = {}
+    for row, pk in stored.items():
+        if row not in served:
+            closed.setdefault(removed_at.get(row, pending.version), []).append(pk)
+    for removed_version, pks in closed.items():
+        SettlementTransfer.objects.filter(pk__in=pks).update(removed_version=removed_version)
+    new_rows = [row + (None,) for row in pending.rows if row not in stored]
+    new_rows += [row for row in pending.removed if row[4] > plan.version and row[:5] not in stored]
+    SettlementTransfer.objects.bulk_create([
+        SettlementTransfer(
+            plan=plan, debtor_id=debtor, creditor_id=creditor, amount=Decimal(cents) / 100,
+            position=position, added_version=added, removed_version=removed
+        )
+        for debtor, creditor, cents, position, added, removed in new_rows
+    ])
+
+    cutoff = pending.version - settings.SETTLEMENT_PLAN_HISTORY
+    if cutoff > plan.history_from:
+        plan.transfers.filter(removed_version__lte=cutoff).delete()
+        plan.history_from = cutoff
+    plan.version = pending.version
+    plan.solver_used = pending.used
+    plan.save(update_fields=['version', 'history_from', 'solver_used'])
+    return pending.version
+
+
+def current_many(states, solver, executor=None):
+    """``{group_id: (settlements, solver used)}`` of many ``GroupState``s.
+
+    Two queries for all the stored plans; groups changed since their plan
+    was stored are solved together (on ``executor`` if given) and carried
+    over as in ``current``.
+    """
+    states = {state.group_id: state for state in states}
+    with _unsaved_lock:
+        seen = {group_id: (_unsaved.get((group_id, solver)), _dropped) for group_id in states}
+    stored = {
+        plan.group_id: plan
+        for plan in SettlementPlan.objects.filter(group_id__in=states, solver=solver)
+    }
+    open_rows = {group_id: [] for group_id in states}
+    oldest = min((plan.version for plan in stored.values()), default=0)
+    rows = (
+        SettlementTransfer.objects.filter(plan__in=stored.values())
+        .filter(Q(removed_version__isnull=True) | Q(removed_version__gt=oldest))
+        .order_by('plan_id', 'position')
+        .values_list('plan__group_id', 'id', 'debtor_id', 'creditor_id',
+                     engine.cents_column('amount'), 'position', 'added_version', 'removed_version')
+    )
+    for group_id, *row, removed in rows:
+        # Open at the version read, as in _open_at
+        version = stored[group_id].version
+        if row[-1] <= version and (removed is None or removed > version):
+            open_rows[group_id].append(tuple(row))
+
+    plans = {}
+    stale = []
+    for group_id, state in states.items():
+        latest = _latest(stored.get(group_id), open_rows[group_id], seen[group_id][0])
+        if latest is not None and latest.version >= state.version:
+            plans[group_id] = [row[:3] for row in latest.rows], latest.used
+        else:
+            stale.append(state)
+    if stale and executor is not None:
+        # Warm the solver results on the pool; _plan_of then only adjusts
+        tasks = [(state.group_id, *state.arrays()) for state in stale]
+        solved = engine.solve_all(tasks, solver, executor)
+    else:
+        solved = {}
+    for state in stale:
+        group_id = state.group_id
+        latest, _ = _plan_of(state, solver, stored.get(group_id), open_rows[group_id], seen[group_id],
+                             solved.get(group_id))
+        plans[group_id] = [row[:3] for row in latest.rows], latest.used
+    return plans
+
+
+def _display(rows):
+    return [
+        {'from_user': debtor, 'to_user': creditor, 'amount': cents / 100, 'position': position}
+        for debtor, creditor, cents, position in rows
+    ]
+
+
+def changes(state, solver, since=None):
+    """The plan of a group, or only what changed after version ``since``."""
+    seen = _unsaved_plan(state.group_id, solver)
+    latest, plan = _plan_of(state, solver, *_stored(state.group_id, solver), seen)
+    version = latest.version
+
+    payload = {'group_id': state.group_id, 'version': version, 'solver': latest.used}
+    # Stored history covers history_from..plan.version, memory the versions after it
+    covered = plan is not None and plan.history_from <= (since or 0) <= version
+    if since is not None and (since == version or covered):
+        payload['since'] = since
+        payload['added'] = _display([row[:4] for row in latest.rows if row[4] > since])
+        removed = []
+        if covered and since < plan.version:
+            removed = list(
+                plan.transfers.filter(added_version__lte=since, removed_version__gt=since,
+                                      removed_version__lte=plan.version)
+                .values_list('debtor_id', 'creditor_id', engine.cents_column('amount'), 'position')
+            )
+        removed += [
+            row[:4] for row in latest.removed
+            if row[4] <= since < row[5] and (plan is None or row[5] > plan.version)
+        ]
+        payload['removed'] = _display(sorted(removed, key=lambda row: row[3]))
+        return payload
+    if since is not None:
+        # Too old (pruned) or from a version this server never had
+        payload['reset'] = True
+    payload['transfers'] = _display([row[:4] for row in latest.rows])
+    return payload
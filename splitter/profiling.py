@@ -0,0 +1,356 @@
+"""Opt-in sampled profiles and SQL capture of single requests, for staff.
+
+A request is profiled when it carries ``?_profile=`` or an
+``X-Splitter-Profile`` header, set to ``1`` from a staff session or to a
+token from ``manage.py profile_token`` (signed with ``SECRET_KEY``, valid
+for ``PROFILE_TOKEN_MAX_AGE`` seconds) for API clients. Anything else is
+ignored, so unprofiled requests only pay for that lookup.
+
+While the view runs, a sampler thread records the stacks of the threads
+working on the request every ``PROFILE_SAMPLE_INTERVAL`` seconds: the
+thread that runs the view (for async views the event loop thread, so
+other requests it serves meanwhile show up too) and any pool thread
+running work it handed to ``offload.run()``. Sampling hooks nothing into
+the interpreter, so it can't clash with another profiler (since Python
+3.12 only one profiling tool may be active at a time). Only one request
+per process is profiled at once; a second one is answered with 503. ORM
+calls that async views make through ``sync_to_async`` run in Django's own
+thread and only show up as SQL.
+
+The last ``PROFILE_HISTORY`` profiles are kept per process, with their
+SQL, and can be listed and downloaded as ``.pstats`` from
+``/api/profiles/`` (load them with ``pstats``, or draw a flame graph with
+e.g. snakeviz or flameprof). Times there are sampled wall-clock times, and
+call counts are sample counts.
+"""
+import contextlib
+import contextvars
+import marshal
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.http import JsonResponse
+from django.utils import timezone
+
+from . import metrics
+
+HEADER = 'X-Splitter-Profile'
+PARAM = '_profile'
+_SALT = 'splitter.profiling'
+
+# The Sampler of the request being served in this context, if any
+current = contextvars.ContextVar('splitter_profile', default=None)
+
+# Held while a request is profiled; one at a time per process
+_active = threading.Lock()
+
+
+def make_token(user):
+    return signing.TimestampSigner(salt=_SALT).sign(str(user.pk))
+
+
+def _token_user(token):
+    try:
+        user_id = signing.TimestampSigner(salt=_SALT).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return get_user_model().objects.filter(pk=user_id, is_active=True, is_staff=True).first()
+
+
+def requester(request):
+    """The staff user asking for a profile of ``request``, or None."""
+    value = request.headers.get(HEADER) or request.GET.get(PARAM)
+    if not value:
+        return None
+    user = getattr(request, 'user', None)
+    if value == '1':
+        return user if user is not None and user.is_active and user.is_staff else None
+    return _token_user(value)
+
+
+def is_staff(request):
+    """Whether ``request`` may read stored profiles: a staff session or token."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_active and user.is_staff:
+        return True
+    token = request.headers.get(HEADER)
+    return bool(token) and _token_user(token) is not None
+
+
+class Sampler:
+    """Sampled stacks of the threads working on one request."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._threads = Counter()
+        self._counts = Counter()
+        self._seconds = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='splitter-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @contextlib.contextmanager
+    def working(self):
+        """Sample the current thread until the block exits."""
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads[ident] -= 1
+                if not self._threads[ident]:
+                    del self._threads[ident]
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            # The GIL can delay a sample, so each one weighs the time since the last
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            with self._lock:
+                idents = list(self._threads)
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                if stack:
+                    stack = tuple(reversed(stack))
+                    self._counts[stack] += 1
+                    self._seconds[stack] += elapsed
+
+    def stats(self):
+        """The samples in the ``pstats`` format: ``{function: (samples,
+        samples, own seconds, cumulative seconds, callers)}``."""
+        own = Counter()
+        own_seconds = Counter()
+        total = Counter()
+        total_seconds = Counter()
+        callers = {}
+        for stack, count in self._counts.items():
+            seconds = self._seconds[stack]
+            own[stack[-1]] += count
+            own_seconds[stack[-1]] += seconds
+            for function in set(stack):
+                total[function] += count
+                total_seconds[function] += seconds
+            for caller, callee in set(zip(stack, stack[1:])):
+                edge = callers.setdefault(callee, {}).get(caller, (0, 0, 0.0, 0.0))
+                leaf = seconds if callee == stack[-1] else 0.0
+                callers[callee][caller] = (edge[0] + count, edge[1] + count, edge[2] + leaf, edge[3] + seconds)
+        return {
+            function: (count, count, own_seconds[function], total_seconds[function],
+                       callers.get(function, {}))
+            for function, count in total.items()
+        }
+
+
+class Profile:
+    """A stored profile: request summary, SQL and marshalled pstats data."""
+
+    __slots__ = ('id', 'created_at', 'user', 'method', 'path', 'status', 'seconds',
+                 'queries', 'sql_seconds', 'statements', 'data')
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'created_at': self.created_at.isoformat(),
+            'user': self.user,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'ms': round(self.seconds * 1000, 1),
+            'queries': self.queries,
+            'sql_ms': round(self.sql_seconds * 1000, 1),
+        }
+
+    def top(self, limit=30, sort='cumulative'):
+        """The ``limit`` heaviest functions, by cumulative or own time."""
+        rows = []
+        for (filename, line, name), (samples, _, own, cumulative, _) in marshal.loads(self.data).items():
+            rows.append({
+                'function': f'{filename}:{line}({name})',
+                'samples': samples,
+                'own_ms': round(own * 1000, 3),
+                'cumulative_ms': round(cumulative * 1000, 3),
+            })
+        key = 'own_ms' if sort == 'tottime' else 'cumulative_ms'
+        rows.sort(key=lambda row: row[key], reverse=True)
+        return rows[:limit]
+
+
+class Store:
+    """Ring buffer of the last ``PROFILE_HISTORY`` profiles of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = None
+
+    def _buffer(self):
+        if self._profiles is None:
+            self._profiles = deque(maxlen=settings.PROFILE_HISTORY)
+        return self._profiles
+
+    def add(self, profile):
+        with self._lock:
+            self._buffer().append(profile)
+
+    def get(self, profile_id):
+        with self._lock:
+            return next((p for p in self._buffer() if p.id == profile_id), None)
+
+    def list(self):
+        with self._lock:
+            return list(reversed(self._buffer()))
+
+    def clear(self):
+        with self._lock:
+            self._buffer().clear()
+
+
+store = Store()
+
+
+def busy_response():
+    response = JsonResponse({'error': 'Another request is being profiled, try again shortly'}, status=503)
+    response['Retry-After'] = '1'
+    return response
+
+
+class ProfilingMiddleware:
+    """Run the view of requests that opt in under the profiler.
+
+    Goes after ``AuthenticationMiddleware``, which it needs to tell staff
+    sessions apart. The response gets ``X-Profile-Id`` and ``X-Profile-Url``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # Django calls a sync process_view through sync_to_async otherwise
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        return self.finish(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if PARAM not in request.GET and HEADER not in request.headers:
+            return None
+        user = requester(request)
+        if user is None:
+            return None
+        if not self.start(request, user):
+            return busy_response()
+        if iscoroutinefunction(view_func):
+            return async_to_sync(self.aprofiled)(request, view_func, view_args, view_kwargs)
+        return self.profiled(request, view_func, view_args, view_kwargs)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if PARAM not in request.GET and HEADER not in request.headers:
+            return None
+        # The session user and token lookups query the database
+        user = await sync_to_async(requester)(request)
+        if user is None:
+            return None
+        if not self.start(request, user):
+            return busy_response()
+        if iscoroutinefunction(view_func):
+            return await self.aprofiled(request, view_func, view_args, view_kwargs)
+        return await sync_to_async(self.profiled)(request, view_func, view_args, view_kwargs)
+
+    def start(self, request, user):
+        """Claim the process's profiler for ``request``; False if it is taken.
+
+        The claim is given up by ``profiled``/``aprofiled`` once the view returns.
+        """
+        if not _active.acquire(blocking=False):
+            return False
+        sampler = Sampler(settings.PROFILE_SAMPLE_INTERVAL)
+        request._profile = (user, sampler, metrics.RequestStats(capture=True), time.perf_counter())
+        sampler.start()
+        return True
+
+    def profiled(self, request, view_func, view_args, view_kwargs):
+        _, sampler, stats, _ = request._profile
+        tokens = current.set(sampler), metrics.current_request.set(stats)
+        try:
+            with sampler.working():
+                return view_func(request, *view_args, **view_kwargs)
+        finally:
+            current.reset(tokens[0])
+            metrics.current_request.reset(tokens[1])
+            sampler.stop()
+            _active.release()
+
+    async def aprofiled(self, request, view_func, view_args, view_kwargs):
+        _, sampler, stats, _ = request._profile
+        tokens = current.set(sampler), metrics.current_request.set(stats)
+        try:
+            with sampler.working():
+                return await view_func(request, *view_args, **view_kwargs)
+        finally:
+            current.reset(tokens[0])
+            metrics.current_request.reset(tokens[1])
+            sampler.stop()
+            _active.release()
+
+    def finish(self, request, response):
+        profiling = getattr(request, '_profile', None)
+        if profiling is None:
+            return response
+        user, sampler, stats, started = profiling
+        # The metrics middleware still counts this request's SQL
+        outer = metrics.current_request.get()
+        if outer is not None:
+            outer.queries += stats.queries
+            outer.sql_seconds += stats.sql_seconds
+            if outer.statements is not None:
+                outer.statements.extend(stats.statements)
+
+        profile = Profile()
+        profile.id = uuid.uuid4().hex
+        profile.created_at = timezone.now()
+        profile.user = user.get_username()
+        profile.method = request.method
+        profile.path = request.get_full_path()
+        profile.status = response.status_code
+        profile.seconds = time.perf_counter() - started
+        profile.queries = stats.queries
+        profile.sql_seconds = stats.sql_seconds
+        profile.statements = sorted(stats.statements, reverse=True)
+        # The format of pstats.Stats.dump_stats, i.e. a .pstats file
+        profile.data = marshal.dumps(sampler.stats())
+        store.add(profile)
+        response['X-Profile-Id'] = profile.id
+        response['X-Profile-Url'] = f'/api/profiles/{profile.id}/'
+        return response
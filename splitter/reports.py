@@ -0,0 +1,267 @@
+"""JSON payloads of group reports, shared by the API views."""
+import itertools
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from .models import DailyBalance, GroupMember
+from .settlement import DEFAULT_SOLVER
+from . import engine, group_cache, offload, plans
+
+
+def _members(group):
+    return GroupMember.objects.filter(group=group).select_related('user')
+
+
+def _report_source(as_of):
+    if as_of is None:
+        return {}
+    return {'source': 'rollups', 'period': (None, as_of)}
+
+
+async def abuild_group_report(group, solver=DEFAULT_SOLVER, as_of=None):
+    """Balances and settlements of a group, now or at the end of day ``as_of``."""
+    members = [m async for m in _members(group)]
+    if not members:
+        return _report_payload(group, members, None, solver)
+    member_ids = [m.user.id for m in members]
+    result = await engine.agroup_report(group.id, member_ids, solver=solver, **_report_source(as_of))
+    return _report_payload(group, members, result, solver)
+
+
+def _report_payload(group, members, result, solver):
+    if result is None:
+        return {
+            'group': group.name,
+            'members': [],
+            'balances': {},
+            'settlements': [],
+            'solver': solver
+        }
+
+    net_balance = result.net_by_user()
+    settlements = result.settlements_display()
+
+    balances_display = {}
+    members_info = []
+    for m in members:
+        balances_display[m.user.username] = net_balance[m.user.id] / 100
+        members_info.append({
+            'id': m.user.id,
+            'username': m.user.username,
+            'balance': net_balance[m.user.id] / 100
+        })
+
+    return {
+        'group': group.name,
+        'members': members_info,
+        'balances': balances_display,
+        'settlements': settlements,
+        'solver': result.solver
+    }
+
+
+async def astate_report(state, solver=DEFAULT_SOLVER):
+    """``abuild_group_report`` of a cached ``group_cache.GroupState``.
+
+    Settlements come from the group's stored plan (``splitter.plans``),
+    read once per solver and state, off the event loop.
+    """
+    if not state.user_ids:
+        return _report_payload(state, [], None, solver)
+    settlements, used = state.cached_plan(solver) or await offload.run(state.plan, solver)
+    balances_display = {}
+    members_info = []
+    for user_id, username, _, net in state.members():
+        balances_display[username] = net / 100
+        members_info.append({
+            'id': user_id,
+            'username': username,
+            'balance': net / 100
+        })
+    return {
+        'group': state.name,
+        'members': members_info,
+        'balances': balances_display,
+        'settlements': [
+            {'from_user': debtor, 'to_user': creditor, 'amount': cents / 100}
+            for debtor, creditor, cents in settlements
+        ],
+        'solver': used
+    }
+
+
+def state_members(state):
+    return [
+        {
+            'id': user_id,
+            'username': username,
+            'email': email
+        }
+        for user_id, username, email, _ in state.members()
+    ]
+
+
+TIMESERIES_INTERVALS = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def build_group_timeseries(group, start=None, end=None, interval='day'):
+    """Spending and running member balances of a group over time.
+
+    One point per ``interval`` with activity between ``start`` and ``end``
+    (inclusive dates, either may be None): ``spent`` is what was paid in
+    that interval and ``net`` each member's balance at its end. Built from
+    the daily rollups, so it costs O(days) rows whatever the history size.
+    """
+    members = list(
+        GroupMember.objects.filter(group=group).order_by('id').values_list('user_id', 'user__username')
+    )
+    member_ids = [user_id for user_id, _ in members]
+    rollups = DailyBalance.objects.filter(group=group)
+
+    # Balances carried into the window
+    net = dict.fromkeys(member_ids, 0)
+    if start is not None:
+        opening = (
+            rollups.filter(day__lt=start, user_id__in=member_ids)
+            .values_list('user_id')
+            .annotate(paid=Sum(engine.cents_column('paid')), owed=Sum(engine.cents_column('owed')))
+            .order_by()
+        )
+        for user_id, paid, owed in opening:
+            net[user_id] = paid - owed
+        rollups = rollups.filter(day__gte=start)
+    if end is not None:
+        rollups = rollups.filter(day__lte=end)
+
+    trunc = TIMESERIES_INTERVALS[interval]
+    bucket = trunc('day') if trunc is not None else F('day')
+    rows = (
+        rollups.annotate(bucket=bucket)
+        .values_list('bucket', 'user_id')
+        .annotate(paid=Sum(engine.cents_column('paid')), owed=Sum(engine.cents_column('owed')))
+        .order_by('bucket')
+    )
+
+    points = []
+    for day, day_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        spent = 0
+        for _, user_id, paid, owed in day_rows:
+            spent += paid
+            if user_id in net:
+                net[user_id] += paid - owed
+        points.append({
+            'date': day.isoformat(),
+            'spent': spent / 100,
+            'net': {str(user_id): cents / 100 for user_id, cents in net.items()},
+        })
+
+    return {
+        'group': group.name,
+        'interval': interval,
+        'members': [{'id': user_id, 'username': username} for user_id, username in members],
+        'points': points,
+    }
+
+
+def build_user_balances(user, solver=DEFAULT_SOLVER):
+    """Where ``user`` stands in every group they belong to.
+
+    Two queries whatever the number of groups for the balances (every
+    membership of those groups, with names, then their ledger rows) and two
+    for the groups' stored settlement plans (``plans.current_many``), so
+    the amounts match each group's report. Counterparty amounts come from
+    the plans: positive means the counterparty pays ``user``.
+    """
+    rows = (
+        GroupMember.objects.filter(group__members__user=user)
+        .order_by('group_id', 'id')
+        .values_list('group_id', 'group__name', 'group__version', 'user_id', 'user__username')
+    )
+    groups_info = {}
+    members_by_group = {}
+    usernames = {}
+    for group_id, group_name, version, user_id, username in rows:
+        groups_info[group_id] = group_name, version
+        members_by_group.setdefault(group_id, []).append(user_id)
+        usernames[user_id] = username
+
+    results = engine.batch_reports(members_by_group, solver=None) if members_by_group else {}
+    states = [
+        group_cache.GroupState(
+            group_id, *groups_info[group_id],
+            [(user_id, usernames[user_id], '') for user_id in members_by_group[group_id]],
+            result.net_by_user()
+        )
+        for group_id, result in results.items()
+    ]
+    group_plans = plans.current_many(states, solver)
+
+    groups = []
+    total_net = 0
+    overall = {}
+    for state in states:
+        net = dict(zip(state.user_ids, state.net))[user.id]
+        total_net += net
+        counterparties = {}
+        for debtor, creditor, cents in group_plans[state.group_id][0]:
+            if creditor == user.id:
+                counterparties[debtor] = counterparties.get(debtor, 0) + cents
+            elif debtor == user.id:
+                counterparties[creditor] = counterparties.get(creditor, 0) - cents
+        for other_id, cents in counterparties.items():
+            overall[other_id] = overall.get(other_id, 0) + cents
+        groups.append({
+            'id': state.group_id,
+            'name': state.name,
+            'net': net / 100,
+            'counterparties': _counterparty_list(counterparties, usernames),
+        })
+
+    return {
+        'user': {'id': user.id, 'username': user.username},
+        'net': total_net / 100,
+        'groups': groups,
+        'counterparties': _counterparty_list(overall, usernames),
+    }
+
+
+def _counterparty_list(amounts, usernames):
+    return [
+        {'id': user_id, 'username': usernames[user_id], 'amount': cents / 100}
+        for user_id, cents in sorted(amounts.items()) if cents
+    ]
+
+
+def _cache_key(kind, group, variant):
+    return ':'.join(str(part) for part in (kind, group.id, group.version) + variant)
+
+
+def cached(kind, group, build, *variant):
+    """Return ``build()``, cached under the group's current change-version.
+
+    The version is part of the key, so entries never need invalidating:
+    any write moves the group to a new key.
+    """
+    key = _cache_key(kind, group, variant)
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, settings.GROUP_RESPONSE_CACHE_TIMEOUT)
+    return data
+
+
+async def acached(kind, group, build, *variant):
+    """``cached`` for async views; ``build`` is a coroutine function."""
+    key = _cache_key(kind, group, variant)
+    data = await cache.aget(key)
+    if data is None:
+        data = await build()
+        await cache.aset(key, data, settings.GROUP_RESPONSE_CACHE_TIMEOUT)
+    return data
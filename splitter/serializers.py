@@ -18,7 +18,8 @@ class GroupSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Group
-        fields = ['id', 'name', 'created_by', 'created_at']
+        fields = ['id', 'name', 'created_by', 'created_at', 'version']
+        read_only_fields = ['version']
 
 class GroupMemberSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
@@ -42,17 +43,29 @@ class ExpenseSplitSerializer(serializers.ModelSerializer):
         model = ExpenseSplit
         fields = ['id', 'member', 'member_username', 'share']
 
-class ExpenseSerializer(serializers.ModelSerializer):
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """Serializer that can be narrowed to a subset of fields with ``fields=``."""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+class ExpenseSerializer(DynamicFieldsModelSerializer):
     payments = ExpensePaymentSerializer(many=True, read_only=True)
     splits = ExpenseSplitSerializer(many=True, read_only=True)
-    total_amount = serializers.SerializerMethodField()
+    # Stored on the expense, so listings don't need the split rows for it
+    total_amount = serializers.DecimalField(
+        max_digits=12, decimal_places=2, read_only=True, coerce_to_string=False
+    )
     date = serializers.DateTimeField(source='created_at', read_only=True)
     
     class Meta:
         model = Expense
-        fields = ['id', 'group', 'description', 'date', 'created_at', 'payments', 'splits', 'total_amount']
-        read_only_fields = ['group']
-    
-    def get_total_amount(self, obj):
-        # Total amount is the sum of all splits (what needs to be divided)
-        return sum(split.share for split in obj.splits.all())
+        fields = [
+            'id', 'group', 'description', 'date', 'created_at', 'payments', 'splits',
+            'total_amount', 'payment_count', 'split_count'
+        ]
+        read_only_fields = ['group', 'payment_count', 'split_count']
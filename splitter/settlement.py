@@ -0,0 +1,225 @@
+"""Settlement solvers.
+
+A solver turns a vector of net balances (integer cents, one per member)
+into ``(from_user, to_user, cents)`` transfers. ``greedy`` is the classic
+largest-debtor/largest-creditor pass. ``optimal`` partitions the members
+into as many zero-sum sub-groups as possible, which is what minimises the
+number of transfers, and falls back to ``greedy`` when the group is too
+large or the CPU-time budget runs out.
+"""
+import time
+
+import numpy as np
+from django.conf import settings
+
+# Balances within this many cents of zero are treated as settled
+TOLERANCE_CENTS = 1
+
+DEFAULT_SOLVER = 'greedy'
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def greedy(user_ids, net):
+    """Greedily match the largest debtor with the largest creditor."""
+    creditor_idx = np.flatnonzero(net > TOLERANCE_CENTS)
+    debtor_idx = np.flatnonzero(net < -TOLERANCE_CENTS)
+    creditor_idx = creditor_idx[np.argsort(-net[creditor_idx], kind='stable')]
+    debtor_idx = debtor_idx[np.argsort(net[debtor_idx], kind='stable')]
+
+    credit = net[creditor_idx].tolist()
+    debt = (-net[debtor_idx]).tolist()
+    creditors = user_ids[creditor_idx].tolist()
+    debtors = user_ids[debtor_idx].tolist()
+
+    settlements = []
+    i, j = 0, 0
+    while i < len(credit) and j < len(debt):
+        amount = min(credit[i], debt[j])
+        settlements.append((debtors[j], creditors[i], amount))
+        credit[i] -= amount
+        debt[j] -= amount
+        if credit[i] < TOLERANCE_CENTS:
+            i += 1
+        if debt[j] < TOLERANCE_CENTS:
+            j += 1
+    return settlements
+
+
+def _zero_sum_groups(values, deadline):
+    """Split ``values`` into the maximum number of zero-sum subsets.
+
+    Bitmask DP: ``dp[mask]`` is the largest number of zero-sum blocks an
+    ordering of ``mask`` can be cut into. Masks are processed one popcount
+    layer at a time with NumPy so the work per layer is vectorised. Returns
+    a list of index lists; a trailing non-zero remainder, if any, is last.
+    """
+    n = len(values)
+    size = 1 << n
+    masks = np.arange(size, dtype=np.int64)
+
+    sums = np.zeros(size, dtype=np.int64)
+    popcount = np.zeros(size, dtype=np.int8)
+    for i in range(n):
+        has_bit = (masks >> i) & 1
+        sums += has_bit * values[i]
+        popcount += has_bit.astype(np.int8)
+    is_zero = (sums == 0).astype(np.int16)
+
+    dp = np.zeros(size, dtype=np.int16)
+    for layer in range(1, n + 1):
+        if time.process_time() > deadline:
+            raise BudgetExceeded
+        layer_masks = masks[popcount == layer]
+        best = np.zeros(len(layer_masks), dtype=np.int16)
+        for i in range(n):
+            bit = 1 << i
+            with_bit = (layer_masks & bit) != 0
+            candidates = dp[layer_masks[with_bit] ^ bit]
+            best[with_bit] = np.maximum(best[with_bit], candidates)
+        dp[layer_masks] = best + is_zero[layer_masks]
+
+    # Walk back from the full set, recovering one element at a time
+    order = []
+    mask = size - 1
+    while mask:
+        for i in range(n):
+            bit = 1 << i
+            if mask & bit and dp[mask ^ bit] + is_zero[mask] == dp[mask]:
+                order.append(i)
+                mask ^= bit
+                break
+    order.reverse()
+
+    groups = []
+    current = []
+    running = 0
+    for i in order:
+        current.append(i)
+        running += values[i]
+        if running == 0:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+
+def optimal(user_ids, net, budget=None, max_parties=None):
+    """Settle with the minimum number of transfers where affordable.
+
+    Exact opposite balances are paired off first; the rest goes through the
+    zero-sum DP, whose cost is O(2**n * n). Raises ``BudgetExceeded`` when
+    there are more than ``max_parties`` open balances left or the CPU-time
+    ``budget`` (seconds) runs out.
+    """
+    if budget is None:
+        budget = settings.SETTLEMENT_SOLVER_BUDGET
+    if max_parties is None:
+        max_parties = settings.SETTLEMENT_SOLVER_MAX_PARTIES
+    # CPU time of the whole process, not wall time: other threads' work
+    # counts against it, time spent waiting does not
+    deadline = time.process_time() + budget
+
+    open_idx = np.flatnonzero(np.abs(net) > TOLERANCE_CENTS).tolist()
+    settlements = []
+
+    # A debtor and creditor with exactly opposite balances always form
+    # their own sub-group in some optimal plan
+    waiting = {}
+    remaining = []
+    for idx in open_idx:
+        partner = waiting.get(-int(net[idx]))
+        if partner:
+            debtor, creditor = (idx, partner.pop()) if net[idx] < 0 else (partner.pop(), idx)
+            settlements.append((int(user_ids[debtor]), int(user_ids[creditor]), abs(int(net[idx]))))
+        else:
+            waiting.setdefault(int(net[idx]), []).append(idx)
+    for indices in waiting.values():
+        remaining.extend(indices)
+    remaining.sort()
+
+    if len(remaining) > max_parties:
+        raise BudgetExceeded
+    if remaining:
+        values = [int(net[idx]) for idx in remaining]
+        for block in _zero_sum_groups(values, deadline):
+            block_idx = np.asarray([remaining[k] for k in block], dtype=np.int64)
+            settlements.extend(greedy(user_ids[block_idx], net[block_idx]))
+    return settlements
+
+
+SOLVERS = {
+    'greedy': greedy,
+    'optimal': optimal,
+}
+
+
+def solve(user_ids, net, solver=DEFAULT_SOLVER):
+    """Run ``solver`` and return ``(settlements, name_of_solver_used)``."""
+    if solver not in SOLVERS:
+        raise ValueError(f'Unknown solver: {solver}')
+    if solver != 'greedy':
+        try:
+            return SOLVERS[solver](user_ids, net), solver
+        except BudgetExceeded:
+            pass
+    return greedy(user_ids, net), 'greedy'
+
+
+def solve_many(tasks, solver=DEFAULT_SOLVER):
+    """``[(group_id, settlements, solver used)]`` of ``(group_id, user_ids, net)`` tasks.
+
+    Runs in the spawned ``batch`` workers, so this module must not import
+    models.
+    """
+    return [(group_id, *solve(user_ids, net, solver)) for group_id, user_ids, net in tasks]
+
+
+def adjust(transfers, user_ids, net):
+    """Update an existing plan to settle new net balances, changing little.
+
+    ``transfers`` is the previous plan, a list of ``(from_user, to_user,
+    cents)``; ``user_ids``/``net`` are the new balances (anyone missing
+    from them counts as settled). Each old transfer is kept, in order, for
+    as much as its payer still owes and its payee is still owed; what is
+    left is settled like ``greedy``, topping up a kept transfer between the
+    same two people or appending a new one. A small change to the balances
+    therefore leaves the transfers of everyone it didn't touch as they were.
+    """
+    remaining = dict(zip(np.asarray(user_ids).tolist(), np.asarray(net).tolist()))
+    # Ties are broken by member order, so the same input gives the same plan
+    order = {user_id: n for n, user_id in enumerate(remaining)}
+
+    plan = []
+    index = {}
+    for debtor, creditor, cents in transfers:
+        amount = min(cents, -remaining.get(debtor, 0), remaining.get(creditor, 0))
+        if amount > 0:
+            transfer = index[debtor, creditor] = [debtor, creditor, amount]
+            plan.append(transfer)
+            remaining[debtor] += amount
+            remaining[creditor] -= amount
+
+    creditors = [u for u, cents in remaining.items() if cents > TOLERANCE_CENTS]
+    debtors = [u for u, cents in remaining.items() if cents < -TOLERANCE_CENTS]
+    creditors.sort(key=lambda u: (-remaining[u], order[u]))
+    debtors.sort(key=lambda u: (remaining[u], order[u]))
+    i, j = 0, 0
+    while i < len(creditors) and j < len(debtors):
+        creditor, debtor = creditors[i], debtors[j]
+        amount = min(remaining[creditor], -remaining[debtor])
+        transfer = index.get((debtor, creditor))
+        if transfer is None:
+            transfer = index[debtor, creditor] = [debtor, creditor, 0]
+            plan.append(transfer)
+        transfer[2] += amount
+        remaining[creditor] -= amount
+        remaining[debtor] += amount
+        if remaining[creditor] < TOLERANCE_CENTS:
+            i += 1
+        if -remaining[debtor] < TOLERANCE_CENTS:
+            j += 1
+    return [tuple(transfer) for transfer in plan]
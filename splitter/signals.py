@@ -0,0 +1,55 @@
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from . import ledger
+from .models import Expense, Group, GroupMember
+
+# Sent after commit whenever a group's expenses or members change.
+# Arguments: group_id.
+group_changed = Signal()
+
+
+def mark_group_changed(group_id):
+    """Bump the group's change-version inside the caller's transaction."""
+    Group.objects.filter(pk=group_id).update(version=F('version') + 1)
+    transaction.on_commit(lambda: group_changed.send(sender=Group, group_id=group_id))
+
+
+def _group_deleted(origin):
+    """Whether a delete started from ``Group`` rows, i.e. cascades through
+    whole groups, whose ledger rows go with them."""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model is Group
+
+
+@receiver(pre_delete, sender=Expense)
+def reverse_deleted_expense(sender, instance, origin=None, **kwargs):
+    if _group_deleted(origin):
+        return
+    # Runs before the cascade removes the lines, so they can still be read.
+    ledger.apply_expense(instance, sign=-1)
+    mark_group_changed(instance.group_id)
+
+
+# Bulk writes (the importer) skip these and call mark_group_changed itself
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=GroupMember)
+def bump_group_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        mark_group_changed(instance.group_id)
+
+
+@receiver(post_delete, sender=GroupMember)
+def bump_group_version_on_leave(sender, instance, origin=None, **kwargs):
+    if not _group_deleted(origin):
+        mark_group_changed(instance.group_id)
+
+
+@receiver(post_delete, sender=Group)
+def announce_deleted_group(sender, instance, **kwargs):
+    # Once for the whole group rather than once per expense and member;
+    # drops its cached state
+    group_id = instance.id
+    transaction.on_commit(lambda: group_changed.send(sender=Group, group_id=group_id))
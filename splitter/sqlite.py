@@ -0,0 +1,18 @@
+"""Per-connection tuning for running on SQLite under concurrent load.
+
+``SQLITE_PRAGMAS`` are applied to every new SQLite connection. WAL lets
+readers carry on while a write is in progress, and ``synchronous=NORMAL`` is
+the durable setting for WAL that doesn't fsync on every commit. The busy
+timeout and ``BEGIN IMMEDIATE`` transactions are configured in
+``DATABASES['default']['OPTIONS']``.
+"""
+from django.conf import settings
+
+
+def configure(connection, **kwargs):
+    """``connection_created`` receiver applying ``SQLITE_PRAGMAS``."""
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,274 @@
+import io
+import json
+import tempfile
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from .management.commands import stress_writes
+from .models import Expense, Group, GroupMember
+from . import group_cache, offload, pdf_jobs, plans, writer
+
+
+class ExpenseCreateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create_user(username=f'user{i}') for i in range(20)]
+        cls.group = Group.objects.create(name='Trip', created_by=cls.users[0])
+        GroupMember.objects.bulk_create(GroupMember(group=cls.group, user=user) for user in cls.users)
+
+    def post(self, body):
+        return self.client.post(
+            f'/api/groups/{self.group.id}/expenses/', json.dumps(body), content_type='application/json'
+        )
+
+    def body(self, lines):
+        users = self.users[:lines]
+        return {
+            'description': f'{lines} lines',
+            'payments': [{'payer': user.id, 'amount': '3.00'} for user in users],
+            'splits': [{'member': user.id, 'share': '3.00'} for user in users],
+        }
+
+    def test_queries_do_not_grow_with_lines(self):
+        counts = {}
+        for lines in (1, 5, 20):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post(self.body(lines))
+            self.assertEqual(response.status_code, 201, response.content)
+            self.assertEqual(len(response.json()['payments']), lines)
+            counts[lines] = len(queries)
+        self.assertEqual(counts[1], counts[5], counts)
+        self.assertEqual(counts[5], counts[20], counts)
+
+    def test_malformed_lines_are_rejected(self):
+        payer = self.users[0].id
+        bodies = [
+            {'payments': 'x', 'splits': []},
+            {'payments': [1], 'splits': []},
+            {'payments': [], 'splits': 'x'},
+            {'payments': [{'payer': payer, 'amount': 'NaN'}]},
+            {'payments': [{'payer': payer, 'amount': 'sNaN'}]},
+            {'payments': [{'payer': payer, 'amount': 'Infinity'}]},
+            {'payments': [{'payer': payer, 'amount': '1e20'}]},
+            {'payments': [{'payer': payer, 'amount': '0.005'}], 'splits': [{'member': payer, 'share': '0.005'}]},
+        ]
+        for body in bodies:
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+        self.assertFalse(Expense.objects.exists())
+
+
+class ImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create_user(username=f'user{i}') for i in range(2)]
+        cls.group = Group.objects.create(name='Trip', created_by=cls.users[0])
+        GroupMember.objects.bulk_create(GroupMember(group=cls.group, user=user) for user in cls.users)
+
+    def url(self):
+        return f'/api/groups/{self.group.id}/expenses/import/'
+
+    def csv(self, amount='10.00'):
+        a, b = (user.id for user in self.users)
+        return (
+            'expense,description,kind,user,amount\n'
+            f'1,Taxi,payment,{a},{amount}\n1,Taxi,split,{a},5.00\n1,Taxi,split,{b},5.00\n'
+        ).encode()
+
+    def test_empty_body_is_rejected(self):
+        response = self.client.generic('POST', self.url(), b'', CONTENT_TYPE='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_chunked_body_is_read_to_its_end(self):
+        # What a WSGI server that de-chunks the upload passes on: no Content-Length
+        body = self.csv()
+        response = self.client.generic(
+            'POST', self.url(), body, content_type='text/csv',
+            CONTENT_LENGTH='', HTTP_TRANSFER_ENCODING='chunked', **{'wsgi.input_terminated': True}
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['imported'], 1)
+        self.assertEqual(Expense.objects.get().total_amount, Decimal('10.00'))
+
+    def test_sub_cent_amounts_are_reported(self):
+        response = self.client.post(self.url(), self.csv('10.005'), content_type='text/csv')
+        self.assertEqual(response.status_code, 200, response.content)
+        report = response.json()
+        self.assertEqual(report['imported'], 0)
+        self.assertEqual(report['errors'], [{'line': 2, 'error': 'Amount must have at most 2 decimal places'}])
+
+
+class ExpenseListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user(username='user')
+        cls.group = Group.objects.create(name='Trip', created_by=user)
+        Expense.objects.create(group=cls.group, description='Taxi')
+
+    def test_fields_narrow_the_listing(self):
+        response = self.client.get(f'/api/groups/{self.group.id}/expenses/?fields=id,description')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([set(row) for row in response.json()['results']], [{'id', 'description'}])
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get(f'/api/groups/{self.group.id}/expenses/?fields=id,bogus')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('bogus', response.json()['error'])
+        self.assertIn('description', response.json()['allowed_fields'])
+        self.assertNotIn('ETag', response)
+
+
+class ThreadedTestCase(TransactionTestCase):
+    """For requests that write from other threads (the write queue, plan
+    saves of reports), which a TestCase's open transaction would lock out."""
+
+    def tearDown(self):
+        # Finish the queued writes before the tables are flushed, and close
+        # the connections of those threads
+        writer.get_queue().stop()
+        offload.shutdown()
+
+
+class ConditionalReadTests(ThreadedTestCase):
+    def setUp(self):
+        group_cache.get_backend().clear()
+        user = get_user_model().objects.create_user(username='user')
+        self.group = Group.objects.create(name='Trip', created_by=user)
+        GroupMember.objects.create(group=self.group, user=user)
+
+    def test_unchanged_report_is_not_modified(self):
+        url = f'/api/groups/{self.group.id}/report/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_write_from_another_process_is_seen(self):
+        url = f'/api/groups/{self.group.id}/report/'
+        etag = self.client.get(url)['ETag']
+        # A write that sends no signals here, as another worker's would
+        Group.objects.filter(pk=self.group.id).update(name='Beach', version=F('version') + 1)
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['group'], 'Beach')
+
+
+@override_settings(SQLITE_WRITE_QUEUE=True, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ParallelWriteTests(ThreadedTestCase):
+    def test_parallel_writers_are_not_locked_out(self):
+        self.assertTrue(writer.enabled(), 'the write queue needs a SQLite file database')
+        queue = writer.get_queue()
+        jobs = queue.jobs
+        out = io.StringIO()
+        # Raises CommandError on any "database is locked" error or ledger drift
+        stress_writes.Command(stdout=out, stderr=out).run(
+            {'writers': 6, 'requests': 15, 'readers': 2, 'no_queue': False, 'seed': 0}
+        )
+        self.assertIn('lock errors: 0, other failures: 0', out.getvalue())
+        self.assertGreater(queue.jobs, jobs)
+
+
+class PlanChangesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create_user(username=name) for name in 'abcd']
+        cls.group = Group.objects.create(name='Trip', created_by=cls.users[0])
+        GroupMember.objects.bulk_create(GroupMember(group=cls.group, user=user) for user in cls.users)
+
+    def setUp(self):
+        group_cache.get_backend().clear()
+        # Plans are only dropped from memory once their save commits, which
+        # a TestCase never does, and group ids come round again
+        plans._unsaved.clear()
+
+    def spend(self, payer, amount, sharers):
+        share = Decimal(amount) / len(sharers)
+        response = self.client.post(f'/api/groups/{self.group.id}/expenses/', json.dumps({
+            'description': 'x',
+            'payments': [{'payer': self.users[payer].id, 'amount': amount}],
+            'splits': [{'member': self.users[i].id, 'share': str(share)} for i in sharers],
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def settlements(self, query=''):
+        response = self.client.get(f'/api/groups/{self.group.id}/settlements/{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_changes_since_a_version_replay_to_the_plan(self):
+        self.spend(0, '30.00', [0, 1, 2])
+        before = self.settlements()
+        self.spend(3, '40.00', [1, 3])
+        self.spend(2, '12.00', [0, 1, 2, 3])
+        changes = self.settlements(f'?since={before["version"]}')
+        after = self.settlements()
+
+        self.assertEqual(changes['version'], after['version'])
+        self.assertGreater(changes['version'], before['version'])
+        self.assertTrue(changes['added'] and changes['removed'], changes)
+        transfers = {t['position']: t for t in before['transfers']}
+        for removed in changes['removed']:
+            self.assertEqual(transfers.pop(removed['position']), removed)
+        for added in changes['added']:
+            transfers[added['position']] = added
+        self.assertEqual(sorted(transfers.values(), key=lambda t: t['position']), after['transfers'])
+
+    def test_current_version_has_no_changes(self):
+        self.spend(0, '30.00', [0, 1, 2])
+        version = self.settlements()['version']
+        changes = self.settlements(f'?since={version}')
+        self.assertEqual((changes['added'], changes['removed']), ([], []))
+
+    def test_unknown_version_resets(self):
+        self.spend(0, '30.00', [0, 1, 2])
+        changes = self.settlements('?since=999')
+        self.assertTrue(changes['reset'])
+        self.assertEqual(len(changes['transfers']), 2)
+        response = self.client.get(f'/api/groups/{self.group.id}/settlements/?since=x')
+        self.assertEqual(response.status_code, 400)
+
+
+class ReportPdfTests(ThreadedTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.enterContext(override_settings(PDF_CACHE_DIR=tmp.name))
+        user = get_user_model().objects.create_user(username='user')
+        self.group = Group.objects.create(name='Trip', created_by=user)
+        GroupMember.objects.create(group=self.group, user=user)
+
+    def render(self):
+        response = self.client.get(f'/api/groups/{self.group.id}/report/pdf/')
+        self.assertEqual(response.status_code, 202, response.content)
+        job = response.json()
+        self.assertIn(job['status'], ('pending', 'done'))
+        self.assertEqual(response['Location'], job['status_url'])
+        pdf_jobs.get_job(job['job_id']).future.result(timeout=60)
+        return job
+
+    def test_rendered_once_then_served_from_cache(self):
+        job = self.render()
+        status = self.client.get(job['status_url']).json()
+        self.assertEqual(status['status'], 'done')
+
+        response = self.client.get(status['download_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        response.close()
+
+        # A change to the group needs a new render
+        Group.objects.filter(pk=self.group.id).update(version=F('version') + 1)
+        self.assertNotEqual(self.render()['job_id'], job['job_id'])
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get('/api/reports/pdf/jobs/nope/').status_code, 404)
@@ -1,8 +1,8 @@
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt  # ADD THIS
 from .views import (
-    GroupListCreate, AddMemberView, ExpenseListCreate,
-    create_user, get_group_members, group_report, download_report_pdf,
+    GroupListCreate, AddMemberView, add_members_bulk, ExpenseDetail, expenses,
+    create_user, get_group_members, import_expenses, export_expenses, group_report, group_settlements, group_timeseries, group_events, my_balances, batch_group_reports, batch_report_pdfs, download_report_pdf, report_pdf_job, metrics_view, profile_list, profile_detail, profile_pstats,
     user_login, user_register, user_logout
 )
 
@@ -12,9 +12,25 @@ urlpatterns = [
     path('users/create/', csrf_exempt(create_user), name='create-user'),  # WRAP WITH csrf_exempt
     path('groups/<int:group_id>/members/list/', get_group_members, name='group-members'),
     path('groups/<int:group_id>/members/', AddMemberView.as_view(), name='add-member'),
-    path('groups/<int:group_id>/expenses/', ExpenseListCreate.as_view(), name='expense-list'),
+    path('groups/<int:group_id>/members/bulk/', add_members_bulk, name='add-members-bulk'),
+    path('groups/<int:group_id>/expenses/', expenses, name='expense-list'),
+    path('groups/<int:group_id>/expenses/import/', import_expenses, name='expense-import'),
+    path('groups/<int:group_id>/expenses/<int:pk>/', ExpenseDetail.as_view(), name='expense-detail'),
+    path('groups/<int:group_id>/export.csv', export_expenses, {'fmt': 'csv'}, name='export-csv'),
+    path('groups/<int:group_id>/export.jsonl', export_expenses, {'fmt': 'jsonl'}, name='export-jsonl'),
     path('groups/<int:group_id>/report/', group_report, name='group-report'),
+    path('groups/<int:group_id>/settlements/', group_settlements, name='group-settlements'),
+    path('groups/<int:group_id>/timeseries/', group_timeseries, name='group-timeseries'),
+    path('groups/<int:group_id>/events/', group_events, name='group-events'),
     path('groups/<int:group_id>/report/pdf/', download_report_pdf, name='download-report-pdf'),
+    path('me/balances/', my_balances, name='my-balances'),
+    path('reports/batch/', batch_group_reports, name='batch-reports'),
+    path('reports/pdf/batch/', batch_report_pdfs, name='batch-report-pdfs'),
+    path('reports/pdf/jobs/<str:job_id>/', report_pdf_job, name='report-pdf-job'),
+    path('metrics', metrics_view, name='metrics'),
+    path('profiles/', profile_list, name='profile-list'),
+    path('profiles/<str:profile_id>/', profile_detail, name='profile-detail'),
+    path('profiles/<str:profile_id>/pstats', profile_pstats, name='profile-pstats'),
     path('login/', user_login, name='login'),
     path('register/', user_register, name='register'),
     path('logout/', user_logout, name='logout'),
@@ -0,0 +1,103 @@
+"""Validation of expense payment/split lines.
+
+Shared by the expense API and the bulk importer. Membership is checked
+against a set of user ids the caller loads once, so validating an expense
+costs no queries however many lines it has.
+"""
+from decimal import Decimal, InvalidOperation
+
+from .models import GroupMember
+
+# Payments and splits of one expense may differ by at most this much
+TOTALS_TOLERANCE = Decimal('0.01')
+
+# Line amounts are stored with max_digits=10, decimal_places=2
+MAX_AMOUNT = Decimal('99999999.99')
+CENT = Decimal('0.01')
+
+
+class LineError(Exception):
+    """A rejected expense line; ``field`` is the key reported to clients."""
+
+    def __init__(self, field, message):
+        super().__init__(message)
+        self.field = field
+
+
+def group_member_ids(group):
+    return set(GroupMember.objects.filter(group=group).values_list('user_id', flat=True))
+
+
+def _user_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _money(value, field, label):
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise LineError(field, f'{label} must be a number')
+    # NaN and Infinity parse, but can't be stored or summed
+    if not amount.is_finite():
+        raise LineError(field, f'{label} must be a number')
+    if abs(amount) > MAX_AMOUNT:
+        raise LineError(field, f'{label} must be at most {MAX_AMOUNT}')
+    # The column would round sub-cent amounts, but the ledger sums them as sent
+    if amount != amount.quantize(CENT):
+        raise LineError(field, f'{label} must have at most 2 decimal places')
+    return amount.quantize(CENT)
+
+
+def _lines(data, field):
+    lines = data.get(field) or []
+    if not isinstance(lines, list) or not all(isinstance(line, dict) for line in lines):
+        raise LineError(field, f'{field} must be a list of objects')
+    return lines
+
+
+def check_lines(data, member_ids):
+    """Validate the ``payments``/``splits`` of an expense body.
+
+    Returns ``(payments, splits)`` as lists of ``(user_id, Decimal)`` pairs
+    or raises ``LineError``, also for malformed bodies.
+    """
+    payments = []
+    for payment_data in _lines(data, 'payments'):
+        payer_id = _user_id(payment_data.get('payer'))
+        if not payer_id:
+            raise LineError('payments', 'Payer ID is required for each payment')
+        amount = payment_data.get('amount')
+        if amount is None or amount == '':
+            raise LineError('payments', 'Amount is required for each payment')
+        amount = _money(amount, 'payments', 'Amount')
+        if not amount:
+            raise LineError('payments', 'Amount is required for each payment')
+        if payer_id not in member_ids:
+            raise LineError('payer', f'Payer with ID {payer_id} must be a member of the group')
+        payments.append((payer_id, amount))
+
+    splits = []
+    for split_data in _lines(data, 'splits'):
+        member_id = _user_id(split_data.get('member'))
+        if not member_id:
+            raise LineError('splits', 'Member ID is required for each split')
+        share = split_data.get('share')
+        if share is None or share == '':
+            raise LineError('splits', 'Share is required for each split')
+        share = _money(share, 'splits', 'Share')
+        if member_id not in member_ids:
+            raise LineError('member', f'Member with ID {member_id} must be a member of the group')
+        splits.append((member_id, share))
+
+    if payments and splits:
+        paid = sum(amount for _, amount in payments)
+        owed = sum(share for _, share in splits)
+        if abs(paid - owed) > TOTALS_TOLERANCE:
+            raise LineError(
+                'splits', f'Splits add up to {owed} but payments add up to {paid}'
+            )
+
+    return payments, splits
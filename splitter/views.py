@@ -2,19 +2,95 @@ from rest_framework import generics, status, serializers
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from django.contrib.auth import get_user_model, authenticate, login, logout
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, render, redirect
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import HttpResponse, FileResponse, JsonResponse, StreamingHttpResponse
 from .models import Group, GroupMember, Expense, ExpensePayment, ExpenseSplit
+from . import ledger, importers, exports, validation, pdf_jobs, reports, events, metrics, batch, writer, offload, members, group_cache, pdf_batch, plans, profiling
+from .settlement import DEFAULT_SOLVER, SOLVERS
 from .serializers import GroupSerializer, GroupMemberSerializer, ExpenseSerializer
-from decimal import Decimal
+from .pagination import KeysetPagination
+from django.utils.dateparse import parse_date
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.exceptions import NotFound
+from functools import wraps
+import hashlib
 import json
+import logging
+
+logger = logging.getLogger('splitter.views')
 
 User = get_user_model()
 
+
+def group_etag(request, group_id, **kwargs):
+    """Strong ETag from the group's change-version and the exact URL."""
+    version = Group.objects.filter(pk=group_id).values_list('version', flat=True).first()
+    if version is None:
+        return None
+    # The view reads the cached state, which may predate another worker's write
+    group_cache.refresh(group_id, version)
+    # Different query strings are different representations
+    variant = hashlib.sha1(request.get_full_path().encode()).hexdigest()[:12]
+    return f'{group_id}-{version}-{variant}'
+
+
+async def agroup_etag(request, group_id, **kwargs):
+    version = await Group.objects.filter(pk=group_id).values_list('version', flat=True).afirst()
+    if version is None:
+        return None
+    await group_cache.arefresh(group_id, version)
+    variant = hashlib.sha1(request.get_full_path().encode()).hexdigest()[:12]
+    return f'{group_id}-{version}-{variant}'
+
+
+def group_conditional(view):
+    """Answer If-None-Match with 304 before the view touches any expense data."""
+    if iscoroutinefunction(view):
+        view = async_condition(view)
+    else:
+        view = condition(etag_func=group_etag)(view)
+    return cache_control(private=True, no_cache=True)(view)
+
+
+def async_condition(view):
+    # condition() calls its etag_func synchronously, which can't query the
+    # database from an async view
+    @wraps(view)
+    async def inner(request, group_id, **kwargs):
+        etag = await agroup_etag(request, group_id)
+        etag = quote_etag(etag) if etag is not None else None
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = await view(request, group_id, **kwargs)
+        # Errors aren't the representation the ETag stands for
+        if etag and request.method in ('GET', 'HEAD') and response.status_code == 200:
+            response.headers.setdefault('ETag', etag)
+        return response
+    return inner
+
+
+def json_response(data, status=200, headers=None):
+    """JSON response of an async view, rendered exactly like the DRF views."""
+    return HttpResponse(
+        JSONRenderer().render(data), status=status, headers=headers, content_type='application/json'
+    )
+
+
 @csrf_exempt
 @api_view(['POST'])
 def create_user(request):
@@ -26,16 +102,16 @@ def create_user(request):
     if not username:
         return Response({'error': 'username is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-    try:
-        user = User.objects.get(username=username)
-        created = False
-    except User.DoesNotExist:
-        user = User.objects.create_user(
-            username=username,
-            email=email or f'{username}@example.com',
-            password=password
+    user = User.objects.filter(username=username).first()
+    if user is None:
+        # Hash outside the write queue; it is the slow part of creating a user
+        defaults = {
+            'email': User.objects.normalize_email(email or f'{username}@example.com'),
+            'password': make_password(password),
+        }
+        user, created = writer.run(
+            lambda: User.objects.get_or_create(username=username, defaults=defaults)
         )
-        created = True
 
     return Response({'id': user.id, 'username': user.username, 'email': user.email})
 
@@ -59,10 +135,12 @@ class GroupListCreate(generics.ListCreateAPIView):
             group = serializer.save(created_by=default_user)
             # Add creator as member
             GroupMember.objects.get_or_create(group=group, user=default_user)
+            ledger.ensure_member(group.id, default_user.id)
         else:
             group = serializer.save()
             # Add creator as member
             GroupMember.objects.get_or_create(group=group, user=created_by)
+            ledger.ensure_member(group.id, created_by.id)
 
 class AddMemberView(generics.GenericAPIView):
     serializer_class = GroupMemberSerializer
@@ -72,9 +150,7 @@ class AddMemberView(generics.GenericAPIView):
         return super().dispatch(*args, **kwargs)
 
     def post(self, request, group_id):
-        print(f"AddMemberView called with group_id={group_id}")
-        print(f"Request data: {request.data}")
-        
+        logger.debug('Adding member to group %s: %s', group_id, request.data)
         group = get_object_or_404(Group, pk=group_id)
         user_id = request.data.get('user_id')
 
@@ -85,407 +161,518 @@ class AddMemberView(generics.GenericAPIView):
             )
 
         user = get_object_or_404(User, pk=user_id)
-        gm, created = GroupMember.objects.get_or_create(group=group, user=user)
+
+        def add():
+            gm, created = GroupMember.objects.get_or_create(group=group, user=user)
+            if created:
+                ledger.ensure_member(group.id, user.id)
+            return gm, created
+
+        gm, created = writer.run(add)
         return Response({'id': gm.id, 'created': created}, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
+@csrf_exempt
+@api_view(['POST'])
+def add_members_bulk(request, group_id):
+    """Get or create many users and add them all to the group in one go."""
+    group = get_object_or_404(Group, pk=group_id)
+    entries = request.data.get('members') if isinstance(request.data, dict) else None
+    if isinstance(entries, list) and len(entries) > settings.GROUP_MEMBERS_BULK_MAX:
+        return Response(
+            {'error': f'At most {settings.GROUP_MEMBERS_BULK_MAX} members per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        entries = members.parse_entries(entries)
+    except members.EntryError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    results = writer.run(lambda: members.add_members(group, entries))
+    added = sum(r['member_created'] for r in results)
+    return Response({
+        'members': results,
+        'users_created': sum(r['user_created'] for r in results),
+        'members_added': added,
+    }, status=status.HTTP_201_CREATED if added else status.HTTP_200_OK)
+
 class ExpenseListCreate(generics.ListCreateAPIView):
     serializer_class = ExpenseSerializer
+    pagination_class = KeysetPagination
 
     @csrf_exempt
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
+    def get_serializer(self, *args, **kwargs):
+        fields = requested_fields(self.request)
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
     def get_queryset(self):
-        group_id = self.kwargs['group_id']
-        return Expense.objects.filter(group_id=group_id)
+        return expense_queryset(self.kwargs['group_id'], requested_fields(self.request))
 
     def perform_create(self, serializer):
         group_id = self.kwargs['group_id']
         group = get_object_or_404(Group, pk=group_id)
 
-        # Handle multiple payments
-        payments_data = self.request.data.get('payments', [])
-        if payments_data:
-            for payment_data in payments_data:
-                payer_id = payment_data.get('payer')
-                amount = Decimal(payment_data.get('amount'))
-
-                if not payer_id:
-                    raise serializers.ValidationError({'payments': 'Payer ID is required for each payment'})
-                if not amount:
-                    raise serializers.ValidationError({'payments': 'Amount is required for each payment'})
-
-                if not GroupMember.objects.filter(group=group, user_id=payer_id).exists():
-                    raise serializers.ValidationError(
-                        {'payer': f'Payer with ID {payer_id} must be a member of the group'}
-                    )
-
-        # Handle splits
-        splits_data = self.request.data.get('splits', [])
-        if splits_data:
-            for split_data in splits_data:
-                member_id = split_data.get('member')
-                share = split_data.get('share')
-
-                if not member_id:
-                    raise serializers.ValidationError({'splits': 'Member ID is required for each split'})
-                if share is None or share == '':
-                    raise serializers.ValidationError({'splits': 'Share is required for each split'})
-
-                if not GroupMember.objects.filter(group=group, user_id=member_id).exists():
-                    raise serializers.ValidationError(
-                        {'member': f'Member with ID {member_id} must be a member of the group'}
-                    )
-
-        expense = serializer.save(group=group)
-
-        # Create Payment objects
-        for payment_data in payments_data:
-            payer_id = payment_data.get('payer')
-            amount = Decimal(payment_data.get('amount'))
-            ExpensePayment.objects.create(expense=expense, payer_id=payer_id, amount=amount)
-
-        # Create Split objects
-        for split_data in splits_data:
-            member_id = split_data.get('member')
-            share = Decimal(split_data.get('share'))
-            ExpenseSplit.objects.create(expense=expense, member_id=member_id, share=share)
+        def create():
+            payments, splits = validate_expense_lines(group, self.request.data)
+            expense = serializer.save(group=group, **ledger.line_totals(payments, splits))
+            create_expense_lines(expense, payments, splits)
+            return expense
+
+        expense = writer.run(create)
+        # Load the lines back for the response in a fixed number of queries
+        prefetch_related_objects([expense], 'payments__payer', 'splits__member')
+
+
+def requested_fields(request):
+    """Fields picked with ``?fields=a,b`` on listings, or None for all."""
+    if request.method != 'GET' or not request.GET.get('fields'):
+        return None
+    return [f.strip() for f in request.GET['fields'].split(',') if f.strip()]
+
+
+def expense_queryset(group_id, fields=None):
+    queryset = Expense.objects.filter(group_id=group_id)
+
+    # Only load the lines the response will actually render
+    if fields is None or 'payments' in fields:
+        queryset = queryset.prefetch_related(
+            Prefetch('payments', queryset=ExpensePayment.objects.select_related('payer'))
+        )
+    if fields is None or 'splits' in fields:
+        queryset = queryset.prefetch_related(
+            Prefetch('splits', queryset=ExpenseSplit.objects.select_related('member'))
+        )
+    return queryset
+
+
+@group_conditional
+async def expense_list(request, group_id):
+    """One keyset page of a group's expenses (GET of ``expenses/``)."""
+    request = Request(request)
+    fields = requested_fields(request)
+    if fields is not None:
+        # A typo would otherwise narrow every expense down to {}
+        allowed = list(ExpenseSerializer().fields)
+        unknown = [name for name in fields if name not in allowed]
+        if unknown:
+            return json_response(
+                {'error': f'Unknown fields: {", ".join(unknown)}', 'allowed_fields': allowed}, status=400
+            )
+    paginator = KeysetPagination()
+    try:
+        page = await paginator.apaginate_queryset(expense_queryset(group_id, fields), request)
+    except NotFound as exc:
+        return json_response({'detail': exc.detail}, status=exc.status_code)
+    kwargs = {'fields': fields} if fields is not None else {}
+    serializer = ExpenseSerializer(page, many=True, context={'request': request}, **kwargs)
+    # Serializing a page of expenses with their lines is the CPU-heavy part
+    data = await offload.run(lambda: serializer.data)
+    return json_response(paginator.get_paginated_data(data))
+
+
+_expense_create = ExpenseListCreate.as_view()
+
+
+@csrf_exempt
+async def expenses(request, group_id):
+    # Listing is async; creating stays on DRF and goes through the write queue
+    if request.method in ('GET', 'HEAD'):
+        return await expense_list(request, group_id)
+    return await sync_to_async(_expense_create)(request, group_id=group_id)
+
+
+class ExpenseDetail(generics.RetrieveUpdateDestroyAPIView):
+    serializer_class = ExpenseSerializer
+
+    @csrf_exempt
+    def dispatch(self, *args, **kwargs):
+        return super().dispatch(*args, **kwargs)
+
+    def get_queryset(self):
+        group_id = self.kwargs['group_id']
+        return Expense.objects.filter(group_id=group_id)
+
+    def perform_update(self, serializer):
+        expense = serializer.instance
+        replace_lines = 'payments' in self.request.data or 'splits' in self.request.data
+        totals = {}
+        if replace_lines:
+            payments, splits = validate_expense_lines(expense.group, self.request.data)
+            totals = ledger.line_totals(payments, splits)
+
+        with transaction.atomic():
+            expense = serializer.save(**totals)
+            if replace_lines:
+                # Take the old lines out of the ledger before swapping them
+                ledger.apply_expense(expense, sign=-1)
+                expense.payments.all().delete()
+                expense.splits.all().delete()
+                create_expense_lines(expense, payments, splits)
+
+    def perform_destroy(self, instance):
+        # The pre_delete signal reverses the expense's ledger entries
+        with transaction.atomic():
+            instance.delete()
+
+
+def validate_expense_lines(group, data):
+    """Validate the payments/splits of an expense request against the group."""
+    # One membership lookup covers every line of the expense
+    try:
+        return validation.check_lines(data, validation.group_member_ids(group))
+    except validation.LineError as exc:
+        raise serializers.ValidationError({exc.field: str(exc)})
+
+
+def create_expense_lines(expense, payments, splits):
+    """Store the lines of an expense and post them to the balance ledger."""
+    ExpensePayment.objects.bulk_create([
+        ExpensePayment(expense=expense, payer_id=payer_id, amount=amount)
+        for payer_id, amount in payments
+    ])
+    ExpenseSplit.objects.bulk_create([
+        ExpenseSplit(expense=expense, member_id=member_id, share=share)
+        for member_id, share in splits
+    ])
+    ledger.apply_lines(expense.group_id, payments, splits, ledger.expense_day(expense))
+
+
+def body_lines(request):
+    """The raw body of a Django request, line by line.
+
+    Django reads only ``Content-Length`` bytes of a WSGI body, so a chunked
+    upload would come through empty; servers that de-chunk it say so with
+    ``wsgi.input_terminated`` and the input is read to its end instead.
+    """
+    environ = getattr(request, 'environ', {})
+    if not environ.get('CONTENT_LENGTH') and environ.get('wsgi.input_terminated'):
+        return iter(environ['wsgi.input'].readline, b'')
+    return request
+
+
+@csrf_exempt
+@api_view(['POST'])
+def import_expenses(request, group_id):
+    group = get_object_or_404(Group, pk=group_id)
+
+    content_type = request.content_type.split(';')[0].strip().lower()
+    reader = importers.FORMATS.get(content_type)
+    if reader is None:
+        return Response(
+            {'error': f'Unsupported content type {content_type!r}, send text/csv or application/x-ndjson'},
+            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+
+    try:
+        chunk_size = int(request.GET.get('chunk_size', settings.EXPENSE_IMPORT_CHUNK_SIZE))
+    except ValueError:
+        chunk_size = 0
+    if chunk_size < 1:
+        return Response({'error': 'chunk_size must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Read the raw body line by line; request.data would buffer all of it
+    report = importers.import_expenses(group, reader(body_lines(request._request)), chunk_size=chunk_size)
+    if not report['imported'] and not report['error_count']:
+        return Response({'error': 'The request body has no expenses'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(report, status=status.HTTP_201_CREATED if report['imported'] else status.HTTP_200_OK)
+
+
+@require_GET
+@group_conditional
+async def get_group_members(request, group_id):
+    state = await group_cache.aget_state(group_id)
+    if state is None:
+        return json_response({'error': 'Group not found'}, status=404)
+    return json_response(reports.state_members(state))
+
+@require_GET
+async def download_report_pdf(request, group_id):
+    try:
+        group = await Group.objects.aget(pk=group_id)
+    except Group.DoesNotExist:
+        return HttpResponse('Group not found', status=404)
+
+    solver = request.GET.get('solver', DEFAULT_SOLVER)
+    if solver not in SOLVERS:
+        return HttpResponse(f'Unknown solver: {solver}', status=400)
+
+    if not await GroupMember.objects.filter(group=group).aexists():
+        return HttpResponse('No members in this group', status=400)
+
+    try:
+        start = parse_date(request.GET['from']) if request.GET.get('from') else None
+        end = parse_date(request.GET['to']) if request.GET.get('to') else None
+    except ValueError:
+        start = end = None
+    if (request.GET.get('from') and start is None) or (request.GET.get('to') and end is None):
+        return HttpResponse('from/to must be dates in YYYY-MM-DD format', status=400)
+
+    filename = f'settlement_report_{group.name}.pdf'
+    if start or end:
+        # Period reports are one-off, so they are rendered inline rather
+        # than cached
+        spool, used = await offload.run(pdf_jobs.render_period, group.id, solver, start, end)
+        response = FileResponse(
+            spool, as_attachment=True, filename=filename, content_type='application/pdf'
+        )
+        response['X-Settlement-Solver'] = used
+        return response
+
+    # Unchanged groups are served straight from the rendered-PDF cache
+    path = pdf_jobs.cached_report(group.id, group.version, solver)
+    if path is not None:
+        response = FileResponse(
+            open(path, 'rb'), as_attachment=True, filename=filename, content_type='application/pdf'
+        )
+        response['X-Settlement-Solver'] = pdf_jobs.solver_of(path)
+        return response
+
+    job = pdf_jobs.submit(group.id, group.version, solver)
+    return json_response(job.as_dict(), status=status.HTTP_202_ACCEPTED, headers={'Location': job.status_url()})
 
+@csrf_exempt
+@group_conditional
+@api_view(['GET'])
+def export_expenses(request, group_id, fmt):
+    group = get_object_or_404(Group, pk=group_id)
+    stream, content_type = exports.FORMATS[fmt]
+    response = StreamingHttpResponse(stream(group), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="expenses_{group.id}.{fmt}"'
+    return response
 
 @csrf_exempt
 @api_view(['GET'])
-def get_group_members(request, group_id):
+def report_pdf_job(request, job_id):
+    job = pdf_jobs.get_job(job_id)
+    if job is None:
+        return Response({'error': 'Job not found'}, status=404)
+    return Response(job.as_dict())
+
+@require_GET
+@group_conditional
+async def group_report(request, group_id):
+    state = await group_cache.aget_state(group_id)
+    if state is None:
+        return json_response({'error': 'Group not found'}, status=404)
+
+    solver = request.GET.get('solver', DEFAULT_SOLVER)
+    if solver not in SOLVERS:
+        return json_response({'error': f'Unknown solver: {solver}'}, status=400)
+
+    as_of = None
+    if request.GET.get('as_of'):
+        try:
+            as_of = parse_date(request.GET['as_of'])
+        except ValueError:
+            pass
+        if as_of is None:
+            return json_response({'error': 'as_of must be a date in YYYY-MM-DD format'}, status=400)
+
+    if as_of is None:
+        return json_response(await reports.astate_report(state, solver))
+
     try:
-        group = Group.objects.get(pk=group_id)
+        group = await Group.objects.aget(pk=group_id)
     except Group.DoesNotExist:
+        return json_response({'error': 'Group not found'}, status=404)
+    data = await reports.acached(
+        'group-report', group, lambda: reports.abuild_group_report(group, solver, as_of=as_of),
+        solver, as_of
+    )
+    return json_response(data)
+
+
+@csrf_exempt
+@group_conditional
+@api_view(['GET'])
+def group_settlements(request, group_id):
+    """The group's stored settlement plan, or with ?since= only the transfers added and removed after that version."""
+    state = group_cache.get_state(group_id)
+    if state is None:
         return Response({'error': 'Group not found'}, status=404)
 
-    members = GroupMember.objects.filter(group=group).select_related('user')
-    return Response([{
-        'id': m.user.id,
-        'username': m.user.username,
-        'email': m.user.email
-    } for m in members])
-
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
-from django.http import HttpResponse
-from io import BytesIO
+    solver = request.GET.get('solver', DEFAULT_SOLVER)
+    if solver not in SOLVERS:
+        return Response({'error': f'Unknown solver: {solver}'}, status=400)
+
+    since = request.GET.get('since')
+    if since is not None:
+        if not since.isdigit():
+            return Response({'error': 'since must be a version number'}, status=400)
+        since = int(since)
+
+    return Response(plans.changes(state, solver, since))
+
 
 @csrf_exempt
+@group_conditional
 @api_view(['GET'])
-def download_report_pdf(request, group_id):
+def group_timeseries(request, group_id):
     try:
         group = Group.objects.get(pk=group_id)
     except Group.DoesNotExist:
-        return HttpResponse('Group not found', status=404)
-
-    members_qs = GroupMember.objects.filter(group=group).select_related('user')
-    members = list(members_qs)
+        return Response({'error': 'Group not found'}, status=404)
 
-    if not members:
-        return HttpResponse('No members in this group', status=400)
+    interval = request.GET.get('interval', 'day')
+    if interval not in reports.TIMESERIES_INTERVALS:
+        return Response({'error': 'interval must be day, week or month'}, status=400)
 
-    member_ids = [m.user.id for m in members]
-    expenses = Expense.objects.filter(group=group).prefetch_related('payments', 'splits')
-
-    paid_by = {}
-    owes = {}
-    for m in members:
-        paid_by[m.user.id] = Decimal('0.00')
-        owes[m.user.id] = Decimal('0.00')
-
-    # Calculate what each person paid
-    for exp in expenses:
-        for payment in exp.payments.all():
-            paid_by[payment.payer.id] += payment.amount
-
-    # Calculate what each person owes
-    for exp in expenses:
-        for split in exp.splits.all():
-            owes[split.member.id] += split.share
-
-    # Calculate net balance
-    net_balance = {}
-    for m in members:
-        net = paid_by[m.user.id] - owes[m.user.id]
-        net_balance[m.user.id] = net
-
-    creditors = []
-    debtors = []
-    for uid, net in net_balance.items():
-        if net > Decimal('0.01'):
-            creditors.append({'user_id': uid, 'amount': net})
-        elif net < Decimal('-0.01'):
-            debtors.append({'user_id': uid, 'amount': -net})
-
-    creditors.sort(key=lambda x: x['amount'], reverse=True)
-    debtors.sort(key=lambda x: x['amount'], reverse=True)
-
-    settlements = []
-    i, j = 0, 0
-    while i < len(creditors) and j < len(debtors):
-        cred = creditors[i]
-        debt = debtors[j]
-        settle_amount = min(cred['amount'], debt['amount'])
-
-        settlements.append({
-            'from_user': debt['user_id'],
-            'to_user': cred['user_id'],
-            'amount': float(settle_amount)
-        })
-
-        cred['amount'] -= settle_amount
-        debt['amount'] -= settle_amount
-
-        if cred['amount'] < Decimal('0.01'):
-            i += 1
-        if debt['amount'] < Decimal('0.01'):
-            j += 1
-
-    user_id_to_name = {}
-    for m in members:
-        user_id_to_name[m.user.id] = m.user.username
-
-    # Create PDF
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.75*inch, bottomMargin=0.75*inch)
-    elements = []
-
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#667eea'),
-        spaceAfter=30,
-        alignment=TA_CENTER
+    try:
+        start = parse_date(request.GET['from']) if request.GET.get('from') else None
+        end = parse_date(request.GET['to']) if request.GET.get('to') else None
+    except ValueError:
+        start = end = None
+    if (request.GET.get('from') and start is None) or (request.GET.get('to') and end is None):
+        return Response({'error': 'from/to must be dates in YYYY-MM-DD format'}, status=400)
+
+    data = reports.cached(
+        'group-timeseries', group,
+        lambda: reports.build_group_timeseries(group, start, end, interval),
+        start, end, interval
     )
+    return Response(data)
 
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=16,
-        textColor=colors.HexColor('#333333'),
-        spaceAfter=12,
-        spaceBefore=20
+@csrf_exempt
+@api_view(['POST'])
+def batch_group_reports(request):
+    """Settlement reports of many groups, streamed as one JSON object per line."""
+    data = request.data
+    solver = data.get('solver', DEFAULT_SOLVER)
+    if solver not in SOLVERS:
+        return Response({'error': f'Unknown solver: {solver}'}, status=400)
+
+    group_ids, error = batch_group_ids(data)
+    if error is not None:
+        return error
+
+    reports_stream = batch.iter_reports(group_ids, solver, parallel=bool(data.get('parallel')))
+    return StreamingHttpResponse(
+        (json.dumps(report) + '\n' for report in reports_stream),
+        content_type='application/x-ndjson'
     )
 
-    # Title
-    title = Paragraph(f"Settlement Report: {group.name}", title_style)
-    elements.append(title)
-    elements.append(Spacer(1, 0.3*inch))
-
-    # Member Balances Section
-    balances_heading = Paragraph("Member Balances", heading_style)
-    elements.append(balances_heading)
-
-    balance_data = [['Member', 'Balance']]
-    for m in members:
-        balance = float(net_balance[m.user.id])
-        balance_str = f"${balance:+.2f}" if balance != 0 else "$0.00"
-        balance_data.append([m.user.username, balance_str])
-
-    balance_table = Table(balance_data, colWidths=[3*inch, 2*inch])
-    balance_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f5f5f5')])
-    ]))
-    elements.append(balance_table)
-    elements.append(Spacer(1, 0.4*inch))
-
-    # Settlements Section
-    settlements_heading = Paragraph("Settlements Needed", heading_style)
-    elements.append(settlements_heading)
-
-    if settlements:
-        settlement_data = [['From', 'To', 'Amount']]
-        for s in settlements:
-            from_user = user_id_to_name.get(s['from_user'], 'Unknown')
-            to_user = user_id_to_name.get(s['to_user'], 'Unknown')
-            settlement_data.append([from_user, to_user, f"${s['amount']:.2f}"])
-
-        settlement_table = Table(settlement_data, colWidths=[2*inch, 2*inch, 1.5*inch])
-        settlement_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f5f5f5')])
-        ]))
-        elements.append(settlement_table)
-    else:
-        all_settled = Paragraph("All settled up! 🎉", styles['Normal'])
-        elements.append(all_settled)
+def batch_group_ids(data):
+    """Group ids of a batch request body, as ``(group_ids, None)`` or ``(None, error response)``."""
+    if ('group_ids' in data) == ('filter' in data):
+        return None, Response({'error': 'Send either group_ids or filter'}, status=status.HTTP_400_BAD_REQUEST)
+    if 'group_ids' in data:
+        try:
+            # Keep the requested order, without repeats
+            return list(dict.fromkeys(int(group_id) for group_id in data['group_ids'])), None
+        except (TypeError, ValueError):
+            return None, Response({'error': 'group_ids must be a list of integers'}, status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(data['filter'], dict):
+        return None, Response({'error': 'filter must be an object'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return batch.filtered_group_ids(data['filter']), None
+    except (TypeError, ValueError) as exc:
+        return None, Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+@csrf_exempt
+@api_view(['POST'])
+def batch_report_pdfs(request):
+    """Settlement PDFs of many groups, rendered on a process pool and streamed as one ZIP."""
+    data = request.data
+    solver = data.get('solver', DEFAULT_SOLVER)
+    if solver not in SOLVERS:
+        return Response({'error': f'Unknown solver: {solver}'}, status=400)
+
+    group_ids, error = batch_group_ids(data)
+    if error is not None:
+        return error
+    return pdf_batch.zip_response(group_ids, solver)
 
-    elements.append(Spacer(1, 0.4*inch))
+@csrf_exempt
+@api_view(['GET'])
+def my_balances(request):
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
 
-    # Expense History Section
-    expense_history_heading = Paragraph("Expense History", heading_style)
-    elements.append(expense_history_heading)
+    solver = request.GET.get('solver', DEFAULT_SOLVER)
+    if solver not in SOLVERS:
+        return Response({'error': f'Unknown solver: {solver}'}, status=400)
 
-    if expenses:
-        expense_data = [['Description', 'Total', 'Paid By', 'Split Among']]
-        for exp in expenses:
-            # Calculate total expense from splits
-            total_exp = sum(split.share for split in exp.splits.all())
-            
-            # Get payers info
-            payers_info = []
-            for payment in exp.payments.all():
-                payer_name = user_id_to_name.get(payment.payer.id, 'Unknown')
-                payers_info.append(f"{payer_name} (${payment.amount:.2f})")
-            payers_str = ', '.join(payers_info) if payers_info else 'N/A'
-            
-            # Get split members info
-            split_members = []
-            for split in exp.splits.all():
-                member_name = user_id_to_name.get(split.member.id, 'Unknown')
-                split_members.append(f"{member_name} (${split.share:.2f})")
-            splits_str = ', '.join(split_members) if split_members else 'N/A'
-            
-            expense_data.append([
-                exp.description or 'No description',
-                f"${total_exp:.2f}",
-                payers_str,
-                splits_str
-            ])
-
-        expense_table = Table(expense_data, colWidths=[1.8*inch, 0.8*inch, 1.8*inch, 1.8*inch])
-        expense_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f5f5f5')]),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP')
-        ]))
-        elements.append(expense_table)
-    else:
-        no_expenses = Paragraph("No expenses recorded yet.", styles['Normal'])
-        elements.append(no_expenses)
+    return Response(reports.build_user_balances(request.user, solver))
 
-    doc.build(elements)
-    buffer.seek(0)
+@require_GET
+async def group_events(request, group_id):
+    """Server-sent balance updates of a group (see ``splitter.events``)."""
+    if not await Group.objects.filter(pk=group_id).aexists():
+        return JsonResponse({'error': 'Group not found'}, status=404)
 
-    response = HttpResponse(buffer, content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="settlement_report_{group.name}.pdf"'
+    try:
+        last_version = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_version = None
+
+    if isinstance(request, ASGIRequest):
+        stream = events.stream(group_id, last_version)
+    else:
+        # WSGI servers buffer async streams whole, so answer like a long poll
+        stream = events.stream(
+            group_id, last_version, duration=settings.GROUP_EVENTS_LONG_POLL, once=True
+        )
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
     return response
 
 @csrf_exempt
 @api_view(['GET'])
-def group_report(request, group_id):
+def profile_list(request):
+    """Profiles this process kept of requests made with ?_profile=, newest first."""
+    if not profiling.is_staff(request):
+        return Response({'error': 'Staff only'}, status=status.HTTP_403_FORBIDDEN)
+    return Response({'profiles': [profile.as_dict() for profile in profiling.store.list()]})
+
+def _staff_profile(request, profile_id):
+    if not profiling.is_staff(request):
+        return None, Response({'error': 'Staff only'}, status=status.HTTP_403_FORBIDDEN)
+    profile = profiling.store.get(profile_id)
+    if profile is None:
+        return None, Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+    return profile, None
+
+@csrf_exempt
+@api_view(['GET'])
+def profile_detail(request, profile_id):
+    profile, error = _staff_profile(request, profile_id)
+    if error:
+        return error
+    sort = request.GET.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime'):
+        return Response({'error': 'sort must be cumulative or tottime'}, status=400)
     try:
-        group = Group.objects.get(pk=group_id)
-    except Group.DoesNotExist:
-        return Response({'error': 'Group not found'}, status=404)
+        limit = int(request.GET.get('limit', 30))
+    except ValueError:
+        return Response({'error': 'limit must be a number'}, status=400)
+    data = profile.as_dict()
+    data['functions'] = profile.top(limit, sort)
+    data['sql'] = [{'ms': round(elapsed * 1000, 3), 'sql': sql} for elapsed, sql in profile.statements]
+    data['pstats_url'] = f'/api/profiles/{profile.id}/pstats'
+    return Response(data)
 
-    members_qs = GroupMember.objects.filter(group=group).select_related('user')
-    members = list(members_qs)
-    if not members:
-        return Response({
-            'group': group.name,
-            'members': [],
-            'balances': {},
-            'settlements': []
-        })
-
-    member_ids = [m.user.id for m in members]
-    expenses = Expense.objects.filter(group=group).prefetch_related('payments', 'splits')
-
-    paid_by = {}
-    owes = {}
-    for m in members:
-        paid_by[m.user.id] = Decimal('0.00')
-        owes[m.user.id] = Decimal('0.00')
-
-    # Calculate what each person paid
-    for exp in expenses:
-        for payment in exp.payments.all():
-            paid_by[payment.payer.id] += payment.amount
-
-    # Calculate what each person owes
-    for exp in expenses:
-        for split in exp.splits.all():
-            owes[split.member.id] += split.share
-
-    # Calculate net balance
-    net_balance = {}
-    for m in members:
-        net = paid_by[m.user.id] - owes[m.user.id]
-        net_balance[m.user.id] = net
-
-    creditors = []
-    debtors = []
-    for uid, net in net_balance.items():
-        if net > Decimal('0.01'):
-            creditors.append({'user_id': uid, 'amount': net})
-        elif net < Decimal('-0.01'):
-            debtors.append({'user_id': uid, 'amount': -net})
-
-    creditors.sort(key=lambda x: x['amount'], reverse=True)
-    debtors.sort(key=lambda x: x['amount'], reverse=True)
-
-    settlements = []
-    i, j = 0, 0
-    while i < len(creditors) and j < len(debtors):
-        cred = creditors[i]
-        debt = debtors[j]
-        settle_amount = min(cred['amount'], debt['amount'])
-
-        settlements.append({
-            'from_user': debt['user_id'],
-            'to_user': cred['user_id'],
-            'amount': float(settle_amount)
-        })
-
-        cred['amount'] -= settle_amount
-        debt['amount'] -= settle_amount
-
-        if cred['amount'] < Decimal('0.01'):
-            i += 1
-        if debt['amount'] < Decimal('0.01'):
-            j += 1
-
-    balances_display = {}
-    members_info = []
-    for m in members:
-        balances_display[m.user.username] = float(net_balance[m.user.id])
-        members_info.append({
-            'id': m.user.id,
-            'username': m.user.username,
-            'balance': float(net_balance[m.user.id])
-        })
+@csrf_exempt
+@api_view(['GET'])
+def profile_pstats(request, profile_id):
+    """The profile as a .pstats file, for pstats, snakeviz or flameprof."""
+    profile, error = _staff_profile(request, profile_id)
+    if error:
+        return error
+    response = HttpResponse(profile.data, content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="profile-{profile.id}.pstats"'
+    return response
 
-    return Response({
-        'group': group.name,
-        'members': members_info,
-        'balances': balances_display,
-        'settlements': settlements
-    })
+@require_GET
+def metrics_view(request):
+    """Request, SQL and PDF render metrics in Prometheus text format."""
+    return HttpResponse(
+        metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
 
 def user_login(request):
     next_url = request.POST.get('next') or request.GET.get('next', '')
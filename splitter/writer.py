@@ -0,0 +1,152 @@
+"""Single-writer queue for the hot write endpoints.
+
+SQLite allows one writer at a time, so request threads that write at once
+mostly wait on each other's locks. ``run(fn)`` hands ``fn`` to one writer
+thread instead and waits for its result. The writer takes every job that is
+queued (up to ``SQLITE_WRITE_BATCH_SIZE``) and runs them in one transaction,
+each in its own savepoint, so a burst of small writes costs one commit and a
+job that raises only rolls back itself. Its exception is re-raised in the
+caller. Reads never go through the queue.
+
+The queue is per process; writers in other processes are still serialised
+by the busy timeout. It is bypassed (``fn`` runs inline in a transaction)
+when ``SQLITE_WRITE_QUEUE`` is off, the database isn't a SQLite file, or the
+caller is already inside a transaction.
+
+``defer(fn)`` queues a write without waiting for it, for reads that leave
+something behind to store (see ``splitter.plans``): the read never waits
+on the queue.
+"""
+import contextvars
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger('splitter.writer')
+
+
+class WriteQueue:
+    def __init__(self):
+        self._jobs = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.jobs = 0
+
+    def submit(self, fn):
+        """Queue ``fn`` and return a Future of its result."""
+        future = Future()
+        # Run in the caller's context so per-request metrics see the SQL
+        self._jobs.put((future, contextvars.copy_context(), fn))
+        self._start()
+        return future
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='splitter-writer', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Let the writer finish the queued jobs, close its connection and exit."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._jobs.put(None)
+            thread.join()
+
+    def _loop(self):
+        while True:
+            job = self._jobs.get()
+            batch = []
+            while job is not None:
+                batch.append(job)
+                if len(batch) == settings.SQLITE_WRITE_BATCH_SIZE:
+                    break
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._run_batch(batch)
+            if job is None:
+                connection.close()
+                return
+
+    def _run_batch(self, batch):
+        results = []
+        try:
+            with transaction.atomic():
+                for future, context, fn in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction.atomic():
+                            results.append((future, context.run(fn), None))
+                    except Exception as exc:
+                        results.append((future, None, exc))
+        except Exception as exc:
+            # The commit itself failed, so nothing in the batch was written
+            for future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            connection.close_if_unusable_or_obsolete()
+            return
+        self.batches += 1
+        self.jobs += len(results)
+        for future, result, exc in results:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+
+_queue = WriteQueue()
+
+
+def get_queue():
+    return _queue
+
+
+def enabled():
+    return (
+        settings.SQLITE_WRITE_QUEUE
+        and connection.vendor == 'sqlite'
+        and not connection.is_in_memory_db()
+        and not connection.in_atomic_block
+    )
+
+
+def run(fn):
+    """Run ``fn`` (which writes) in a transaction and return its result.
+
+    Goes through the writer thread when the queue is enabled.
+    """
+    if not enabled():
+        with transaction.atomic():
+            return fn()
+    return _queue.submit(fn).result()
+
+
+def defer(fn):
+    """Queue ``fn`` (which writes) without waiting for it.
+
+    Failures are logged rather than raised. Without the queue ``fn`` runs
+    inline, like ``run()``.
+    """
+    if not enabled():
+        try:
+            run(fn)
+        except Exception:
+            logger.exception('Deferred write failed')
+        return
+    _queue.submit(fn).add_done_callback(_log_failure)
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error('Deferred write failed', exc_info=future.exception())